@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 
 import os
-import pkg_resources as p
 import click
 
 # CLI tree
@@ -23,11 +22,15 @@ import click
 #     cpac group isc
 #         cpac group isc <pipeline config>
 # cpac utils
+#     cpac utils profile <callback log>
 #     cpac utils data_config
 #         cpac utils data_config new_template
 #         cpac utils data_config build <data settings file>
 #     cpac utils pipe_config
 #         cpac utils pipe_config new_template
+#
+# Every command imports what it runs: loading this module only imports click,
+# so short invocations (cpac version, cpac utils ...) start fast.
 
 
 @click.group()
@@ -53,8 +56,11 @@ def gui():
 @click.option('--num_cores')
 @click.option('--ndmg_mode', is_flag=True)
 @click.option('--debug', is_flag=True)
+@click.option('--bids_index')
 def run(data_config, pipe_config=None, num_cores=None, ndmg_mode=False,
-        debug=False):
+        debug=False, bids_index=None):
+    import pkg_resources as p
+
     if not pipe_config:
         pipe_config = \
             p.resource_filename("CPAC",
@@ -124,7 +130,7 @@ def run(data_config, pipe_config=None, num_cores=None, ndmg_mode=False,
 
     import CPAC.pipeline.cpac_runner as cpac_runner
     cpac_runner.run(data_config, pipe_config, num_subs_at_once=num_cores,
-                    debug=debug)
+                    debug=debug, bids_index=bids_index)
 
 
 # Group analysis
@@ -319,6 +325,34 @@ def crash(crash_file):
         from nipype.scripts.crash_files import display_crash_file
         display_crash_file(crash_file, False, False, None)
 
+@utils.command()
+@click.argument('callback_log')
+@click.option('--output', '-o', default=None,
+              help='HTML report to write, with a Gantt chart of the nodes')
+@click.option('--top', default=10)
+def profile(callback_log, output=None, top=10):
+    from CPAC.utils.callback_profile import (profile_callback_log,
+                                             html_report)
+    run_profile = profile_callback_log(callback_log)
+    runs = run_profile['runs']
+    times = run_profile['times']
+
+    print('{0} nodes, run time {1:.0f} s'.format(len(runs),
+                                                 run_profile['duration']))
+    print('\nCritical path (self / wait, in seconds):')
+    for node_id in run_profile['critical_path']:
+        print('  {0:8.1f} {1:8.1f}  {2}'.format(
+            times[node_id]['self'], times[node_id]['wait'], node_id))
+    print('\nLongest waits for resources (in seconds):')
+    for node_id in sorted(runs, key=lambda node: -times[node]['wait'])[:top]:
+        print('  {0:8.1f}  {1}'.format(times[node_id]['wait'], node_id))
+
+    if output:
+        with open(output, 'w') as f:
+            f.write(html_report(run_profile))
+        print('\nReport written to {0}'.format(output))
+
+
 @utils.group()
 def data_config():
     from CPAC.utils.ga import track_config
@@ -417,6 +451,7 @@ def test():
 @click.option('--list', '-l', 'show_list', is_flag=True)
 @click.option('--filter', '-f', 'pipeline_filter', default='')
 def run_suite(show_list=False, pipeline_filter=''):
+    import pkg_resources as p
     import CPAC.pipeline.cpac_runner as cpac_runner
 
     test_config_dir = \
@@ -52,7 +52,8 @@ def create_connectome(name='connectome'):
     node = pe.Node(Function(input_names=['time_series', 'method'],
                             output_names=['connectome'],
                             function=compute_correlation,
-                            as_module=True),
+                            as_module=True,
+                            threaded=True),
                    name='connectome')
 
     wf.connect([
@@ -7,8 +7,8 @@ import pandas as pd
 from CPAC.cwas.mdmr import mdmr
 from CPAC.utils import correlation
 
-from CPAC.pipeline.cpac_ga_model_generator import (create_merge_mask,
-                                                   create_merged_copefile)
+from CPAC.pipeline.cpac_ga_model_generator import \
+    create_merge_mask_from_files
 
 
 def joint_mask(subjects, mask_file=None):
@@ -31,10 +31,8 @@ def joint_mask(subjects, mask_file=None):
     """
     if not mask_file:
         files = list(subjects.values())
-        cope_file = os.path.join(os.getcwd(), 'joint_cope.nii.gz')
         mask_file = os.path.join(os.getcwd(), 'joint_mask.nii.gz')
-        create_merged_copefile(files, cope_file)
-        create_merge_mask(cope_file, mask_file)
+        create_merge_mask_from_files(files, mask_file)
 
     return mask_file
 
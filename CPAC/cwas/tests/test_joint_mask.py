@@ -0,0 +1,26 @@
+import nibabel as nb
+import numpy as np
+
+from CPAC.cwas.cwas import joint_mask
+
+
+def test_joint_mask(tmpdir):
+    rng = np.random.RandomState(0)
+    subjects = {}
+    timeseries = []
+    for i in range(3):
+        data = rng.randn(4, 4, 4, 10).astype(np.float32)
+        data[rng.rand(4, 4, 4, 10) < 0.02] = 0
+        path = str(tmpdir.join('s%d.nii.gz' % i))
+        nb.save(nb.Nifti1Image(data, np.eye(4)), path)
+        subjects['s%d' % i] = path
+        timeseries.append(data)
+
+    with tmpdir.as_cwd():
+        mask_file = joint_mask(subjects)
+
+    # fslmaths -abs -Tmin -bin of the merged time series
+    merged = np.concatenate(timeseries, axis=3)
+    expected = (np.abs(merged).min(axis=3) > 0).astype(float)
+    assert 0 < expected.sum() < expected.size
+    np.testing.assert_array_equal(nb.load(mask_file).get_fdata(), expected)
@@ -10,7 +10,8 @@ from nipype.interfaces import afni
 from nipype.interfaces.afni import preprocess
 from nipype.interfaces.afni import utils as afni_utils
 from CPAC.func_preproc.utils import add_afni_prefix, nullify, chunk_ts, \
-    split_ts_chunks, oned_text_concat, notch_filter_motion
+    split_ts_chunks, split_ts_chunks_in_process, concat_ts_chunks, \
+    oned_text_concat, notch_filter_motion
 from CPAC.utils.interfaces.function import Function
 from CPAC.generate_motion_statistics import motion_power_statistics
 
@@ -837,13 +838,25 @@ def create_func_preproc(skullstrip_tool, motion_correct_tool,
             chunk.inputs.n_cpus = int(config.maxCoresPerParticipant)
             preproc.connect(func_reorient, 'out_file', chunk, 'func_file')
 
-            split_imports = ['import os', 'import subprocess']
-            split = pe.Node(Function(input_names=['func_file',
-                                                  'tr_ranges'],
-                                     output_names=['split_funcs'],
-                                     function=split_ts_chunks,
-                                     imports=split_imports),
-                            name='split')
+            chunk_in_process = getattr(config,
+                                       'motion_correction_chunk_in_process',
+                                       False)
+
+            if chunk_in_process:
+                split = pe.Node(Function(input_names=['func_file',
+                                                      'tr_ranges'],
+                                         output_names=['split_funcs'],
+                                         function=split_ts_chunks_in_process,
+                                         as_module=True),
+                                name='split')
+            else:
+                split_imports = ['import os', 'import subprocess']
+                split = pe.Node(Function(input_names=['func_file',
+                                                      'tr_ranges'],
+                                         output_names=['split_funcs'],
+                                         function=split_ts_chunks,
+                                         imports=split_imports),
+                                name='split')
 
             preproc.connect(func_reorient, 'out_file', split, 'func_file')
             preproc.connect(chunk, 'TR_ranges', split, 'tr_ranges')
@@ -861,9 +874,16 @@ def create_func_preproc(skullstrip_tool, motion_correct_tool,
             preproc.connect(out_split_func, 'out_file',
                             func_motion_correct, 'in_file')
 
-            func_concat = pe.Node(interface=afni_utils.TCat(),
-                                  name='func_concat')
-            func_concat.inputs.outputtype = 'NIFTI_GZ'
+            if chunk_in_process:
+                func_concat = pe.Node(Function(input_names=['in_files'],
+                                               output_names=['out_file'],
+                                               function=concat_ts_chunks,
+                                               as_module=True),
+                                      name='func_concat')
+            else:
+                func_concat = pe.Node(interface=afni_utils.TCat(),
+                                      name='func_concat')
+                func_concat.inputs.outputtype = 'NIFTI_GZ'
 
             preproc.connect(func_motion_correct, 'out_file',
                             func_concat, 'in_files')
@@ -1004,9 +1024,17 @@ def create_func_preproc(skullstrip_tool, motion_correct_tool,
 
         if config:
             if int(config.maxCoresPerParticipant) > 1:
-                motion_concat = pe.Node(interface=afni_utils.TCat(),
-                                        name='motion_concat')
-                motion_concat.inputs.outputtype = 'NIFTI_GZ'
+                if getattr(config, 'motion_correction_chunk_in_process',
+                           False):
+                    motion_concat = pe.Node(Function(input_names=['in_files'],
+                                                     output_names=['out_file'],
+                                                     function=concat_ts_chunks,
+                                                     as_module=True),
+                                            name='motion_concat')
+                else:
+                    motion_concat = pe.Node(interface=afni_utils.TCat(),
+                                            name='motion_concat')
+                    motion_concat.inputs.outputtype = 'NIFTI_GZ'
 
                 preproc.connect(func_motion_correct_A, 'out_file',
                                 motion_concat, 'in_files')
@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+import nibabel as nb
+
+from CPAC.func_preproc.utils import chunk_ts, split_ts_chunks_in_process, \
+    concat_ts_chunks
+
+
+def _write_func(path, n_trs):
+    data = np.arange(2 * 3 * 4 * n_trs, dtype=np.float32)
+    data = data.reshape((2, 3, 4, n_trs))
+    nb.Nifti1Image(data, np.eye(4)).to_filename(path)
+    return data
+
+
+def test_chunk_ts_short_run(tmpdir):
+
+    func_file = str(tmpdir.join('func.nii'))
+    _write_func(func_file, 3)
+
+    # more cores than TRs should not produce empty or repeated chunks
+    assert chunk_ts(func_file, 8) == [(0, 0), (1, 1), (2, 2)]
+
+
+def test_split_and_concat_ts_chunks(tmpdir):
+
+    func_file = str(tmpdir.join('func_resample.nii.gz'))
+    data = _write_func(func_file, 10)
+
+    tr_ranges = chunk_ts(func_file, 3)
+
+    with tmpdir.as_cwd():
+        split_funcs = split_ts_chunks_in_process(func_file, tr_ranges)
+
+        assert [os.path.basename(f) for f in split_funcs] == \
+            ['func_resample_0.nii', 'func_resample_1.nii',
+             'func_resample_2.nii']
+        assert sum(nb.load(f).shape[3] for f in split_funcs) == 10
+
+        out_file = concat_ts_chunks(split_funcs)
+
+    assert os.path.basename(out_file) == 'func_resample.nii.gz'
+    np.testing.assert_array_equal(nb.load(out_file).get_fdata(), data)
+
+
+def test_concat_ts_chunks_name(tmpdir):
+
+    # only the chunk index is dropped, not other "_0"s of the name
+    func_file = str(tmpdir.join('sub-10_0_run_0.nii.gz'))
+    _write_func(func_file, 4)
+
+    with tmpdir.as_cwd():
+        split_funcs = split_ts_chunks_in_process(func_file, [(0, 1), (2, 3)])
+        assert os.path.basename(concat_ts_chunks(split_funcs)) == \
+            'sub-10_0_run_0.nii.gz'
+
+        # named by 3dvolreg
+        volreg_files = []
+        for split_func in split_funcs:
+            volreg_file = split_func.replace('.nii', '_volreg.nii')
+            os.rename(split_func, volreg_file)
+            volreg_files.append(volreg_file)
+        assert os.path.basename(concat_ts_chunks(volreg_files)) == \
+            'sub-10_0_run_0_volreg.nii.gz'
@@ -25,6 +25,8 @@ def nullify(value, function=None):
 def chunk_ts(func_file, n_cpus):
     func_img = nb.load(func_file)
     trs = func_img.shape[3]
+    # never hand out empty or overlapping ranges on very short runs
+    n_cpus = max(1, min(int(n_cpus), trs))
     chunk = trs/n_cpus
     TR_ranges = []
 
@@ -56,6 +58,94 @@ def split_ts_chunks(func_file, tr_ranges):
     return split_funcs
 
 
+def split_ts_chunks_in_process(func_file, tr_ranges):
+    """Split a 4D image into TR chunks with a single read of the input.
+
+    Each chunk is a view into the (memory-mapped, if uncompressed) input and
+    is written out uncompressed, so the per-chunk 3dvolreg runs do not have
+    to decompress anything.
+    """
+    import os
+    import numpy as np
+    import nibabel as nb
+
+    func_img = nb.load(func_file, mmap=True)
+    func_data = np.asanyarray(func_img.dataobj)
+
+    prefix = os.path.basename(func_file)
+    for ext in ['.nii.gz', '.nii']:
+        if prefix.endswith(ext):
+            prefix = prefix[:-len(ext)]
+            break
+
+    split_funcs = []
+    for chunk_idx, tr_range in enumerate(tr_ranges):
+        chunk_data = func_data[..., tr_range[0]:tr_range[1] + 1]
+
+        header = func_img.header.copy()
+        header.set_data_dtype(chunk_data.dtype)
+        chunk_img = nb.Nifti1Image(chunk_data, func_img.affine, header=header)
+
+        out_file = os.path.join(os.getcwd(),
+                                "{0}_{1}.nii".format(prefix, chunk_idx))
+        chunk_img.to_filename(out_file)
+        split_funcs.append(out_file)
+
+    return split_funcs
+
+
+def concat_ts_chunks(in_files, compress_level=1):
+    """Merge per-chunk 4D images back into one time series, in place of a
+    3dTcat pass. Each chunk is read once into a preallocated array.
+    """
+    import os
+    import re
+    import numpy as np
+    import nibabel as nb
+    from CPAC.utils.nifti_utils import intermediate_ext, save_nifti_image
+
+    chunk_imgs = [nb.load(in_file, mmap=True) for in_file in in_files]
+
+    shapes = [img.shape if len(img.shape) > 3 else img.shape + (1,)
+              for img in chunk_imgs]
+    if len(set(shape[:3] for shape in shapes)) > 1:
+        raise ValueError("Cannot concatenate chunks with different spatial "
+                         "dimensions: {0}".format(in_files))
+
+    n_trs = sum(shape[3] for shape in shapes)
+
+    concat_data = None
+    start = 0
+    for img, shape in zip(chunk_imgs, shapes):
+        chunk_data = np.asanyarray(img.dataobj).reshape(shape)
+        if concat_data is None:
+            concat_data = np.empty(shape[:3] + (n_trs,),
+                                   dtype=chunk_data.dtype)
+        stop = start + shape[3]
+        concat_data[..., start:stop] = chunk_data
+        start = stop
+        del chunk_data
+
+    header = chunk_imgs[0].header.copy()
+    header.set_data_dtype(concat_data.dtype)
+    concat_img = nb.Nifti1Image(concat_data, chunk_imgs[0].affine,
+                                header=header)
+
+    out_name = os.path.basename(in_files[0])
+    for ext in ['.nii.gz', '.nii']:
+        if out_name.endswith(ext):
+            out_name = out_name[:-len(ext)]
+            break
+    # drop the chunk index split_ts_chunks_in_process appended, followed by
+    # the suffix of the tool run on the chunk, if any, e.g.
+    # func_resample_0_volreg -> func_resample_volreg
+    out_name = re.sub(r"_0(_[A-Za-z]+)?$", r"\1", out_name)
+
+    out_file = os.path.join(os.getcwd(), out_name + intermediate_ext())
+
+    return save_nifti_image(concat_img, out_file, compress_level)
+
+
 def oned_text_concat(in_files):
     out_file = os.path.join(os.getcwd(), os.path.basename(in_files[0].replace("_0", "")))
 
@@ -159,6 +159,7 @@ REQUIREMENTS        = [
     "scikit-learn==0.22.1",
     "scipy==1.4.1",
     "simplejson==3.15.0",
+    "threadpoolctl==2.1.0",
     "traits==4.6.0",
     "PyBASC==0.4.5",
     "pathlib==1.0.1",
@@ -32,6 +32,7 @@ def median_angle_correct(target_angle_deg, realigned_file):
     import nibabel as nb
     import os
     from scipy.stats.stats import pearsonr
+    from CPAC.utils.nifti_utils import intermediate_ext
 
     def shiftCols(pc, A, dtheta):
         pcxA = np.dot(pc, A)
@@ -76,7 +77,8 @@ def median_angle_correct(target_angle_deg, realigned_file):
         #'Median Angle >= Target Angle, skipping correction'
         Ynf = Yn
 
-    corrected_file = os.path.join(os.getcwd(), 'median_angle_corrected.nii.gz')
+    corrected_file = os.path.join(os.getcwd(),
+                                  'median_angle_corrected' + intermediate_ext())
     angles_file = os.path.join(os.getcwd(), 'angles_U5_Yn.npy')
 
     angles_U5_Yn = np.arccos(np.dot(U[:, 0:5].T, Yn))
@@ -64,6 +64,8 @@ def bandpass_voxels(realigned_file, regressor_file, bandpass_freqs,
         Path of filtered output (nifti file).
     
     """
+    from CPAC.utils.nifti_utils import intermediate_ext
+
     nii = nb.load(realigned_file)
     data = nii.get_data().astype('float64')
     mask = (data != 0).sum(-1) != 0
@@ -85,7 +87,8 @@ def bandpass_voxels(realigned_file, regressor_file, bandpass_freqs,
     img = nb.Nifti1Image(data, header=nii.get_header(),
                          affine=nii.get_affine())
     bandpassed_file = os.path.join(os.getcwd(),
-                                   'bandpassed_demeaned_filtered.nii.gz')
+                                   'bandpassed_demeaned_filtered' +
+                                   intermediate_ext())
     img.to_filename(bandpassed_file)
 
     regressor_bandpassed_file = None
@@ -106,7 +109,8 @@ def bandpass_voxels(realigned_file, regressor_file, bandpass_freqs,
             img = nb.Nifti1Image(data, header=nii.get_header(),
                             affine=nii.get_affine())
             regressor_bandpassed_file = os.path.join(os.getcwd(),
-                                    'regressor_bandpassed_demeaned_filtered.nii.gz')
+                                    'regressor_bandpassed_demeaned_filtered' +
+                                    intermediate_ext())
             img.to_filename(regressor_bandpassed_file)
         
         else:
@@ -1099,7 +1099,8 @@ def create_regressor_workflow(nuisance_selectors,
                                                     output_names=[
                                                         'compcor_file'],
                                                     function=calc_compcor_components,
-                                                    imports=compcor_imports),
+                                                    imports=compcor_imports,
+                                                    threaded=True),
                                            name='{}_DetrendPC'.format(regressor_type), mem_gb=2.0)
 
                     compcor_node.inputs.num_components = regressor_selector['summary']['components']
@@ -0,0 +1,213 @@
+"""Completion manifests of participants, to skip them when a run is resumed
+
+When a participant's workflow succeeds, a manifest records the pipeline
+configuration, the participant's inputs and the outputs written. When the
+same data configuration is run again, participants whose manifest still
+matches (same configuration, unchanged inputs, outputs still there) are
+skipped before their workflow is built, instead of being rebuilt for nipype
+to find every node cached.
+"""
+import hashlib
+import json
+import os
+
+import CPAC
+from CPAC.pipeline.workflow_cache import RUNTIME_KEYS
+
+# configuration keys that change how participants run, but not their outputs
+EXECUTION_KEYS = RUNTIME_KEYS + [
+    'maxCoresPerParticipant', 'num_ants_threads', 'participant_scheduling',
+    'scheduler_memory_gb', 'scheduler_cores', 'tune_node_resources',
+    'node_resources_margin', 'node_profiles_file', 'node_thread_budgets',
+    's3_input_cache_dir', 's3_input_cache_max_gb', 's3_input_cache_threads',
+    's3_input_cache_prefetch_participants', 'workflow_cache_dir',
+    'share_resampled_templates', 'template_cache_dir',
+    'reclaim_working_directory', 'removeWorkingDir',
+    'skip_completed_participants', 'completion_manifest_dir'
+]
+
+
+def participant_id(sub_dict):
+    """Participant and session ID, as used to name the outputs"""
+    subject_id = sub_dict['subject_id']
+    if sub_dict.get('unique_id'):
+        subject_id += '_' + sub_dict['unique_id']
+    return subject_id
+
+
+def config_hash(c):
+    """
+    Hash of the pipeline configuration, without the keys that only change
+    how participants run
+
+    Parameters
+    ----------
+    c : CPAC.utils.configuration.Configuration
+
+    Returns
+    -------
+    digest : string
+    """
+    config = {name: value for name, value in vars(c).items()
+              if name not in EXECUTION_KEYS}
+    return hashlib.sha1(json.dumps(
+        {'version': CPAC.__version__, 'config': config},
+        sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _input_paths(value):
+    if isinstance(value, dict):
+        for item in value.values():
+            for path in _input_paths(item):
+                yield path
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            for path in _input_paths(item):
+                yield path
+    elif isinstance(value, str) and '/' in value:
+        yield value
+
+
+def input_signature(sub_dict):
+    """
+    Size and modification time of the local files of a participant's data
+    configuration entry, and the entry itself
+
+    S3 inputs are only identified by their path.
+
+    Parameters
+    ----------
+    sub_dict : dictionary
+
+    Returns
+    -------
+    signature : dictionary
+    """
+    files = {}
+    for path in _input_paths(sub_dict):
+        if not path.lower().startswith('s3://') and os.path.isfile(path):
+            stat = os.stat(path)
+            files[path] = [stat.st_size, stat.st_mtime]
+        else:
+            files[path] = None
+
+    return {
+        'sub_dict': hashlib.sha1(json.dumps(
+            sub_dict, sort_keys=True, default=str).encode('utf-8')
+        ).hexdigest(),
+        'files': files
+    }
+
+
+def participant_outputs(c, subject_id, pipeline_ids):
+    """
+    Output files of a participant, in a local output directory
+
+    Parameters
+    ----------
+    c : CPAC.utils.configuration.Configuration
+    subject_id : string
+    pipeline_ids : list
+        pipeline IDs the participant's workflow writes to
+
+    Returns
+    -------
+    outputs : list
+        paths, or an empty list for an output directory on S3
+    """
+    if c.outputDirectory.lower().startswith('s3://'):
+        return []
+
+    outputs = []
+    for pipeline_id in sorted(set(pipeline_ids)):
+        sub_output_dir = os.path.join(c.outputDirectory,
+                                      'pipeline_{0}'.format(pipeline_id),
+                                      subject_id)
+        for root, _, files in os.walk(sub_output_dir):
+            outputs.extend(os.path.join(root, f) for f in files)
+    return sorted(outputs)
+
+
+def completion_manifest_dir(c):
+    """Directory of the completion manifests of a pipeline"""
+    return getattr(c, 'completion_manifest_dir', None) or os.path.join(
+        c.logDirectory, 'pipeline_%s' % c.pipelineName, 'completed')
+
+
+class CompletionManifests(object):
+    """
+    Directory of completion manifests, one JSON file per participant
+
+    Parameters
+    ----------
+    manifest_dir : string
+    """
+
+    def __init__(self, manifest_dir):
+        self.manifest_dir = os.path.abspath(manifest_dir)
+
+    def path(self, subject_id):
+        return os.path.join(self.manifest_dir, subject_id + '.json')
+
+    def write(self, sub_dict, c_hash, outputs):
+        """
+        Record that a participant completed
+
+        Parameters
+        ----------
+        sub_dict : dictionary
+            participant entry of the data configuration
+        c_hash : string
+            config_hash of the configuration the participant ran with
+        outputs : list
+            output files of the participant
+        """
+        if not os.path.exists(self.manifest_dir):
+            try:
+                os.makedirs(self.manifest_dir)
+            except OSError:
+                if not os.path.isdir(self.manifest_dir):
+                    raise
+
+        manifest = {
+            'config': c_hash,
+            'inputs': input_signature(sub_dict),
+            'outputs': outputs
+        }
+        path = self.path(participant_id(sub_dict))
+        partial = '{0}.part-{1}'.format(path, os.getpid())
+        with open(partial, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.rename(partial, path)
+
+    def remove(self, sub_dict):
+        """Forget a participant's completion, before it runs again"""
+        try:
+            os.remove(self.path(participant_id(sub_dict)))
+        except OSError:
+            pass
+
+    def is_complete(self, sub_dict, c_hash):
+        """
+        Whether a participant completed with the same configuration and
+        inputs, and its outputs are still there
+
+        Parameters
+        ----------
+        sub_dict : dictionary
+        c_hash : string
+            config_hash of the configuration to run
+
+        Returns
+        -------
+        complete : boolean
+        """
+        try:
+            with open(self.path(participant_id(sub_dict)), 'r') as f:
+                manifest = json.load(f)
+        except (IOError, OSError, ValueError):
+            return False
+
+        return manifest.get('config') == c_hash and \
+            manifest.get('inputs') == input_signature(sub_dict) and \
+            all(os.path.exists(path) for path in manifest.get('outputs', []))
@@ -37,6 +37,166 @@ def create_dir(dir_path, description):
             raise Exception(err)
 
 
+def _volume_checksum(volume):
+    """SHA-1 of a volume's voxels, as written to a merged file (float32)"""
+    import hashlib
+    import numpy as np
+
+    return hashlib.sha1(np.ascontiguousarray(
+        volume, dtype=np.float32).tobytes()).hexdigest()
+
+
+def _checksums_file(merged_outfile):
+    # named without "merged", which run_feat looks for in the model files
+    import hashlib
+    return os.path.join(os.path.dirname(merged_outfile),
+                        ".volume_checksums_%s.json" % hashlib.sha1(
+                            os.path.basename(merged_outfile).encode(
+                                "utf-8")).hexdigest()[:12])
+
+
+def merge_copefile_and_mask(list_of_output_files, merged_outfile,
+                            mask_outfile):
+    """
+    Create the 4D merged copefile and its group mask in one pass
+
+    The participant maps are read one at a time with nibabel into a
+    preallocated, memory-mapped 4D array, while the mask is accumulated as
+    the voxels non-zero in every map (fslmaths -abs -Tmin -bin). The
+    checksum of every volume written is recorded next to the merged file,
+    for check_merged_file.
+
+    Parameters
+    ----------
+    list_of_output_files : list
+        participant maps, in the order of the design matrix
+    merged_outfile : string
+    mask_outfile : string
+
+    Returns
+    -------
+    merged_outfile : string
+    mask_outfile : string
+    """
+    import json
+    import numpy as np
+    import nibabel as nb
+
+    list_of_output_files = list(list_of_output_files)
+    first = nb.load(list_of_output_files[0])
+    shape = first.shape[:3]
+
+    memmap_file = "{0}.part-{1}.dat".format(merged_outfile, os.getpid())
+    try:
+        merged = np.memmap(memmap_file, dtype=np.float32, mode="w+",
+                           shape=shape + (len(list_of_output_files),),
+                           order="F")
+        mask = np.ones(shape, dtype=bool)
+        checksums = []
+
+        for i, output_file in enumerate(list_of_output_files):
+            img = nb.load(output_file)
+            if img.shape[:3] != shape or \
+                    int(np.prod(img.shape[3:])) != 1:
+                err = "\n\n[!] The derivative files to merge for group " \
+                      "analysis must be 3D images of the same " \
+                      "dimensions.\n\nFirst file: %s, %s\n\nMismatching " \
+                      "file: %s, %s\n\n" % (list_of_output_files[0],
+                                            first.shape, output_file,
+                                            img.shape)
+                raise Exception(err)
+            volume = np.asarray(img.dataobj,
+                                dtype=np.float32).reshape(shape)
+            merged[..., i] = volume
+            mask &= np.abs(volume) > 0
+            checksums.append(_volume_checksum(volume))
+
+        header = first.header.copy()
+        header.set_data_dtype(np.float32)
+        merged_img = nb.Nifti1Image(merged, first.affine, header=header)
+        merged_img.header.set_slope_inter(1, 0)
+        nb.save(merged_img, merged_outfile)
+        del merged_img, merged
+
+        mask_img = nb.Nifti1Image(mask.astype(np.float32), first.affine,
+                                  header=header)
+        mask_img.header.set_slope_inter(1, 0)
+        nb.save(mask_img, mask_outfile)
+    except Exception as e:
+        err = "\n\n[!] Something went wrong during the creation of the 4D " \
+              "merged file and group mask for group analysis.\n\n" \
+              "Attempted to create files: %s, %s\n\nLength of list of " \
+              "files to merge: %d\n\nError details: %s\n\n" \
+              % (merged_outfile, mask_outfile, len(list_of_output_files), e)
+        raise Exception(err)
+    finally:
+        if os.path.exists(memmap_file):
+            os.remove(memmap_file)
+
+    stat = os.stat(merged_outfile)
+    with open(_checksums_file(merged_outfile), "w") as f:
+        json.dump({"merged_file": [stat.st_size, stat.st_mtime],
+                   "files": list_of_output_files,
+                   "checksums": checksums}, f, indent=1)
+
+    return merged_outfile, mask_outfile
+
+
+def create_merge_mask_from_files(list_of_files, mask_outfile):
+    """
+    Create the mask of the voxels non-zero in every volume of a list of 3D
+    or 4D images, as fslmaths -abs -Tmin -bin would on their merged file,
+    without merging them
+
+    The images are read one at a time.
+
+    Parameters
+    ----------
+    list_of_files : list
+    mask_outfile : string
+
+    Returns
+    -------
+    mask_outfile : string
+    """
+    import numpy as np
+    import nibabel as nb
+
+    list_of_files = list(list_of_files)
+    first = nb.load(list_of_files[0])
+    shape = first.shape[:3]
+
+    try:
+        mask = np.ones(shape, dtype=bool)
+        for in_file in list_of_files:
+            img = nb.load(in_file)
+            if img.shape[:3] != shape:
+                err = "\n\n[!] The files to mask must have the same " \
+                      "spatial dimensions.\n\nFirst file: %s, %s\n\n" \
+                      "Mismatching file: %s, %s\n\n" % (
+                          list_of_files[0], first.shape, in_file, img.shape)
+                raise Exception(err)
+            data = np.asarray(img.dataobj, dtype=np.float32).reshape(
+                shape + (-1,))
+            mask &= (np.abs(data) > 0).all(axis=3)
+            del data
+
+        header = first.header.copy()
+        header.set_data_dtype(np.float32)
+        mask_img = nb.Nifti1Image(mask.astype(np.float32), first.affine,
+                                  header=header)
+        mask_img.header.set_slope_inter(1, 0)
+        nb.save(mask_img, mask_outfile)
+    except Exception as e:
+        err = "\n\n[!] Something went wrong during the creation of the " \
+              "group mask.\n\nAttempted to create file: %s\n\nLength of " \
+              "list of files: %d\n\nError details: %s\n\n" \
+              % (mask_outfile, len(list_of_files), e)
+        raise Exception(err)
+
+    return mask_outfile
+
+
 def create_merged_copefile(list_of_output_files, merged_outfile):
 
     import subprocess
@@ -76,10 +236,61 @@ def create_merge_mask(merged_file, mask_outfile):
     return mask_outfile
 
 
+def _check_merged_checksums(list_of_output_files, merged_outfile):
+    """
+    Check the order of a merged file from the checksums of its volumes,
+    recorded by merge_copefile_and_mask
+
+    Returns
+    -------
+    checked : boolean
+        False when no checksums were recorded for this merged file
+    """
+    import json
+    import numpy as np
+    import nibabel as nb
+
+    try:
+        with open(_checksums_file(merged_outfile), "r") as f:
+            recorded = json.load(f)
+        stat = os.stat(merged_outfile)
+    except (IOError, OSError, ValueError):
+        return False
+    if recorded.get("merged_file") != [stat.st_size, stat.st_mtime]:
+        return False
+
+    checksums = recorded.get("checksums", [])
+    if len(checksums) != len(list_of_output_files):
+        err = "\n\n[!] The merged file has %d volumes, but there are %d " \
+              "derivative files in the model.\n\nMerged file: %s\n\n" \
+              % (len(checksums), len(list_of_output_files), merged_outfile)
+        raise Exception(err)
+
+    for i, output_file in enumerate(list_of_output_files):
+        img = nb.load(output_file)
+        volume = np.asarray(img.dataobj, dtype=np.float32)
+        if _volume_checksum(volume) != checksums[i]:
+            err = "\n\n[!] The volumes of the merged file do not " \
+                  "correspond to the correct order of output files as " \
+                  "described in the phenotype matrix.\n\nMerged file: " \
+                  "%s\n\nMismatch between merged file volume %d and " \
+                  "derivative file %s\n\nEach volume should correspond " \
+                  "to the derivative output file for each participant in " \
+                  "the model.\n\n" % (merged_outfile, i, output_file)
+            raise Exception(err)
+
+    return True
+
+
 def check_merged_file(list_of_output_files, merged_outfile):
 
     import subprocess
 
+    # merged by merge_copefile_and_mask: compare the checksums of the
+    # volumes with those of the output files
+    if _check_merged_checksums(list(list_of_output_files), merged_outfile):
+        return
+
     # make sure the order is correct
     #   we are ensuring each volume of the merge file correlates perfectly
     #   with the output file it should correspond to
@@ -96,7 +307,7 @@ def check_merged_file(list_of_output_files, merged_outfile):
                   "\n\nError details: %s\n\n" % e
             raise Exception(err)
 
-        retcode = retcode.rstrip("\n").rstrip("\t")
+        retcode = retcode.decode("utf-8").rstrip("\n").rstrip("\t")
 
         if retcode != "1":
             err = "\n\n[!] The volumes of the merged file do not correspond "\
@@ -651,14 +862,12 @@ def build_feat_model(model_df, model_name, group_config_file, resource_id,
     # matrix
     merge_outfile = model_name + "_" + resource_id + "_merged.nii.gz"
     merge_outfile = os.path.join(model_path, merge_outfile)
-    merge_file = create_merged_copefile(model_df["Filepath"].tolist(),
-                                        merge_outfile)
-
-    # create merged group mask
+    # and the merged group mask, in the same pass
     merge_mask_outfile = '_'.join([model_name, resource_id,
                                    "merged_mask.nii.gz"])
     merge_mask_outfile = os.path.join(model_path, merge_mask_outfile)
-    merge_mask = create_merge_mask(merge_file, merge_mask_outfile)
+    merge_file, merge_mask = merge_copefile_and_mask(
+        model_df["Filepath"].tolist(), merge_outfile, merge_mask_outfile)
 
     if "Group Mask" in group_config_obj.mean_mask:
         mask_for_means = merge_mask
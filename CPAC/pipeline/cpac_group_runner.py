@@ -236,7 +236,8 @@ def grab_raw_score_filepath(filepath, resource_id):
     return raw_score_path
 
 
-def find_power_params_file(filepath, resource_id, series_id):
+def find_power_params_file(filepath, resource_id, series_id,
+                           output_index=None):
 
     import os
 
@@ -253,11 +254,15 @@ def find_power_params_file(filepath, resource_id, series_id):
         raise Exception(err)
 
     power_params_file = None
-    for root, dirs, files in os.walk(power_first_half):
-        for filename in files:
-            filepath = os.path.join(root, filename)
-            if "pow_params.txt" in filepath:
-                power_params_file = filepath
+    if output_index is not None:
+        filepaths = output_index.files_under(power_first_half)
+    else:
+        filepaths = [os.path.join(root, filename)
+                     for root, dirs, files in os.walk(power_first_half)
+                     for filename in files]
+    for filepath in filepaths:
+        if "pow_params.txt" in filepath:
+            power_params_file = filepath
 
     if not power_params_file:
         err = "\n\n[!] Could not find the power parameters file for the " \
@@ -307,7 +312,8 @@ def extract_power_params(power_params_lines, power_params_filepath):
 def create_output_dict_list(nifti_globs, pipeline_output_folder,
                             resource_list, get_motion=False,
                             get_raw_score=False, pull_func=False,
-                            derivatives=None, exts=['nii', 'nii.gz']):
+                            derivatives=None, exts=['nii', 'nii.gz'],
+                            output_index=None):
 
     import os
     import glob
@@ -370,73 +376,80 @@ def create_output_dict_list(nifti_globs, pipeline_output_folder,
     # parse each result of each "valid" glob string
     output_dict_list = {}
 
-    for root, _, files in os.walk(pipeline_output_folder):
-        for filename in files:
-
-            filepath = os.path.join(root, filename)
-
-            if not any(fnmatch.fnmatch(filepath, pattern) for pattern in nifti_globs):
-                continue
+    if output_index is not None:
+        filepaths = output_index.paths(search_dirs, exts)
+    else:
+        filepaths = [
+            os.path.join(root, filename)
+            for root, _, files in os.walk(pipeline_output_folder)
+            for filename in files
+            if any(fnmatch.fnmatch(os.path.join(root, filename), pattern)
+                   for pattern in nifti_globs)
+        ]
 
-            if not any(filepath.endswith(ext) for ext in exts):
-                continue
+    for filepath in filepaths:
+        for ext in exts:
+            if filepath.endswith(ext):
+                break
+        else:
+            continue
 
-            relative_filepath = filepath.split(pipeline_output_folder)[1]
-            filepath_pieces = [_f for _f in relative_filepath.split("/") if _f]
+        relative_filepath = filepath.split(pipeline_output_folder)[1]
+        filepath_pieces = [_f for _f in relative_filepath.split("/") if _f]
 
-            resource_id = filepath_pieces[1]
+        resource_id = filepath_pieces[1]
 
-            if resource_id not in search_dirs:
-                continue
+        if resource_id not in search_dirs:
+            continue
 
-            series_id_string = filepath_pieces[2]
-            strat_info = "_".join(filepath_pieces[3:])[:-len(ext)]
+        series_id_string = filepath_pieces[2]
+        strat_info = "_".join(filepath_pieces[3:])[:-len(ext)]
 
-            unique_resource_id = (resource_id, strat_info)
+        unique_resource_id = (resource_id, strat_info)
 
-            if unique_resource_id not in output_dict_list.keys():
-                output_dict_list[unique_resource_id] = []
+        if unique_resource_id not in output_dict_list.keys():
+            output_dict_list[unique_resource_id] = []
 
-            unique_id = filepath_pieces[0]
+        unique_id = filepath_pieces[0]
 
-            series_id = series_id_string.replace("_scan_", "")
-            series_id = series_id.replace("_rest", "")
+        series_id = series_id_string.replace("_scan_", "")
+        series_id = series_id.replace("_rest", "")
 
-            new_row_dict = {}
-            new_row_dict["participant_session_id"] = unique_id
-            new_row_dict["participant_id"], new_row_dict["Sessions"] = \
-                unique_id.split('_')
+        new_row_dict = {}
+        new_row_dict["participant_session_id"] = unique_id
+        new_row_dict["participant_id"], new_row_dict["Sessions"] = \
+            unique_id.split('_')
 
-            new_row_dict["Series"] = series_id
-            new_row_dict["Filepath"] = filepath
+        new_row_dict["Series"] = series_id
+        new_row_dict["Filepath"] = filepath
 
-            print('{0} - {1} - {2}'.format(
-                unique_id,
-                series_id,
-                resource_id
-            ))
+        print('{0} - {1} - {2}'.format(
+            unique_id,
+            series_id,
+            resource_id
+        ))
 
-            if get_motion:
-                # if we're including motion measures
-                power_params_file = find_power_params_file(filepath,
-                    resource_id, series_id)
-                power_params_lines = load_text_file(power_params_file,
-                    "power parameters file")
-                meanfd_p, meanfd_j, meandvars = \
-                    extract_power_params(power_params_lines,
-                                         power_params_file)
-                new_row_dict["MeanFD_Power"] = meanfd_p
-                new_row_dict["MeanFD_Jenkinson"] = meanfd_j
-                new_row_dict["MeanDVARS"] = meandvars
+        if get_motion:
+            # if we're including motion measures
+            power_params_file = find_power_params_file(filepath,
+                resource_id, series_id, output_index)
+            power_params_lines = load_text_file(power_params_file,
+                "power parameters file")
+            meanfd_p, meanfd_j, meandvars = \
+                extract_power_params(power_params_lines,
+                                     power_params_file)
+            new_row_dict["MeanFD_Power"] = meanfd_p
+            new_row_dict["MeanFD_Jenkinson"] = meanfd_j
+            new_row_dict["MeanDVARS"] = meandvars
 
-            if get_raw_score:
-                # grab raw score for measure mean just in case
-                raw_score_path = grab_raw_score_filepath(filepath,
-                                                         resource_id)
-                new_row_dict["Raw_Filepath"] = raw_score_path
+        if get_raw_score:
+            # grab raw score for measure mean just in case
+            raw_score_path = grab_raw_score_filepath(filepath,
+                                                     resource_id)
+            new_row_dict["Raw_Filepath"] = raw_score_path
 
-            # unique_resource_id is tuple (resource_id,strat_info)
-            output_dict_list[unique_resource_id].append(new_row_dict)
+        # unique_resource_id is tuple (resource_id,strat_info)
+        output_dict_list[unique_resource_id].append(new_row_dict)
 
     return output_dict_list
 
@@ -477,22 +490,29 @@ def gather_outputs(pipeline_folder, resource_list, inclusion_list,
                    get_motion, get_raw_score, get_func=False,
                    derivatives=None):
 
-    nifti_globs = gather_nifti_globs(
-        pipeline_folder,
-        resource_list,
-        get_func
-    )
+    from CPAC.pipeline.output_index import OutputIndex
+
+    # one pass over the output directory, saved for the next analyses
+    output_index = OutputIndex(pipeline_folder)
 
     output_dict_list = create_output_dict_list(
-        nifti_globs,
-        pipeline_folder,
+        None,
+        output_index.pipeline_folder,
         resource_list,
         get_motion,
         get_raw_score,
         get_func,
-        derivatives
+        derivatives,
+        output_index=output_index
     )
 
+    if not output_dict_list:
+        err = "\n\n[!] No output filepaths found in the pipeline output " \
+              "directory provided for the derivatives selected!\n\nPipeline " \
+              "output directory provided: %s\nDerivatives selected:%s\n\n" \
+              % (pipeline_folder, resource_list)
+        raise Exception(err)
+
     output_df_dict = create_output_df_dict(output_dict_list, inclusion_list)
 
     return output_df_dict
@@ -1080,6 +1100,55 @@ def build_feat_models(group_config_file):
         return -1
 
 
+def find_feat_models(model_dir):
+    """
+    Model files of the FSL-FEAT/Randomise models built in a directory
+
+    Parameters
+    ----------
+    model_dir : string
+        directory of the group model's outputs
+
+    Returns
+    -------
+    models : dictionary
+        model files by (resource, series, strategy..., model_files) tuple
+    """
+    import os
+
+    models = {}
+    for root, dirs, files in os.walk(model_dir):
+        for filename in files:
+            filepath = os.path.join(root, filename)
+            second_half = filepath.split(model_dir)[1].split('/')
+            second_half.remove('')
+
+            try:
+                id_tuple = (second_half[0], second_half[1], second_half[2],
+                            second_half[3])
+            except IndexError:
+                # not a file we are interested in
+                continue
+
+            if id_tuple not in models.keys():
+                models[id_tuple] = {}
+
+            if 'group_sublist' in filepath:
+                models[id_tuple]['group_sublist'] = filepath
+            elif 'design_matrix' in filepath:
+                models[id_tuple]['design_matrix'] = filepath
+                models[id_tuple]['dir_path'] = filepath.replace('model_files/design_matrix.csv', '')
+            elif 'groups' in filepath:
+                models[id_tuple]['group_vector'] = filepath
+            elif filename.endswith(('_merged_mask.nii.gz',
+                                    '_merged_mask.nii')):
+                models[id_tuple]['merged_mask'] = filepath
+            elif filename.endswith(('_merged.nii.gz', '_merged.nii')):
+                models[id_tuple]['merged'] = filepath
+
+    return models
+
+
 def run_feat(group_config_file, feat=True):
 
     import os
@@ -1117,34 +1186,7 @@ def run_feat(group_config_file, feat=True):
               "\n\n".format(custom_contrasts_csv)
         raise Exception(err)
 
-    models = {}
-    for root, dirs, files in os.walk(model_dir):
-        for filename in files:
-            filepath = os.path.join(root, filename)
-            second_half = filepath.split(model_dir)[1].split('/')
-            second_half.remove('')
-
-            try:
-                id_tuple = (second_half[0], second_half[1], second_half[2],
-                            second_half[3])
-            except IndexError:
-                # not a file we are interested in
-                continue
-
-            if id_tuple not in models.keys():
-                models[id_tuple] = {}
-
-            if 'group_sublist' in filepath:
-                models[id_tuple]['group_sublist'] = filepath
-            elif 'design_matrix' in filepath:
-                models[id_tuple]['design_matrix'] = filepath
-                models[id_tuple]['dir_path'] = filepath.replace('model_files/design_matrix.csv', '')
-            elif 'groups' in filepath:
-                models[id_tuple]['group_vector'] = filepath
-            elif 'merged_mask' in filepath:
-                models[id_tuple]['merged_mask'] = filepath
-            elif 'merged' in filepath:
-                models[id_tuple]['merged'] = filepath
+    models = find_feat_models(model_dir)
 
     if len(models) == 0:
         err = '\n\n[!] C-PAC says: Cannot find the FSL-FEAT/Randomise model ' \
@@ -113,6 +113,7 @@ from CPAC.utils import Configuration, Strategy, Outputs, find_files
 from CPAC.utils.interfaces.function import Function
 
 from CPAC.utils.interfaces.datasink import DataSink
+from CPAC.utils.nifti_utils import set_intermediate_format
 
 from CPAC.qc.pipeline import create_qc_workflow
 from CPAC.qc.utils import generate_qc_pages
@@ -133,6 +134,22 @@ from CPAC.utils.utils import (
 
 from CPAC.utils.monitoring import log_nodes_initial, log_nodes_cb
 
+from CPAC.utils.node_profiles import NodeProfileStore, participant_input_gb
+
+from CPAC.pipeline.completion_manifest import (
+    CompletionManifests,
+    completion_manifest_dir,
+    config_hash,
+    participant_outputs
+)
+from CPAC.pipeline.plugins import (
+    InstrumentedMultiProcPlugin,
+    ReclaimingMultiProcPlugin,
+    ReclaimingThreadBudgetMultiProcPlugin,
+    ThreadBudgetMultiProcPlugin
+)
+from CPAC.pipeline.workflow_cache import WorkflowCache, workflow_cache_key
+
 logger = logging.getLogger('nipype.workflow')
 # config.enable_debug_mode()
 
@@ -168,6 +185,12 @@ def run_workflow(sub_dict, c, run, pipeline_timing_info=None, p_name=None,
     # Assure that changes on config will not affect other parts
     c = copy.copy(c)
 
+    # Hashed before the workflow is built, as the runner does to skip the
+    # participants that completed
+    c_hash = config_hash(c)
+    manifests = CompletionManifests(completion_manifest_dir(c))
+    manifests.remove(sub_dict)
+
     subject_id = sub_dict['subject_id']
     if sub_dict['unique_id']:
         subject_id += "_" + sub_dict['unique_id']
@@ -215,6 +238,30 @@ def run_workflow(sub_dict, c, run, pipeline_timing_info=None, p_name=None,
     os.environ['MKL_NUM_THREADS'] = '1'  # str(num_cores_per_sub)
     os.environ['ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS'] = str(num_ants_cores)
 
+    # working directory format policy: keep intermediates uncompressed, the
+    # sinks compress them on the way to the output directory
+    if getattr(c, 'uncompressed_intermediates', False):
+        os.environ['FSLOUTPUTTYPE'] = 'NIFTI'
+        os.environ['CPAC_INTERMEDIATE_FORMAT'] = 'NIFTI'
+    else:
+        os.environ['CPAC_INTERMEDIATE_FORMAT'] = 'NIFTI_GZ'
+
+    # shared S3 input cache, read by check_for_s3
+    if getattr(c, 's3_input_cache_dir', None):
+        os.environ['CPAC_S3_INPUT_CACHE'] = c.s3_input_cache_dir
+        if getattr(c, 's3_input_cache_max_gb', None):
+            os.environ['CPAC_S3_INPUT_CACHE_MAX_GB'] = \
+                str(c.s3_input_cache_max_gb)
+
+    # shared cache of resampled templates, read by resolve_resolution
+    if getattr(c, 'template_cache_dir', None):
+        os.environ['CPAC_TEMPLATE_CACHE'] = c.template_cache_dir
+    elif getattr(c, 'share_resampled_templates', True):
+        os.environ['CPAC_TEMPLATE_CACHE'] = os.path.join(
+            os.path.abspath(c.workingDirectory), 'resampled_templates')
+    else:
+        os.environ.pop('CPAC_TEMPLATE_CACHE', None)
+
     # TODO: TEMPORARY
     # TODO: solve the UNet model hanging issue during MultiProc
     if "unet" in c.skullstrip_option:
@@ -316,9 +363,31 @@ def run_workflow(sub_dict, c, run, pipeline_timing_info=None, p_name=None,
     if 's3://' not in c.outputDirectory:
         c.outputDirectory = os.path.abspath(c.outputDirectory)
 
-    workflow, strat_list, pipeline_ids = build_workflow(
-        subject_id, sub_dict, c, p_name, num_ants_cores
-    )
+    # participants with the same data configuration shape share the same
+    # workflow, only their inputs are stamped in (not for the ndmg output
+    # tree, which has the participant ID in its output file names)
+    built = None
+    if getattr(c, 'workflow_cache_dir', None) and not ndmg_out:
+        workflow_cache = WorkflowCache(c.workflow_cache_dir)
+        workflow_key = workflow_cache_key(c, sub_dict, p_name,
+                                          num_ants_cores)
+        built = workflow_cache.load(workflow_key, subject_id, sub_dict,
+                                    input_creds_path)
+        if built is None:
+            # build_workflow replaces the templates of the configuration by
+            # nodes, which would change the key of the next participants
+            built = build_workflow(
+                subject_id, sub_dict, copy.copy(c), p_name, num_ants_cores
+            )
+            workflow_cache.save(workflow_key, built, subject_id, sub_dict,
+                                input_creds_path)
+
+    if built is None:
+        built = build_workflow(
+            subject_id, sub_dict, c, p_name, num_ants_cores
+        )
+
+    workflow, strat_list, pipeline_ids = built
 
     forks = "\n\nStrategy forks:\n" + \
             "\n".join(["- " + pipe for pipe in sorted(set(pipeline_ids))]) + \
@@ -391,6 +460,26 @@ Please, make yourself aware of how it works and its assumptions:
             except IOError:
                 pass
 
+            # Set the resources of the nodes from their runs for the
+            # previous participants, and learn from this one's
+            node_profiles = None
+            if getattr(c, 'tune_node_resources', True):
+                node_profiles = NodeProfileStore(
+                    getattr(c, 'node_profiles_file', None) or
+                    os.path.join(c.logDirectory,
+                                 'pipeline_%s' % c.pipelineName,
+                                 'node_profiles.json'))
+                input_gb = participant_input_gb(sub_dict)
+                n_tuned = node_profiles.apply(
+                    workflow, input_gb,
+                    margin=getattr(c, 'node_resources_margin', 1.2),
+                    max_memory_gb=sub_mem_gb,
+                    max_procs=num_cores_per_sub)
+                logger.info('Resources of {0} nodes set from {1}'.format(
+                    n_tuned, node_profiles.path))
+                cb_log_offset = os.path.getsize(cb_log_filename) \
+                    if os.path.exists(cb_log_filename) else 0
+
             # Add handler to callback log file
             cb_logger = cb_logging.getLogger('callback')
             cb_logger.setLevel(cb_logging.DEBUG)
@@ -411,6 +500,21 @@ Please, make yourself aware of how it works and its assumptions:
 
             if plugin_args['n_procs'] == 1:
                 plugin = 'Linear'
+            elif plugin == 'MultiProc':
+                # the CPU time and I/O of the nodes are recorded, threaded
+                # function nodes get the idle cores, and the outputs used up
+                # by the workflow are reclaimed as it runs
+                thread_budgets = getattr(c, 'node_thread_budgets', True)
+                if getattr(c, 'reclaim_working_directory', False):
+                    plugin = ReclaimingThreadBudgetMultiProcPlugin \
+                        if thread_budgets else ReclaimingMultiProcPlugin
+                    plugin = plugin(plugin_args=plugin_args)
+                elif thread_budgets:
+                    plugin = ThreadBudgetMultiProcPlugin(
+                        plugin_args=plugin_args)
+                else:
+                    plugin = InstrumentedMultiProcPlugin(
+                        plugin_args=plugin_args)
 
             try:
                 # Actually run the pipeline now, for the current subject
@@ -432,6 +536,11 @@ Please, make yourself aware of how it works and its assumptions:
                     "before running C-PAC >=v1.6.2"
                 )
 
+            if node_profiles is not None:
+                handler.flush()
+                node_profiles.update(cb_log_filename, input_gb,
+                                     cb_log_offset)
+
             # PyPEER kick-off
             if 1 in c.run_pypeer:
                 from CPAC.pypeer.peer import prep_for_pypeer
@@ -440,6 +549,10 @@ Please, make yourself aware of how it works and its assumptions:
                                 pipeline_ids, c.peer_stimulus_path, c.peer_gsr,
                                 c.peer_scrub, c.peer_scrub_thresh)
 
+            # Record the completion, for reruns to skip this participant
+            manifests.write(sub_dict, c_hash,
+                            participant_outputs(c, subject_id, pipeline_ids))
+
             # Dump subject info pickle file to subject log dir
             subject_info['status'] = 'Completed'
 
@@ -3263,6 +3376,19 @@ def build_workflow(subject_id, sub_dict, c, pipeline_name=None, num_ants_cores=1
     except:
         encrypt_data = False
 
+    # intermediates written as .nii are gzipped by the sinks
+    compress_nifti = bool(getattr(c, 'uncompressed_intermediates', False))
+    compress_level = int(getattr(c, 'output_compression_level', 6))
+    compress_threads = int(getattr(c, 'output_compression_threads', 1))
+
+    # S3 outputs are uploaded concurrently, and recorded in per-sink
+    # manifests kept in the working directory to skip them on reruns
+    upload_threads = int(getattr(c, 's3_upload_threads', 1))
+    multipart_threshold = int(getattr(c, 's3_multipart_threshold_mb', 64))
+    upload_manifest_dir = os.path.join(
+        c.workingDirectory, 'upload_manifests',
+        'pipeline_{0}'.format(c.pipelineName), subject_id)
+
 
     # TODO enforce value with schema validation
     # Extract credentials path for output if it exists
@@ -3363,6 +3489,13 @@ def build_workflow(subject_id, sub_dict, c, pipeline_name=None, num_ants_cores=1
                 ds.inputs.base_directory = c.outputDirectory
                 ds.inputs.creds_path = creds_path
                 ds.inputs.encrypt_bucket_keys = encrypt_data
+                ds.inputs.compress_nifti = compress_nifti
+                ds.inputs.compress_level = compress_level
+                ds.inputs.compress_threads = compress_threads
+                ds.inputs.upload_threads = upload_threads
+                ds.inputs.multipart_threshold = multipart_threshold
+                ds.inputs.upload_manifest = os.path.join(
+                    upload_manifest_dir, '{0}.json'.format(ds.name))
                 ds.inputs.parameterization = True
                 ds.inputs.regexp_substitutions = [
                     (r'_rename_(.)*/', ''),
@@ -3509,6 +3642,13 @@ def build_workflow(subject_id, sub_dict, c, pipeline_name=None, num_ants_cores=1
                 ds.inputs.base_directory = c.outputDirectory
                 ds.inputs.creds_path = creds_path
                 ds.inputs.encrypt_bucket_keys = encrypt_data
+                ds.inputs.compress_nifti = compress_nifti
+                ds.inputs.compress_level = compress_level
+                ds.inputs.compress_threads = compress_threads
+                ds.inputs.upload_threads = upload_threads
+                ds.inputs.multipart_threshold = multipart_threshold
+                ds.inputs.upload_manifest = os.path.join(
+                    upload_manifest_dir, '{0}.json'.format(ds.name))
                 ds.inputs.container = os.path.join(
                     'pipeline_{0}'.format(pipeline_id), subject_id
                 )
@@ -3570,6 +3710,10 @@ def build_workflow(subject_id, sub_dict, c, pipeline_name=None, num_ants_cores=1
 
                 output_sink_nodes += [(ds, 'out_file')]
 
+    if compress_nifti:
+        # AFNI/FSL nodes write .nii into the working directory
+        set_intermediate_format(workflow, 'NIFTI')
+
     logger.info('\n\n' + 'Pipeline building completed.' + '\n\n')
 
     return workflow, strat_list, pipeline_ids
@@ -7,6 +7,11 @@ from time import strftime
 import yaml
 import yamlordereddictloader
 
+from CPAC.pipeline.completion_manifest import (
+    CompletionManifests,
+    completion_manifest_dir,
+    config_hash
+)
 from CPAC.utils.configuration import Configuration
 from CPAC.utils.ga import track_run
 from CPAC.longitudinal_pipeline.longitudinal_workflow import (
@@ -168,10 +173,116 @@ def run_cpac_on_cluster(config_file, subject_list_file,
         f.write(pid)
 
 
+def create_s3_input_cache(c, sublist):
+    """
+    Build the shared S3 input cache configured in the pipeline
+    configuration, or return None when it is disabled or no participant
+    input is on S3
+    """
+    from CPAC.utils.s3_cache import S3InputCache, participant_s3_paths
+
+    cache_dir = getattr(c, 's3_input_cache_dir', None)
+    if not cache_dir:
+        return None
+
+    if not any(participant_s3_paths(sub) for sub in sublist):
+        return None
+
+    creds_path = None
+    for sub in sublist:
+        if sub.get('creds_path') and \
+                str(sub['creds_path']).lower() not in ('none', 'null'):
+            creds_path = sub['creds_path']
+            break
+
+    return S3InputCache(cache_dir,
+                        getattr(c, 's3_input_cache_max_gb', None),
+                        creds_path=creds_path,
+                        n_threads=getattr(c, 's3_input_cache_threads', 8))
+
+
+def run_participants_packed(sublist, c, run_args, s3_cache=None,
+                            lookahead=1):
+    """
+    Run participants in parallel processes, started as soon as their
+    estimated memory and cores are free on the machine
+
+    Parameters
+    ----------
+    sublist : list
+        participant entries of the data configuration
+    c : CPAC.utils.configuration.Configuration
+    run_args : tuple
+        arguments of run_workflow after the participant and configuration
+    s3_cache : CPAC.utils.s3_cache.S3InputCache or None
+        cache whose files are prefetched for the participants about to run
+    lookahead : integer
+        number of pending participants prefetched beyond the started ones
+    """
+    import copy
+    import time
+    import psutil
+    from multiprocessing import cpu_count
+
+    from CPAC.pipeline.cpac_pipeline import run_workflow
+    from CPAC.pipeline.participant_scheduler import ParticipantScheduler, \
+        estimate_participant_resources
+
+    mem_budget = getattr(c, 'scheduler_memory_gb', None) or \
+        psutil.virtual_memory().total / (1024.0 ** 3)
+    procs_budget = getattr(c, 'scheduler_cores', None) or cpu_count()
+
+    # participants whose images can't be read (on S3) get the configured
+    # memory
+    default_mem = c.maximumMemoryPerParticipant or \
+        mem_budget / c.numParticipantsAtOnce
+
+    scheduler = ParticipantScheduler(mem_budget, procs_budget)
+    for idx, sub in enumerate(sublist):
+        mem_gb, n_procs = estimate_participant_resources(sub, c)
+        scheduler.submit(idx, mem_gb or default_mem, n_procs)
+        print('Participant {0}: {1:.1f} GB, {2} cores{3}'.format(
+            sub.get('subject_id'), mem_gb or default_mem, n_procs,
+            '' if mem_gb else ' (not estimated)'))
+
+    pid = open(os.path.join(c.workingDirectory, 'pid.txt'), 'w')
+
+    processes = {}
+    while len(scheduler):
+        for idx, process in list(processes.items()):
+            if not process.is_alive():
+                scheduler.finish(idx)
+                del processes[idx]
+                if s3_cache is not None:
+                    s3_cache.release_participant(sublist[idx])
+
+        started = scheduler.next_jobs()
+
+        if s3_cache is not None and started:
+            s3_cache.prefetch_participants(
+                [sublist[idx] for idx in started] +
+                [sublist[job[0]] for job in scheduler.pending[:lookahead]])
+
+        for idx in started:
+            # the participant's process is limited to its estimate
+            sub_c = copy.copy(c)
+            sub_c.maximumMemoryPerParticipant = scheduler.running[idx][0]
+            process = Process(target=run_workflow,
+                              args=(sublist[idx], sub_c) + run_args)
+            process.start()
+            print(process.pid, file=pid)
+            processes[idx] = process
+
+        if len(scheduler):
+            time.sleep(2)
+
+    pid.close()
+
+
 # Run C-PAC subjects via job queue
 def run(subject_list_file, config_file=None, p_name=None, plugin=None,
         plugin_args=None, tracking=True, num_subs_at_once=None, debug=False,
-        test_config=False):
+        test_config=False, bids_index=None):
 
     # Import packages
     import subprocess
@@ -199,7 +310,7 @@ def run(subject_list_file, config_file=None, p_name=None, plugin=None,
         from CPAC.utils.bids_utils import collect_bids_files_configs, \
             bids_gen_cpac_sublist
         (file_paths, config) = collect_bids_files_configs(subject_list_file,
-                                                          None)
+                                                          None, bids_index)
         sublist = bids_gen_cpac_sublist(subject_list_file, file_paths,
                                         config, None)
         if not sublist:
@@ -524,11 +635,55 @@ def run(subject_list_file, config_file=None, p_name=None, plugin=None,
 
         # END LONGITUDINAL TEMPLATE PIPELINE
 
+        # Skip the participants that completed with this configuration
+        if getattr(c, 'skip_completed_participants', True):
+            manifests = CompletionManifests(completion_manifest_dir(c))
+            c_hash = config_hash(c)
+            remaining = [sub for sub in sublist
+                         if not manifests.is_complete(sub, c_hash)]
+            if len(remaining) < len(sublist):
+                print("Skipping {0} participants that already completed "
+                      "with this pipeline configuration (see {1})".format(
+                          len(sublist) - len(remaining),
+                          manifests.manifest_dir))
+                sublist = remaining
+                pipeline_timing_info[2] = len(sublist)
+            if not sublist:
+                return
+
+        # Download the S3 inputs of the participants about to run (and of
+        # the next ones in line) in the background
+        s3_cache = create_s3_input_cache(c, sublist)
+        lookahead = getattr(c, 's3_input_cache_prefetch_participants', 1)
+
+        def prefetch(start, stop):
+            if s3_cache is not None:
+                s3_cache.prefetch_participants(
+                    sublist[start:stop + lookahead])
+
+        def release(sub):
+            if s3_cache is not None:
+                s3_cache.release_participant(sub)
+
+        # Pack participants onto the memory and cores of the machine
+        if getattr(c, 'participant_scheduling', 'fixed') == 'bin_packing':
+            run_participants_packed(
+                sublist, c, (True, pipeline_timing_info, p_name, plugin,
+                             plugin_args, test_config),
+                s3_cache, lookahead)
+            if s3_cache is not None:
+                s3_cache.shutdown(wait=False)
+            return
+
         # If it only allows one, run it linearly
         if c.numParticipantsAtOnce == 1:
-            for sub in sublist:
+            for i, sub in enumerate(sublist):
+                prefetch(i, i + 1)
                 run_workflow(sub, c, True, pipeline_timing_info,
                               p_name, plugin, plugin_args, test_config)
+                release(sub)
+            if s3_cache is not None:
+                s3_cache.shutdown(wait=False)
             return
 
         pid = open(os.path.join(c.workingDirectory, 'pid.txt'), 'w')
@@ -546,6 +701,7 @@ def run(subject_list_file, config_file=None, p_name=None, plugin=None,
 
         # If we're allocating more processes than are subjects, run them all
         if len(sublist) <= c.numParticipantsAtOnce:
+            prefetch(0, len(sublist))
             for p in processes:
                 p.start()
                 print(p.pid, file=pid)
@@ -558,6 +714,7 @@ def run(subject_list_file, config_file=None, p_name=None, plugin=None,
                 if len(job_queue) == 0 and idx == 0:
                     # Init subject process index
                     idc = idx
+                    prefetch(idc, idc + c.numParticipantsAtOnce)
                     # Launch processes (one for each subject)
                     for p in processes[idc: idc+c.numParticipantsAtOnce]:
                         p.start()
@@ -574,8 +731,10 @@ def run(subject_list_file, config_file=None, p_name=None, plugin=None,
                             print('found dead job ', job)
                             loc = job_queue.index(job)
                             del job_queue[loc]
+                            release(sublist[processes.index(job)])
                             # ...and start the next available process
                             # (subject)
+                            prefetch(idx, idx + 1)
                             processes[idx].start()
                             # Append this to job queue and increment index
                             job_queue.append(processes[idx])
@@ -583,4 +742,6 @@ def run(subject_list_file, config_file=None, p_name=None, plugin=None,
                     # Add sleep so while loop isn't consuming 100% of CPU
                     time.sleep(2)
         # Close PID txt file to indicate finish
-        pid.close()
\ No newline at end of file
+        pid.close()
+        if s3_cache is not None:
+            s3_cache.shutdown(wait=False)
\ No newline at end of file
@@ -0,0 +1,157 @@
+"""Index of the files of a pipeline output directory, for group analyses
+
+Group analyses look for the derivatives of every participant in the output
+directory of a pipeline, laid out as
+
+    <pipeline>/<participant>_<session>/<resource>/<series>/<strategy...>/file
+
+The directory tree is read once, with os.scandir, into an index of the
+relative paths of its files, which is saved next to the outputs with the
+modification times of the directories read. The next group analyses only
+read again the participants whose directories changed.
+"""
+import json
+import os
+
+# saved index, in the pipeline output directory
+INDEX_FILE = '.cpac_output_index.json'
+
+INDEX_VERSION = 1
+
+
+def _scan(directory, relative=''):
+    """Modification times of the directories, and the files, of a tree"""
+    dirs = {relative: os.stat(directory).st_mtime}
+    files = []
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return dirs, files
+    for entry in entries:
+        if entry.name.startswith('.'):
+            continue
+        path = os.path.join(relative, entry.name) if relative else entry.name
+        if entry.is_dir():
+            sub_dirs, sub_files = _scan(entry.path, path)
+            dirs.update(sub_dirs)
+            files.extend(sub_files)
+        elif entry.is_file():
+            files.append(path)
+    return dirs, files
+
+
+class OutputIndex(object):
+    """
+    Files of a pipeline output directory, by participant
+
+    Parameters
+    ----------
+    pipeline_folder : string
+        output directory of a pipeline (pipeline_<name>)
+    save : boolean
+        save the index in the output directory, when writable
+    """
+
+    def __init__(self, pipeline_folder, save=True):
+        self.pipeline_folder = os.path.abspath(pipeline_folder.rstrip('/'))
+        self.index_file = os.path.join(self.pipeline_folder, INDEX_FILE)
+        self.participants = self._build(save)
+
+    def _load(self):
+        try:
+            with open(self.index_file, 'r') as f:
+                index = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        if index.get('version') != INDEX_VERSION:
+            return {}
+        return index.get('participants', {})
+
+    def _unchanged(self, participant, entry):
+        for relative, mtime in entry['dirs'].items():
+            try:
+                if os.stat(os.path.join(self.pipeline_folder, participant,
+                                        relative)).st_mtime != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def _build(self, save):
+        saved = self._load()
+        participants = {}
+        changed = False
+        try:
+            entries = sorted(os.scandir(self.pipeline_folder),
+                             key=lambda entry: entry.name)
+        except OSError:
+            entries = []
+        for entry in entries:
+            if not entry.is_dir() or entry.name.startswith('.'):
+                continue
+            if entry.name in saved and \
+                    self._unchanged(entry.name, saved[entry.name]):
+                participants[entry.name] = saved[entry.name]
+                continue
+            dirs, files = _scan(entry.path)
+            participants[entry.name] = {'dirs': dirs, 'files': sorted(files)}
+            changed = True
+
+        if save and (changed or set(saved) != set(participants)):
+            partial = '{0}.part-{1}'.format(self.index_file, os.getpid())
+            try:
+                with open(partial, 'w') as f:
+                    json.dump({'version': INDEX_VERSION,
+                               'participants': participants}, f)
+                os.rename(partial, self.index_file)
+            except (IOError, OSError):
+                pass
+
+        return participants
+
+    def paths(self, resources=None, exts=None, min_depth=3):
+        """
+        Paths of the output files
+
+        Parameters
+        ----------
+        resources : list or None
+            resource directories to include, or None for all
+        exts : list or None
+            file extensions to include, or None for all
+        min_depth : integer
+            minimum number of directories between the pipeline directory and
+            the files (participant, resource and series)
+
+        Returns
+        -------
+        paths : list
+        """
+        resources = set(resources) if resources is not None else None
+        exts = tuple(exts) if exts is not None else None
+        paths = []
+        for participant, entry in sorted(self.participants.items()):
+            for relative in entry['files']:
+                pieces = relative.split('/')
+                if len(pieces) < min_depth:
+                    continue
+                if resources is not None and pieces[0] not in resources:
+                    continue
+                if exts is not None and not relative.endswith(exts):
+                    continue
+                paths.append(os.path.join(self.pipeline_folder, participant,
+                                          relative))
+        return paths
+
+    def files_under(self, directory):
+        """Paths of the output files in a directory tree"""
+        relative = os.path.relpath(os.path.abspath(directory),
+                                   self.pipeline_folder)
+        pieces = relative.split(os.sep)
+        entry = self.participants.get(pieces[0])
+        if relative.startswith('..') or entry is None:
+            return []
+        prefix = '/'.join(pieces[1:])
+        return [os.path.join(self.pipeline_folder, pieces[0], path)
+                for path in entry['files']
+                if not prefix or path.startswith(prefix + '/')]
@@ -0,0 +1,191 @@
+"""Memory-aware scheduling of participants on the local machine
+
+Instead of running participants in fixed groups of numParticipantsAtOnce,
+each with the same maximumMemoryPerParticipant, the peak memory of each
+participant is estimated from the headers of its images and the forks of
+the pipeline configuration, and participants are packed onto the memory and
+cores of the machine: the largest pending participant that fits in the free
+resources starts as soon as a running participant finishes.
+"""
+import os
+
+import numpy as np
+
+# in-memory copies of the largest functional run held by the heaviest nodes
+# (motion correction, nuisance regression: input, output and temporaries)
+FUNC_COPIES = 4
+
+# same for the anatomical image (registration, segmentation)
+ANAT_COPIES = 6
+
+# interpreter, nipype and workflow overhead of a participant, in GB
+BASE_MEMORY_GB = 1.0
+
+# nipype refuses to run a node declaring more memory than its participant
+# has, and some nodes of the workflows declare up to 3 GB
+MIN_MEMORY_GB = BASE_MEMORY_GB + 3.0
+
+# pipeline configuration lists that fork the strategies
+FORKING_KEYS = ['skullstrip_option', 'regOption', 'motion_correction',
+                'motion_correction_reference', 'slice_timing_correction',
+                'runBBReg', 'func_reg_input', 'functionalMasking', 'runICA',
+                'runNuisance']
+
+
+def _image_shape(file_path):
+    """Shape from the header of a local image, or None if it can't be read"""
+    import nibabel as nb
+
+    if not isinstance(file_path, str) or file_path.lower().startswith(
+            's3://') or not os.path.exists(file_path):
+        return None
+    try:
+        return nb.load(file_path).header.get_data_shape()
+    except Exception:
+        return None
+
+
+def _image_gb(shape):
+    # images are processed as 32-bit floats
+    return 4 * float(np.prod(shape)) / 1024 ** 3
+
+
+def count_strategies(c):
+    """
+    Number of strategies a pipeline configuration forks into
+
+    Parameters
+    ----------
+    c : CPAC.utils.configuration.Configuration
+
+    Returns
+    -------
+    n_strats : integer
+    """
+    n_strats = 1
+    for key in FORKING_KEYS:
+        options = getattr(c, key, None)
+        if isinstance(options, list) and options:
+            n_strats *= len(set(map(str, options)))
+
+    if 1 in getattr(c, 'runNuisance', []):
+        n_strats *= max(1, len(getattr(c, 'Regressors', None) or []))
+
+    return n_strats
+
+
+def estimate_participant_resources(sub_dict, c):
+    """
+    Estimate the peak memory and the cores a participant needs
+
+    The heaviest nodes hold a few copies of a functional run (or of the
+    anatomical image) in memory, and up to one such node runs per core, for
+    each scan and strategy running in parallel.
+
+    Parameters
+    ----------
+    sub_dict : dictionary
+        participant entry of the data configuration
+    c : CPAC.utils.configuration.Configuration
+
+    Returns
+    -------
+    mem_gb : float or None
+        estimated peak memory, or None when the images can't be read (on S3
+        or missing)
+    n_procs : integer
+        cores of the participant, which are set by maxCoresPerParticipant
+        because the workflow is built for them
+    """
+    n_procs = int(c.maxCoresPerParticipant or 1)
+
+    anat_shape = _image_shape(sub_dict.get('anat'))
+    if anat_shape is None:
+        return None, n_procs
+
+    func_dct = sub_dict.get('func') or sub_dict.get('rest') or {}
+    func_gbs = []
+    for scan in func_dct.values():
+        scan_path = scan.get('scan') if isinstance(scan, dict) else scan
+        func_shape = _image_shape(scan_path)
+        if func_shape is None:
+            return None, n_procs
+        func_gbs.append(_image_gb(func_shape))
+
+    node_gb = ANAT_COPIES * _image_gb(anat_shape)
+    parallel_nodes = min(n_procs, count_strategies(c))
+    if func_gbs and 1 in getattr(c, 'runFunctional', [1]):
+        node_gb = max(node_gb, FUNC_COPIES * max(func_gbs))
+        parallel_nodes = min(n_procs, count_strategies(c) * len(func_gbs))
+
+    mem_gb = max(MIN_MEMORY_GB, BASE_MEMORY_GB + parallel_nodes * node_gb)
+
+    # the centrality nodes reserve their own memory
+    if 1 in getattr(c, 'runNetworkCentrality', [0]):
+        mem_gb = max(mem_gb,
+                     float(getattr(c, 'memoryAllocatedForDegreeCentrality',
+                                   0) or 0) + BASE_MEMORY_GB)
+
+    return mem_gb, n_procs
+
+
+class ParticipantScheduler(object):
+    """
+    Bin-packing queue of participants over a memory and core budget
+
+    Parameters
+    ----------
+    mem_gb : float
+        memory of the machine available to participants
+    n_procs : integer
+        cores of the machine available to participants
+    """
+
+    def __init__(self, mem_gb, n_procs):
+        self.mem_gb = float(mem_gb)
+        self.n_procs = int(n_procs)
+        self.pending = []
+        self.running = {}
+
+    @property
+    def free_mem_gb(self):
+        return self.mem_gb - sum(mem for mem, _ in self.running.values())
+
+    @property
+    def free_procs(self):
+        return self.n_procs - sum(procs for _, procs in self.running.values())
+
+    def submit(self, job_id, mem_gb, n_procs):
+        """Queue a participant with its memory and core demand"""
+        self.pending.append((job_id, float(mem_gb), int(n_procs)))
+        # first fit decreasing: the largest participants are placed first
+        self.pending.sort(key=lambda job: (-job[1], -job[2]))
+
+    def next_jobs(self):
+        """
+        Mark as running, and return, the pending participants that fit in
+        the free resources
+
+        A participant larger than the whole budget starts alone, when nothing
+        else runs, and no smaller participant starts while it waits.
+        """
+        started = []
+        for job in list(self.pending):
+            job_id, mem_gb, n_procs = job
+            if self.running and (mem_gb > self.mem_gb or
+                                 n_procs > self.n_procs):
+                break
+            fits = mem_gb <= self.free_mem_gb and \
+                n_procs <= self.free_procs
+            if fits or not self.running:
+                self.pending.remove(job)
+                self.running[job_id] = (mem_gb, n_procs)
+                started.append(job_id)
+        return started
+
+    def finish(self, job_id):
+        """Release the resources of a participant"""
+        del self.running[job_id]
+
+    def __len__(self):
+        return len(self.pending) + len(self.running)
@@ -0,0 +1,332 @@
+"""nipype plugins for running participant workflows"""
+import glob
+import json
+import logging
+import os
+
+import numpy as np
+
+from nipype.pipeline.engine import MapNode
+from nipype.pipeline.plugins.multiproc import MultiProcPlugin
+
+from CPAC.utils.instrumentation import run_node_instrumented
+from CPAC.utils.interfaces import function
+
+logger = logging.getLogger('nipype.workflow')
+
+
+class InstrumentedMultiProcPlugin(MultiProcPlugin):
+    """
+    MultiProc plugin recording the CPU time and I/O of each node (see
+    CPAC.utils.instrumentation)
+    """
+
+    def _submit_job(self, node, updatehash=False):
+        self._taskid += 1
+
+        # Don't allow streaming outputs
+        if getattr(node.interface, 'terminal_output', '') == 'stream':
+            node.interface.terminal_output = 'allatonce'
+
+        result_future = self.pool.submit(run_node_instrumented, node,
+                                         updatehash, self._taskid)
+        result_future.add_done_callback(self._async_callback)
+        self._task_obj[self._taskid] = result_future
+
+        logger.debug('[MultiProc] Submitted task %s (taskid=%d).',
+                     node.fullname, self._taskid)
+        return self._taskid
+
+
+class ThreadBudgetMultiProcPlugin(InstrumentedMultiProcPlugin):
+    """
+    MultiProc plugin giving the cores left free by the other nodes to the
+    function nodes declared as threaded
+
+    The processes of a participant run with a single BLAS/OpenMP thread.
+    When threaded nodes (CPAC.utils.interfaces.function.Function with
+    threaded=True) are ready to run, the free cores, minus those needed by
+    the other ready nodes, are split between them: each node is scheduled
+    with its share as n_procs, and its function runs with as many threads.
+
+    Without threadpoolctl, the BLAS/OpenMP libraries already loaded by the
+    workers can't be given more threads, and nodes are scheduled as
+    MultiProc would.
+    """
+
+    def _send_procs_to_workers(self, updatehash=False, graph=None):
+        self._budget_threads()
+        return super(ThreadBudgetMultiProcPlugin,
+                     self)._send_procs_to_workers(updatehash, graph)
+
+    def _budget_threads(self):
+        if function.threadpool_limits is None:
+            return
+
+        jobids = np.flatnonzero(
+            ~self.proc_done &
+            np.asarray(self.depidx.sum(axis=0) == 0).ravel())
+
+        threaded = [
+            jobid for jobid in jobids
+            if not isinstance(self.procs[jobid], MapNode) and
+            getattr(self.procs[jobid].interface, 'threaded', False)
+        ]
+        if not threaded:
+            return
+
+        free_processors = self._check_resources(self.pending_tasks)[1]
+        needed = sum(min(self.procs[jobid].n_procs, self.processors)
+                     for jobid in jobids if jobid not in threaded)
+        share = max(1, (free_processors - needed) // len(threaded))
+
+        for jobid in threaded:
+            node = self.procs[jobid]
+            node.n_procs = share
+            node.interface.num_threads = share
+
+
+def _output_files(value):
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            for path in _output_files(item):
+                yield path
+    elif isinstance(value, dict):
+        for item in value.values():
+            for path in _output_files(item):
+                yield path
+
+
+def reclaim_node_outputs(node, min_bytes=0, reclaimed_list='_reclaimed.json'):
+    """
+    Free the disk space of the output files a node wrote in its directory
+
+    Each file is emptied in place, as a sparse file with the same size and
+    modification time, so that it still exists and hashes the same with the
+    'timestamp' hash method. Files linked from elsewhere, or with other hard
+    links, are left untouched.
+
+    Parameters
+    ----------
+    node : nipype.pipeline.engine.Node
+    min_bytes : integer
+        size under which files are kept
+    reclaimed_list : string
+        name of the file, in the node's directory, listing the emptied files
+
+    Returns
+    -------
+    reclaimed_bytes : integer
+    """
+    outdir = os.path.realpath(node.output_dir())
+    outputs = node.result.outputs
+    if outputs is None:
+        return 0
+
+    reclaimed = []
+    reclaimed_bytes = 0
+    for path in set(_output_files(outputs.trait_get())):
+        if os.path.islink(path) or not os.path.isfile(path) or \
+                not os.path.realpath(path).startswith(outdir + os.sep):
+            continue
+        stat = os.stat(path)
+        if stat.st_nlink > 1 or stat.st_size < min_bytes or \
+                stat.st_blocks == 0:
+            continue
+        with open(path, 'r+b') as f:
+            f.truncate(0)
+            f.truncate(stat.st_size)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        reclaimed.append(path)
+        reclaimed_bytes += stat.st_size
+
+    if reclaimed:
+        list_path = os.path.join(outdir, reclaimed_list)
+        try:
+            with open(list_path, 'r') as f:
+                reclaimed += json.load(f)
+        except (IOError, OSError, ValueError):
+            pass
+        with open(list_path, 'w') as f:
+            json.dump(sorted(set(reclaimed)), f, indent=1)
+        logger.info('Reclaimed %.1f MB of outputs of %s',
+                    reclaimed_bytes / 1024.0 ** 2, node)
+
+    return reclaimed_bytes
+
+
+def invalidate_node(node):
+    """Remove the results and hashes of a node, so that it runs again"""
+    outdir = node.output_dir()
+    for path in glob.glob(os.path.join(outdir, 'result_*.pklz')) + \
+            glob.glob(os.path.join(outdir, '_0x*.json')):
+        os.remove(path)
+
+
+def reclaimed_files(paths, reclaimed_list='_reclaimed.json'):
+    """
+    Files among paths emptied by reclaim_node_outputs, by node directory
+
+    Parameters
+    ----------
+    paths : iterable
+        values that may be file paths
+    reclaimed_list : string
+
+    Returns
+    -------
+    reclaimed : dictionary
+        list of reclaimed files by directory of the node that wrote them
+    """
+    lists = {}
+    reclaimed = {}
+    for path in set(paths):
+        if not isinstance(path, str) or not os.path.isfile(path):
+            continue
+        path = os.path.realpath(path)
+        directory = os.path.dirname(path)
+        while True:
+            if directory not in lists:
+                try:
+                    with open(os.path.join(directory, reclaimed_list),
+                              'r') as f:
+                        lists[directory] = set(os.path.realpath(listed)
+                                               for listed in json.load(f))
+                except (IOError, OSError, ValueError):
+                    lists[directory] = None
+            if lists[directory] is not None:
+                if path in lists[directory]:
+                    reclaimed.setdefault(directory, []).append(path)
+                break
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                break
+            directory = parent
+    return reclaimed
+
+
+class ReclaimOutputsMixin(object):
+    """
+    MultiProc plugin mixin freeing the disk space of the outputs of a node as
+    soon as all the nodes consuming them, DataSinks included, have finished
+
+    Nodes passing the files of a node through to their outputs unchanged
+    (such as util.Merge, or functions picking one of their inputs) do not use
+    them up: the nodes consuming theirs become consumers of those files too.
+
+    The reclaimed files are kept, empty, with the node's results and hash
+    files (see reclaim_node_outputs), so that the nodes downstream remain
+    cached when the workflow is run again. If one of them has to run again,
+    it stops with an error, and the nodes whose outputs it needs are
+    invalidated for the next run to recompute them.
+    """
+
+    reclaimed_list = '_reclaimed.json'
+
+    # smaller files (parameters, text outputs) are not worth reclaiming
+    reclaim_min_bytes = 1024 ** 2
+
+    def _generate_dependency_list(self, graph):
+        super(ReclaimOutputsMixin, self)._generate_dependency_list(graph)
+        # the outputs of the nodes without consumers are the ends of the
+        # workflow
+        self._reclaimed = set(np.flatnonzero(
+            np.asarray(self.depidx.sum(axis=1) == 0).ravel()))
+
+    def _task_finished_cb(self, jobid, cached=False):
+        producers = [] if jobid in self.mapnodesubids else \
+            list(self.refidx[:, jobid].nonzero()[0])
+        super(ReclaimOutputsMixin, self)._task_finished_cb(jobid, cached)
+        self._hold_forwarded_outputs(jobid, producers)
+        self._reclaim_outputs()
+
+    def _hold_forwarded_outputs(self, jobid, producers):
+        """
+        Make the consumers of a node that finished consumers of the nodes
+        whose files it passed through to its outputs
+        """
+        if not producers:
+            return
+        try:
+            outputs = self.procs[jobid].result.outputs
+        except Exception:
+            outputs = None
+        if outputs is None:
+            return
+        paths = [os.path.realpath(path)
+                 for path in set(_output_files(outputs.trait_get()))
+                 if os.path.isabs(path)]
+        if not paths:
+            return
+
+        consumers = [idx for idx in self.refidx[jobid, :].nonzero()[1]
+                     if idx != jobid]
+        for idx in producers:
+            outdir = os.path.realpath(self.procs[idx].output_dir()) + os.sep
+            if not any(path.startswith(outdir) for path in paths):
+                continue
+            if not consumers:
+                # passed through to the end of the workflow: kept
+                self._reclaimed.add(idx)
+            for consumer in consumers:
+                self.refidx[idx, consumer] = 1
+
+    def _reclaim_outputs(self):
+        consumed = np.flatnonzero(
+            np.asarray(self.refidx.sum(axis=1) == 0).ravel())
+        for idx in consumed:
+            if idx in self._reclaimed or idx in self.mapnodesubids or \
+                    not self.proc_done[idx] or self.proc_pending[idx]:
+                continue
+            self._reclaimed.add(idx)
+            try:
+                reclaim_node_outputs(self.procs[idx], self.reclaim_min_bytes,
+                                     self.reclaimed_list)
+            except Exception as e:
+                logger.warning('Could not reclaim the outputs of %s: %s',
+                               self.procs[idx], e)
+
+    def _local_hash_check(self, jobid, graph):
+        if super(ReclaimOutputsMixin, self)._local_hash_check(jobid, graph):
+            return True
+        if jobid in self.mapnodesubids:
+            return False
+
+        # the inputs are those of the hash check
+        node = self.procs[jobid]
+        reclaimed_dirs = reclaimed_files(
+            _output_files(node.inputs.trait_get()), self.reclaimed_list)
+        if not reclaimed_dirs:
+            return False
+        reclaimed = [
+            proc for idx, proc in enumerate(self.procs)
+            if idx not in self.mapnodesubids and
+            os.path.realpath(proc.output_dir()) in reclaimed_dirs
+        ]
+
+        for node in reclaimed:
+            invalidate_node(node)
+        error = 'The outputs of {0}, which {1} needs, were reclaimed ' \
+                'during a previous run: run the workflow again to ' \
+                'recompute them.\n'.format(
+                    ', '.join(str(node) for node in reclaimed) or
+                    ', '.join(sorted(reclaimed_dirs)),
+                    self.procs[jobid])
+        self._clean_queue(jobid, graph,
+                          result={'result': None, 'traceback': error})
+        if hasattr(self, '_run_errors'):
+            self._run_errors.append(error)
+        return True
+
+
+class ReclaimingMultiProcPlugin(ReclaimOutputsMixin,
+                                InstrumentedMultiProcPlugin):
+    """MultiProc plugin reclaiming the outputs used up by the workflow"""
+
+
+class ReclaimingThreadBudgetMultiProcPlugin(ReclaimOutputsMixin,
+                                            ThreadBudgetMultiProcPlugin):
+    """ThreadBudgetMultiProcPlugin reclaiming the outputs used up by the
+    workflow"""
@@ -16,18 +16,40 @@ schema = Schema({
 
     'awsOutputBucketCredentials': str,
     's3Encryption': bool,  # check/normalize
+    's3_upload_threads': All(int, Range(min=1)),
+    's3_multipart_threshold_mb': All(int, Range(min=5)),
 
     'maximumMemoryPerParticipant': float,
     'maxCoresPerParticipant': All(int, Range(min=1)),
     'numParticipantsAtOnce': All(int, Range(min=1)),
+    'participant_scheduling': In(['fixed', 'bin_packing']),
+    'scheduler_memory_gb': Any(None, int, float),
+    'scheduler_cores': Any(None, All(int, Range(min=1))),
+    'tune_node_resources': bool,
+    'node_resources_margin': All(Any(int, float), Range(min=1)),
+    'node_profiles_file': Any(None, str),
+    'node_thread_budgets': bool,
     'num_ants_threads': All(int, Range(min=1)),
 
     'write_func_outputs': bool,
     'write_debugging_outputs': bool,  # check/normalize
     'generateQualityControlImages': bool, # check/normalize
     'removeWorkingDir': bool,
+    'reclaim_working_directory': bool,
+    'skip_completed_participants': bool,
+    'completion_manifest_dir': Any(None, str),
     'run_logging': bool,
     'reGenerateOutputs': bool, # check/normalize
+    'uncompressed_intermediates': bool,
+    'output_compression_level': All(int, Range(min=1, max=9)),
+    'output_compression_threads': All(int, Range(min=1)),
+    's3_input_cache_dir': Any(None, str),
+    's3_input_cache_max_gb': Any(None, int, float),
+    's3_input_cache_threads': All(int, Range(min=1)),
+    's3_input_cache_prefetch_participants': All(int, Range(min=0)),
+    'share_resampled_templates': bool,
+    'template_cache_dir': Any(None, str),
+    'workflow_cache_dir': Any(None, str),
     'runSymbolicLinks': bool, # check/normalize
 
     'resolution_for_anat': All(str, Match(r'^[0-9]+mm$')),
@@ -163,6 +185,8 @@ schema = Schema({
     'mrsNorm': bool,
 
     'runVMHC': bool,
+    'vmhc_in_process': bool,
+    'motion_correction_chunk_in_process': bool,
 
     'runALFF': bool,
     'highPassFreqALFF': [float],
@@ -0,0 +1,47 @@
+import os
+
+from CPAC.pipeline.completion_manifest import (CompletionManifests,
+                                               config_hash,
+                                               participant_outputs)
+from CPAC.utils.configuration import Configuration
+
+
+def test_completion_manifests(tmpdir):
+    anat = tmpdir.join('sub-01_T1w.nii.gz')
+    anat.write('anat')
+    sub_dict = {'subject_id': 'sub-01', 'unique_id': 'ses-1',
+                'anat': str(anat),
+                'func': {'rest': {'scan': 's3://bucket/sub-01_bold.nii.gz'}}}
+    output = tmpdir.join('output', 'pipeline_analysis', 'sub-01_ses-1',
+                         'anatomical_brain', 'brain.nii.gz')
+    output.write('brain', ensure=True)
+
+    c = Configuration({'pipelineName': 'analysis',
+                       'outputDirectory': str(tmpdir.join('output')),
+                       'logDirectory': str(tmpdir.join('log')),
+                       'numParticipantsAtOnce': 1})
+    outputs = participant_outputs(c, 'sub-01_ses-1', ['analysis'])
+    assert outputs == [str(output)]
+
+    manifests = CompletionManifests(str(tmpdir.join('completed')))
+    manifests.write(sub_dict, config_hash(c), outputs)
+    assert manifests.is_complete(sub_dict, config_hash(c))
+
+    # running it differently doesn't change the outputs
+    c.numParticipantsAtOnce = 4
+    assert manifests.is_complete(sub_dict, config_hash(c))
+
+    c.pipelineName = 'other'
+    assert not manifests.is_complete(sub_dict, config_hash(c))
+    c.pipelineName = 'analysis'
+
+    os.utime(str(anat), (0, 0))
+    assert not manifests.is_complete(sub_dict, config_hash(c))
+    manifests.write(sub_dict, config_hash(c), outputs)
+    assert manifests.is_complete(sub_dict, config_hash(c))
+
+    output.remove()
+    assert not manifests.is_complete(sub_dict, config_hash(c))
+
+    manifests.remove(sub_dict)
+    assert not os.path.exists(manifests.path('sub-01_ses-1'))
@@ -0,0 +1,42 @@
+import nibabel as nb
+import numpy as np
+import pytest
+
+from CPAC.pipeline.cpac_ga_model_generator import (check_merged_file,
+                                                   merge_copefile_and_mask)
+
+
+def _maps(tmpdir, n=4, shape=(5, 6, 7)):
+    rng = np.random.RandomState(0)
+    affine = np.diag([3.0, 3.0, 3.0, 1.0])
+    paths, volumes = [], []
+    for i in range(n):
+        volume = rng.randn(*shape).astype(np.float32)
+        volume[rng.rand(*shape) < 0.1] = 0
+        path = str(tmpdir.join('sub-%d_map.nii.gz' % i))
+        nb.save(nb.Nifti1Image(volume, affine), path)
+        paths.append(path)
+        volumes.append(volume)
+    return paths, volumes
+
+
+def test_merge_copefile_and_mask(tmpdir):
+    paths, volumes = _maps(tmpdir)
+    merged_file = str(tmpdir.join('merged.nii.gz'))
+    mask_file = str(tmpdir.join('merged_mask.nii.gz'))
+
+    assert merge_copefile_and_mask(paths, merged_file, mask_file) == (
+        merged_file, mask_file)
+
+    merged = np.stack(volumes, axis=-1)
+    np.testing.assert_array_equal(nb.load(merged_file).get_fdata(), merged)
+    # fslmaths -abs -Tmin -bin
+    np.testing.assert_array_equal(
+        nb.load(mask_file).get_fdata(),
+        (np.abs(merged).min(axis=-1) > 0).astype(float))
+    assert not [path for path in tmpdir.listdir()
+                if '.part-' in path.basename]
+
+    check_merged_file(paths, merged_file)
+    with pytest.raises(Exception, match='volume 0'):
+        check_merged_file(paths[::-1], merged_file)
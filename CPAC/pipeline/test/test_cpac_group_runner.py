@@ -6,3 +6,34 @@ def run_gather_outputs_func(pipeline_out_dir):
                                 None, False, False, get_func=True)
     print(df_dct)
 
+
+
+def test_find_feat_models(tmpdir):
+    import nibabel as nb
+    import numpy as np
+    from CPAC.pipeline.cpac_ga_model_generator import merge_copefile_and_mask
+    from CPAC.pipeline.cpac_group_runner import find_feat_models
+
+    model_files = tmpdir.join('alff', '_scan_rest', '_hp_0.01', 'model_files')
+    model_files.ensure(dir=True)
+    maps = []
+    for i in range(2):
+        path = str(tmpdir.join('sub-%d.nii.gz' % i))
+        nb.save(nb.Nifti1Image(np.ones((2, 2, 2), dtype=np.float32),
+                               np.eye(4)), path)
+        maps.append(path)
+    merged = str(model_files.join('model_alff_merged.nii.gz'))
+    mask = str(model_files.join('model_alff_merged_mask.nii.gz'))
+    merge_copefile_and_mask(maps, merged, mask)
+    model_files.join('design_matrix.csv').write('')
+
+    # the checksums of the merged volumes are not mistaken for the merged
+    # file
+    assert len(model_files.listdir()) == 4
+    models = find_feat_models(str(tmpdir))
+    assert list(models.values()) == [{
+        'merged': merged,
+        'merged_mask': mask,
+        'design_matrix': str(model_files.join('design_matrix.csv')),
+        'dir_path': str(tmpdir.join('alff', '_scan_rest', '_hp_0.01')) + '/'
+    }]
@@ -0,0 +1,54 @@
+import os
+
+from CPAC.pipeline import output_index
+from CPAC.pipeline.cpac_group_runner import gather_outputs
+from CPAC.pipeline.output_index import INDEX_FILE, OutputIndex
+
+
+def _output(pipeline_dir, participant, resource, *strategy):
+    path = pipeline_dir.join(participant, resource, '_scan_rest', *strategy)
+    path.write('', ensure=True)
+    return str(path)
+
+
+def test_output_index(tmpdir, monkeypatch):
+    pipeline_dir = tmpdir.join('pipeline_analysis')
+    alff = _output(pipeline_dir, 'sub-1_ses-1', 'alff_to_standard_zstd',
+                   '_hp_0.01', 'alff_zstd.nii.gz')
+    _output(pipeline_dir, 'sub-1_ses-1', 'alff_to_standard_zstd',
+            '_hp_0.01', '.hidden.nii.gz')
+    _output(pipeline_dir, 'sub-1_ses-1', 'power_params', 'pow_params.txt')
+
+    index = OutputIndex(str(pipeline_dir))
+    assert index.paths(['alff_to_standard_zstd'], ['.nii.gz']) == [alff]
+    assert index.files_under(str(pipeline_dir.join(
+        'sub-1_ses-1', 'power_params'))) == [str(pipeline_dir.join(
+            'sub-1_ses-1', 'power_params', '_scan_rest', 'pow_params.txt'))]
+    assert pipeline_dir.join(INDEX_FILE).exists()
+
+    scanned = []
+    scan = output_index._scan
+
+    def counting_scan(directory, relative=''):
+        if not relative:
+            scanned.append(os.path.basename(directory))
+        return scan(directory, relative)
+
+    monkeypatch.setattr(output_index, '_scan', counting_scan)
+
+    # only the new participant is read
+    alff_2 = _output(pipeline_dir, 'sub-2_ses-1', 'alff_to_standard_zstd',
+                     '_hp_0.01', 'alff_zstd.nii.gz')
+    index = OutputIndex(str(pipeline_dir))
+    assert scanned == ['sub-2_ses-1']
+    assert index.paths(['alff_to_standard_zstd'], ['.nii.gz']) == \
+        [alff, alff_2]
+
+    output_df_dict = gather_outputs(str(pipeline_dir), ['alff'], None,
+                                    False, False,
+                                    derivatives=['alff_to_standard_zstd'])
+    unique_resource_id = ('alff_to_standard_zstd', '_hp_0.01_alff_zstd')
+    assert list(output_df_dict) == [unique_resource_id]
+    df = output_df_dict[unique_resource_id]
+    assert list(df.participant_id) == ['sub-1', 'sub-2']
+    assert list(df.Filepath) == [alff, alff_2]
@@ -0,0 +1,68 @@
+import os
+
+import nibabel as nb
+
+from CPAC.pipeline.participant_scheduler import MIN_MEMORY_GB, \
+    ParticipantScheduler, count_strategies, estimate_participant_resources
+from CPAC.utils.configuration import Configuration
+
+
+def test_participant_scheduler():
+    scheduler = ParticipantScheduler(mem_gb=16, n_procs=8)
+    for job_id, mem_gb in [('small', 3), ('large', 11), ('medium', 6),
+                           ('tiny', 2)]:
+        scheduler.submit(job_id, mem_gb, 2)
+
+    # the largest participants are placed first, and the small ones fill
+    # the memory left
+    assert scheduler.next_jobs() == ['large', 'small', 'tiny']
+    assert scheduler.free_mem_gb == 0 and scheduler.free_procs == 2
+    assert scheduler.next_jobs() == []
+
+    scheduler.finish('tiny')
+    assert scheduler.next_jobs() == []
+    scheduler.finish('large')
+    assert scheduler.next_jobs() == ['medium']
+
+    # a participant larger than the machine runs alone
+    scheduler.submit('huge', 32, 2)
+    scheduler.submit('tiny', 1, 2)
+    assert scheduler.next_jobs() == []
+    scheduler.finish('small')
+    scheduler.finish('medium')
+    assert scheduler.next_jobs() == ['huge']
+    scheduler.finish('huge')
+    assert scheduler.next_jobs() == ['tiny']
+    scheduler.finish('tiny')
+    assert len(scheduler) == 0
+
+
+def test_estimate_participant_resources(tmpdir):
+    def image(name, shape):
+        # only the header is read
+        path = os.path.join(str(tmpdir), name)
+        header = nb.Nifti1Header()
+        header.set_data_shape(shape)
+        with open(path, 'wb') as f:
+            header.write_to(f)
+        return path
+
+    c = Configuration({'maxCoresPerParticipant': 4,
+                       'regOption': ['ANTS', 'FSL'],
+                       'runNuisance': [0]})
+    assert count_strategies(c) == 2
+
+    sub_dict = {'anat': image('anat.nii', (16, 16, 16)),
+                'func': {'rest': {'scan': image('rest.nii',
+                                                (64, 64, 40, 2000))}}}
+    mem_gb, n_procs = estimate_participant_resources(sub_dict, c)
+    assert n_procs == 4
+    # two strategies of four copies of a 1.22 GB run
+    assert round(mem_gb, 1) == round(1 + 2 * 4 * 64 * 64 * 40 * 2000 * 4 /
+                                     1024.0 ** 3, 1)
+
+    sub_dict['func']['rest']['scan'] = image('rest.nii', (64, 64, 40, 10))
+    assert estimate_participant_resources(sub_dict, c)[0] == MIN_MEMORY_GB
+
+    sub_dict['func']['rest']['scan'] = 's3://bucket/rest.nii.gz'
+    assert estimate_participant_resources(sub_dict, c) == (None, 4)
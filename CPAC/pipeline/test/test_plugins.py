@@ -0,0 +1,210 @@
+import os
+
+import nipype.interfaces.utility as util
+import nipype.pipeline.engine as pe
+import pytest
+
+from CPAC.pipeline.plugins import (InstrumentedMultiProcPlugin,
+                                   ReclaimingMultiProcPlugin,
+                                   ThreadBudgetMultiProcPlugin)
+from CPAC.utils.instrumentation import node_instrumentation
+from CPAC.utils.interfaces.function import Function
+
+
+def omp_threads(in_value):
+    import os
+    return os.environ.get('OMP_NUM_THREADS')
+
+
+def _thread_budget_workflow(base_dir):
+    workflow = pe.Workflow(name='thread_budget', base_dir=base_dir)
+
+    nodes = []
+    for name, threaded in [('threaded_a', True), ('threaded_b', True),
+                           ('single', False)]:
+        node = pe.Node(Function(input_names=['in_value'],
+                                output_names=['threads'],
+                                function=omp_threads,
+                                threaded=threaded),
+                       name=name)
+        node.inputs.in_value = name
+        workflow.add_nodes([node])
+        nodes.append(node)
+    return workflow
+
+
+def test_thread_budget_multiproc(tmpdir):
+    pytest.importorskip('threadpoolctl')
+    graph = _thread_budget_workflow(str(tmpdir)).run(
+        plugin=ThreadBudgetMultiProcPlugin(
+            plugin_args={'n_procs': 5, 'memory_gb': 1}))
+
+    threads = {node.name: node.result.outputs.threads
+               for node in graph.nodes()}
+    # the single-threaded node keeps a core, the others share the rest
+    assert threads['threaded_a'] == threads['threaded_b'] == '2'
+    assert threads['single'] != '2'
+
+
+def test_thread_budget_without_threadpoolctl(tmpdir, monkeypatch):
+    from CPAC.utils.interfaces import function
+    monkeypatch.setattr(function, 'threadpool_limits', None)
+
+    graph = _thread_budget_workflow(str(tmpdir)).run(
+        plugin=ThreadBudgetMultiProcPlugin(
+            plugin_args={'n_procs': 5, 'memory_gb': 1}))
+
+    # no threads the workers' BLAS would ignore, no cores reserved for them
+    for node in graph.nodes():
+        assert node.n_procs == 1
+        assert node.result.outputs.threads != '2'
+
+
+def write_image(in_value):
+    import os
+    out_file = os.path.abspath('image.nii')
+    with open(out_file, 'wb') as f:
+        f.write(b'\1' * (2 * 1024 ** 2))
+    return out_file
+
+
+def read_image(in_file, scale):
+    import os
+    with open(in_file, 'rb') as f:
+        content = f.read()
+    if not any(content):
+        raise ValueError('empty input')
+    out_file = os.path.abspath('scaled.nii')
+    with open(out_file, 'wb') as f:
+        f.write(content * scale)
+    return out_file
+
+
+def _reclaim_workflow(base_dir, scale=1):
+    workflow = pe.Workflow(name='reclaim', base_dir=base_dir)
+    workflow.config['execution']['crashdump_dir'] = base_dir
+    write = pe.Node(Function(input_names=['in_value'],
+                             output_names=['out_file'],
+                             function=write_image), name='write')
+    write.inputs.in_value = 1
+    scaled = pe.Node(Function(input_names=['in_file', 'scale'],
+                              output_names=['out_file'],
+                              function=read_image), name='scaled')
+    scaled.inputs.scale = scale
+    again = pe.Node(Function(input_names=['in_file', 'scale'],
+                             output_names=['out_file'],
+                             function=read_image), name='again')
+    again.inputs.scale = 1
+    workflow.connect(write, 'out_file', scaled, 'in_file')
+    workflow.connect(scaled, 'out_file', again, 'in_file')
+    return workflow
+
+
+def test_reclaiming_multiproc(tmpdir):
+    plugin_args = {'n_procs': 2, 'memory_gb': 1}
+    _reclaim_workflow(str(tmpdir)).run(
+        plugin=ReclaimingMultiProcPlugin(plugin_args=plugin_args))
+
+    image = tmpdir.join('reclaim', 'write', 'image.nii')
+    scaled = tmpdir.join('reclaim', 'scaled', 'scaled.nii')
+    final = tmpdir.join('reclaim', 'again', 'scaled.nii')
+    # used up: emptied, as sparse files of the same size
+    for path in [image, scaled]:
+        assert os.path.getsize(str(path)) == 2 * 1024 ** 2
+        assert os.stat(str(path)).st_blocks == 0
+        assert not any(path.read_binary())
+    # end of the workflow: kept
+    assert any(final.read_binary())
+
+    # the consumers remain cached
+    mtime = os.path.getmtime(str(final))
+    _reclaim_workflow(str(tmpdir)).run(
+        plugin=ReclaimingMultiProcPlugin(plugin_args=plugin_args))
+    assert os.path.getmtime(str(final)) == mtime
+
+    # a consumer to run again stops, and its inputs are recomputed next
+    with pytest.raises(RuntimeError):
+        _reclaim_workflow(str(tmpdir), scale=2).run(
+            plugin=ReclaimingMultiProcPlugin(plugin_args=plugin_args))
+    _reclaim_workflow(str(tmpdir), scale=2).run(
+        plugin=ReclaimingMultiProcPlugin(plugin_args=plugin_args))
+    assert os.path.getsize(str(final)) == 4 * 1024 ** 2
+
+
+def read_first_image(in_files):
+    import os
+    with open(in_files[0], 'rb') as f:
+        content = f.read()
+    out_file = os.path.abspath('scaled.nii')
+    with open(out_file, 'wb') as f:
+        f.write(content)
+    return out_file
+
+
+def _pass_through_workflow(base_dir, read_image=True):
+    workflow = pe.Workflow(name='pass_through', base_dir=base_dir)
+    workflow.config['execution']['crashdump_dir'] = base_dir
+    write = pe.Node(Function(input_names=['in_value'],
+                             output_names=['out_file'],
+                             function=write_image), name='write')
+    write.inputs.in_value = 1
+    merge = pe.Node(util.Merge(1), name='merge')
+    workflow.connect(write, 'out_file', merge, 'in1')
+    if read_image:
+        read = pe.Node(Function(input_names=['in_files'],
+                                output_names=['out_file'],
+                                function=read_first_image), name='read')
+        workflow.connect(merge, 'out', read, 'in_files')
+    return workflow
+
+
+def test_reclaiming_multiproc_pass_through(tmpdir):
+    plugin_args = {'n_procs': 2, 'memory_gb': 1}
+
+    # util.Merge passes the image through: it is only used up once the
+    # node reading it through the list finishes
+    _pass_through_workflow(str(tmpdir.join('read'))).run(
+        plugin=ReclaimingMultiProcPlugin(plugin_args=plugin_args))
+    image = tmpdir.join('read', 'pass_through', 'write', 'image.nii')
+    final = tmpdir.join('read', 'pass_through', 'read', 'scaled.nii')
+    assert sum(final.read_binary()) == 2 * 1024 ** 2
+    assert not any(image.read_binary())
+
+    # passed through to the end of the workflow: kept
+    _pass_through_workflow(str(tmpdir.join('end')), read_image=False).run(
+        plugin=ReclaimingMultiProcPlugin(plugin_args=plugin_args))
+    image = tmpdir.join('end', 'pass_through', 'write', 'image.nii')
+    assert any(image.read_binary())
+
+
+def make_image(shape):
+    import os
+    import nibabel as nb
+    import numpy as np
+    from CPAC.utils.interfaces.function import stage
+
+    with stage('compute'):
+        data = np.ones(shape, dtype=np.float32)
+    with stage('write'):
+        out_file = os.path.abspath('image.nii.gz')
+        nb.Nifti1Image(data, np.eye(4)).to_filename(out_file)
+    return out_file
+
+
+def test_instrumented_multiproc(tmpdir):
+    workflow = pe.Workflow(name='instrumented', base_dir=str(tmpdir))
+    image = pe.Node(Function(input_names=['shape'],
+                             output_names=['out_file'],
+                             function=make_image), name='image')
+    image.inputs.shape = (4, 5, 6, 3)
+    workflow.add_nodes([image])
+
+    graph = workflow.run(plugin=InstrumentedMultiProcPlugin(
+        plugin_args={'n_procs': 2, 'memory_gb': 1}))
+
+    usage = node_instrumentation(list(graph.nodes())[0])
+    assert usage['cpu_user_s'] + usage['cpu_system_s'] > 0
+    assert usage['write_bytes'] >= 0 and usage['output_bytes'] > 0
+    assert usage['output_dimensions'] == {'out_file': [[4, 5, 6, 3]]}
+    assert usage['input_dimensions'] == {}
+    assert sorted(usage['stage_timings']) == ['compute', 'write']
@@ -0,0 +1,89 @@
+import os
+
+import nipype.interfaces.utility as util
+import nipype.pipeline.engine as pe
+
+from CPAC.pipeline.workflow_cache import WorkflowCache, sub_dict_shape
+from CPAC.utils.datasource import create_func_datasource
+from CPAC.utils.interfaces.datasink import DataSink
+
+
+def _sub_dict(sub):
+    return {
+        'subject_id': sub,
+        'unique_id': 'ses-1',
+        'anat': '/data/{0}/anat/T1w.nii.gz'.format(sub),
+        'func': {
+            'rest': {
+                'scan': '/data/{0}/func/rest_bold.nii.gz'.format(sub),
+                'scan_parameters': {'TR': 2.0}
+            }
+        },
+        'creds_path': None
+    }
+
+
+def _build(subject_id, sub_dict):
+    workflow = pe.Workflow(name='resting_preproc_' + subject_id)
+
+    anat = pe.Node(util.IdentityInterface(fields=['subject', 'anat']),
+                   name='anat_gather_0')
+    anat.inputs.subject = subject_id
+    anat.inputs.anat = sub_dict['anat']
+
+    func_wf = create_func_datasource(sub_dict['func'], 'func_gather_0')
+    func_wf.inputs.inputnode.subject = subject_id
+    func_wf.inputs.inputnode.dl_dir = '/tmp'
+    func_wf.get_node('inputnode').iterables = \
+        ('scan', list(sub_dict['func'].keys()))
+
+    ds = pe.Node(DataSink(), name='sinker_0_anatomical_brain')
+    ds.inputs.base_directory = '/output'
+    ds.inputs.container = os.path.join('pipeline_test', subject_id)
+    workflow.connect(anat, 'anat', ds, 'anatomical_brain')
+    workflow.connect(func_wf, 'outputspec.rest', ds, 'functional')
+
+    return workflow
+
+
+def test_sub_dict_shape():
+    assert sub_dict_shape(_sub_dict('sub-01_ses-1')) == \
+        sub_dict_shape(_sub_dict('sub-02_ses-1'))
+
+    fmap = _sub_dict('sub-02_ses-1')
+    fmap['fmap'] = {'diff_phase': {'scan': '/data/phasediff.nii.gz'}}
+    assert sub_dict_shape(fmap) != sub_dict_shape(_sub_dict('sub-01_ses-1'))
+
+    masked = _sub_dict('sub-02_ses-1')
+    masked['brain_mask'] = 'None'
+    assert sub_dict_shape(masked) == \
+        sub_dict_shape(dict(_sub_dict('sub-01_ses-1'), brain_mask=None))
+
+
+def test_workflow_cache(tmpdir):
+    old = _sub_dict('sub-01_ses-1')
+    new = _sub_dict('sub-02_ses-1')
+    new['func']['rest']['scan_parameters']['TR'] = 2.5
+
+    cache = WorkflowCache(str(tmpdir))
+    workflow = _build('sub-01_ses-1', old)
+    cache.save('key', (workflow, [], ['test']), 'sub-01_ses-1', old)
+
+    assert cache.load('other', 'sub-02_ses-1', new) is None
+
+    stamped, _, pipeline_ids = cache.load('key', 'sub-02_ses-1', new)
+    assert pipeline_ids == ['test']
+
+    expected = _build('sub-02_ses-1', new)
+    assert stamped.name == expected.name
+    stamped_nodes = {node.fullname: node.inputs.get()
+                     for node in stamped._get_all_nodes()}
+    assert stamped_nodes == {node.fullname: node.inputs.get()
+                             for node in expected._get_all_nodes()}
+    assert stamped_nodes['func_gather_0.check_func_scan'][
+        'func_scan_dct']['rest']['scan_parameters']['TR'] == 2.5
+
+    # the cached workflow is left as it was built
+    stamped, _, _ = cache.load('key', 'sub-01_ses-1', old)
+    assert stamped.get_node('sinker_0_anatomical_brain').inputs.container == \
+        os.path.join('pipeline_test', 'sub-01_ses-1')
@@ -0,0 +1,264 @@
+"""Persistent cache of built participant workflows
+
+Building the nipype graph of a participant takes as long as several of its
+short nodes, and it is repeated, identically, for every participant of a
+data configuration. Participants only differ in the values fed into the
+graph, so a built workflow is pickled the first time a pipeline
+configuration meets a data configuration "shape" (which scans, field maps and
+optional anatomical inputs exist), and reused for the next participants with
+the same shape after stamping their own inputs in:
+
+- the file paths of the data configuration, and its scan and field map
+  dictionaries, wherever they are node inputs;
+- the participant ID, in the workflow name and as a path component of the
+  sinks' containers and manifests.
+"""
+import copy
+import hashlib
+import json
+import os
+import pickle
+
+from nipype import logging
+
+import CPAC
+
+logger = logging.getLogger('nipype.workflow')
+
+# configuration keys only used to run the workflow, which can differ between
+# participants sharing it
+RUNTIME_KEYS = ['maximumMemoryPerParticipant', 'numParticipantsAtOnce']
+
+
+def sub_dict_shape(sub_dict):
+    """
+    Summarize the structure of a data configuration entry: keys, list
+    lengths and types, with the values that change the workflow (blank or
+    'None' strings) but without the file paths
+
+    Parameters
+    ----------
+    sub_dict : dictionary
+        participant entry of the data configuration
+
+    Returns
+    -------
+    shape : JSON-serializable structure
+    """
+    if isinstance(sub_dict, dict):
+        return {str(key): sub_dict_shape(value)
+                for key, value in sub_dict.items()}
+    if isinstance(sub_dict, (list, tuple)):
+        return [sub_dict_shape(value) for value in sub_dict]
+    if sub_dict is None or isinstance(sub_dict, str) and (
+            not sub_dict or sub_dict.lower() == 'none'):
+        return 'none'
+    if isinstance(sub_dict, str):
+        return 's3' if sub_dict.lower().startswith('s3://') else 'str'
+    return type(sub_dict).__name__
+
+
+def workflow_cache_key(c, sub_dict, pipeline_name=None, num_ants_cores=1):
+    """
+    Hash of everything a built workflow depends on, except for the
+    participant's own input values
+
+    Parameters
+    ----------
+    c : CPAC.utils.configuration.Configuration
+        pipeline configuration, before build_workflow replaces its templates
+        with nodes
+    sub_dict : dictionary
+        participant entry of the data configuration
+    pipeline_name : string or None
+    num_ants_cores : integer
+
+    Returns
+    -------
+    key : string
+    """
+    key = {
+        'version': CPAC.__version__,
+        'config': {name: value for name, value in vars(c).items()
+                   if name not in RUNTIME_KEYS},
+        'shape': sub_dict_shape(sub_dict),
+        'pipeline_name': pipeline_name,
+        'num_ants_cores': num_ants_cores
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True,
+                                   default=str).encode('utf-8')).hexdigest()
+
+
+def _input_pairs(template, participant):
+    """Pair the values of a template participant with those of another
+    participant of the same shape, largest containers first"""
+    pairs = []
+
+    if isinstance(template, dict):
+        if template != participant:
+            pairs.append((template, participant))
+        for key in template:
+            pairs += _input_pairs(template[key], participant[key])
+    elif isinstance(template, (list, tuple)):
+        if template != participant:
+            pairs.append((template, participant))
+        for old, new in zip(template, participant):
+            pairs += _input_pairs(old, new)
+    elif isinstance(template, str) and template != participant and \
+            (os.sep in template or '://' in template):
+        # only paths: short strings and numbers (scan parameters) could
+        # match unrelated node inputs
+        pairs.append((template, participant))
+
+    return pairs
+
+
+def _stamp(value, pairs, old_id, new_id):
+    for old, new in pairs:
+        if type(value) is type(old) and value == old:
+            return copy.deepcopy(new)
+
+    if isinstance(value, dict):
+        return {key: _stamp(val, pairs, old_id, new_id)
+                for key, val in value.items()}
+    if isinstance(value, list):
+        return [_stamp(val, pairs, old_id, new_id) for val in value]
+    if isinstance(value, tuple):
+        return tuple(_stamp(val, pairs, old_id, new_id) for val in value)
+    if isinstance(value, str) and old_id in value.split(os.sep):
+        return os.sep.join(new_id if part == old_id else part
+                           for part in value.split(os.sep))
+    return value
+
+
+def stamp_workflow(workflow, template, participant):
+    """
+    Replace the inputs of the participant a workflow was built for by those
+    of another participant with the same data configuration shape
+
+    Parameters
+    ----------
+    workflow : nipype.pipeline.engine.Workflow
+        workflow built for the template participant, modified in place
+    template : dictionary
+        'subject_id', 'sub_dict' and 'creds_path' (the absolute input
+        credentials path, or None) of the participant the workflow was built
+        for
+    participant : dictionary
+        same, for the participant to run
+
+    Returns
+    -------
+    workflow : nipype.pipeline.engine.Workflow
+    """
+    old_id = str(template['subject_id'])
+    new_id = str(participant['subject_id'])
+
+    pairs = _input_pairs(template['sub_dict'], participant['sub_dict'])
+    if isinstance(template['creds_path'], str) and \
+            template['creds_path'] != participant['creds_path']:
+        pairs.append((template['creds_path'], participant['creds_path']))
+    if old_id != new_id:
+        pairs.append((old_id, new_id))
+
+    old_name = workflow.name
+    workflow.name = old_name.replace(old_id, new_id)
+
+    for node in workflow._get_all_nodes():
+        if node._hierarchy and node._hierarchy.split('.')[0] == old_name:
+            node._hierarchy = workflow.name + node._hierarchy[len(old_name):]
+        for name, value in node.inputs.get().items():
+            stamped = _stamp(value, pairs, old_id, new_id)
+            if stamped is not value:
+                setattr(node.inputs, name, stamped)
+        if node.iterables:
+            node.iterables = _stamp(node.iterables, pairs, old_id, new_id)
+
+    return workflow
+
+
+class WorkflowCache(object):
+    """
+    Directory of pickled participant workflows, one per cache key
+
+    Parameters
+    ----------
+    cache_dir : string
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.abspath(cache_dir)
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, '{0}.pkl'.format(key))
+
+    def load(self, key, subject_id, sub_dict, creds_path=None):
+        """
+        Load the workflow cached under key, stamped with a participant's
+        inputs
+
+        Returns
+        -------
+        built : tuple or None
+            (workflow, strat_list, pipeline_ids) as returned by
+            build_workflow, or None if there is no usable cached workflow
+        """
+        try:
+            with open(self.path(key), 'rb') as f:
+                cached = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError,
+                AttributeError, ImportError) as e:
+            if not isinstance(e, (IOError, OSError)) or \
+                    os.path.exists(self.path(key)):
+                logger.warning('Ignoring the cached workflow {0}: {1}'.format(
+                    self.path(key), e))
+            return None
+
+        workflow, strat_list, pipeline_ids = cached['built']
+        stamp_workflow(workflow, cached['participant'], {
+            'subject_id': subject_id,
+            'sub_dict': sub_dict,
+            'creds_path': creds_path
+        })
+
+        logger.info('Reusing the workflow built for participant {0}'.format(
+            cached['participant']['subject_id']))
+
+        return workflow, strat_list, pipeline_ids
+
+    def save(self, key, built, subject_id, sub_dict, creds_path=None):
+        """
+        Cache a workflow built by build_workflow for a participant
+
+        Parameters
+        ----------
+        key : string
+        built : tuple
+            (workflow, strat_list, pipeline_ids)
+        subject_id : string
+        sub_dict : dictionary
+        creds_path : string or None
+            absolute input credentials path
+        """
+        if not os.path.exists(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError:
+                if not os.path.isdir(self.cache_dir):
+                    raise
+
+        partial = '{0}.part-{1}'.format(self.path(key), os.getpid())
+        try:
+            with open(partial, 'wb') as f:
+                pickle.dump({
+                    'participant': {'subject_id': subject_id,
+                                    'sub_dict': sub_dict,
+                                    'creds_path': creds_path},
+                    'built': built
+                }, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.rename(partial, self.path(key))
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            logger.warning('Could not cache the workflow of participant '
+                           '{0}: {1}'.format(subject_id, e))
+            if os.path.exists(partial):
+                os.remove(partial)
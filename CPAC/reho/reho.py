@@ -3,6 +3,7 @@ import nipype.pipeline.engine as pe
 import nipype.interfaces.fsl as fsl
 import nipype.interfaces.utility as util
 from CPAC.reho.utils import *
+from CPAC.utils.interfaces.function import Function
 
 
 def create_reho():
@@ -88,12 +89,14 @@ def create_reho():
 
     reho_imports = ['import os', 'import sys', 'import nibabel as nb',
                     'import numpy as np',
-                    'from CPAC.reho.utils import f_kendall']
-    raw_reho_map = pe.Node(util.Function(input_names=['in_file', 'mask_file',
-                                                      'cluster_size'],
-                                         output_names=['out_file'],
-                                         function=compute_reho,
-                                         imports=reho_imports),
+                    'from CPAC.reho.utils import f_kendall',
+                    'from CPAC.utils.nifti_utils import intermediate_ext']
+    raw_reho_map = pe.Node(Function(input_names=['in_file', 'mask_file',
+                                                 'cluster_size'],
+                                    output_names=['out_file'],
+                                    function=compute_reho,
+                                    imports=reho_imports,
+                                    threaded=True),
                            name='reho_map')
 
     reHo.connect(inputNode, 'rest_res_filt', raw_reho_map, 'in_file')
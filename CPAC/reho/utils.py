@@ -275,7 +275,7 @@ def compute_reho(in_file, mask_file, cluster_size):
 
     img = nb.Nifti1Image(K, header=res_img.get_header(),
                          affine=res_img.get_affine())
-    reho_file = os.path.join(os.getcwd(), 'ReHo.nii.gz')
+    reho_file = os.path.join(os.getcwd(), 'ReHo' + intermediate_ext())
     img.to_filename(reho_file)
     out_file = reho_file
 
@@ -1,7 +1,9 @@
 from .scrubbing import create_scrubbing_preproc, \
                       get_mov_parameters, \
-                      get_indx
+                      get_indx, \
+                      scrub_image_in_process
 
 __all__ = ['create_scrubbing_preproc', \
            'get_mov_parameters', \
-           'get_indx']
+           'get_indx', \
+           'scrub_image_in_process']
@@ -1,9 +1,11 @@
 import nipype.interfaces.afni.preprocess as e_afni
 import nipype.pipeline.engine as pe
 import nipype.interfaces.utility as util
+from CPAC.utils.interfaces.function import Function
 
 
-def create_scrubbing_preproc(wf_name = 'scrubbing'):
+def create_scrubbing_preproc(wf_name = 'scrubbing', in_process=False,
+                             compress_level=1):
 
     """
     This workflow essentially takes the list of offending timepoints that are to be removed
@@ -14,6 +16,12 @@ def create_scrubbing_preproc(wf_name = 'scrubbing'):
     ----------
     wf_name : string
         Name of the workflow
+    in_process : boolean
+        Censor the volumes with nibabel inside the node (see
+        `scrub_image_in_process`) instead of running 3dcalc
+    compress_level : integer
+        gzip compression level of the scrubbed image, only used when
+        in_process is True
     
     Returns
     -------
@@ -103,10 +111,19 @@ def create_scrubbing_preproc(wf_name = 'scrubbing'):
     #scrubbed_preprocessed.inputs.expr = 'a'
     #scrubbed_preprocessed.inputs.outputtype = 'NIFTI_GZ'   
     
-    scrubbed_preprocessed = pe.Node(util.Function(input_names=['scrub_input'],
-                                                  output_names=['scrubbed_image'],
-                                                  function=scrub_image),
-                                    name='scrubbed_preprocessed')
+    if in_process:
+        scrubbed_preprocessed = pe.Node(Function(input_names=['scrub_input',
+                                                              'compress_level'],
+                                                 output_names=['scrubbed_image'],
+                                                 function=scrub_image_in_process,
+                                                 as_module=True),
+                                        name='scrubbed_preprocessed')
+        scrubbed_preprocessed.inputs.compress_level = compress_level
+    else:
+        scrubbed_preprocessed = pe.Node(util.Function(input_names=['scrub_input'],
+                                                      output_names=['scrubbed_image'],
+                                                      function=scrub_image),
+                                        name='scrubbed_preprocessed')
 
     scrub.connect(inputNode, 'preprocessed', craft_scrub_input, 'scrub_input')
     scrub.connect(inputNode, 'frames_in_1D', craft_scrub_input, 'frames_in_1D_file')
@@ -194,7 +211,7 @@ def get_indx(scrub_input, frames_in_1D_file):
 
     line = line.strip(',')
     if line:
-        indx = map(int, line.split(","))
+        indx = list(map(int, line.split(",")))
     else:
         raise Exception("No time points remaining after scrubbing.")
     
@@ -231,3 +248,101 @@ def scrub_image(scrub_input):
     scrubbed_image = os.path.join(os.getcwd(), "scrubbed_preprocessed.nii.gz")
 
     return scrubbed_image
+
+
+def parse_scrub_input(scrub_input):
+
+    """
+    Method to split the output of `get_indx` into the image path and
+    the list of volumes to keep
+
+    Parameters
+    ----------
+    scrub_input : string or tuple
+        either a string such as " 4dfile.nii.gz[0,1,2,..100] ", or a
+        (path, list of volume indices) pair
+
+    Returns
+    -------
+    in_file : string
+        path to the 4D file to be scrubbed
+
+    indx : list
+        indices of the volumes to be kept
+
+    """
+
+    import re
+
+    if isinstance(scrub_input, (tuple, list)):
+        in_file, indx = scrub_input
+        return in_file, [int(i) for i in indx]
+
+    match = re.match(r'^(.+)\[([0-9,\s]*)\]$', scrub_input.strip())
+    if not match:
+        raise ValueError("Could not parse the scrubbing input "
+                         "{0}".format(scrub_input))
+
+    in_file, indx = match.groups()
+    indx = [int(i) for i in indx.split(',') if i.strip()]
+
+    if not indx:
+        raise Exception("No time points remaining after scrubbing.")
+
+    return in_file, indx
+
+
+def scrub_image_in_process(scrub_input, compress_level=1):
+
+    """
+    Method to scrub the image without calling out to AFNI. The input image
+    is memory-mapped, and the retained volumes are copied with fancy
+    indexing straight into a preallocated output array, so the volume list
+    never has to fit on a command line.
+
+    Parameters
+    ----------
+    scrub_input : string or tuple
+        output of `get_indx`, i.e. the path to the 4D file to be scrubbed
+        with the selected volumes appended, or a (path, indices) pair
+    compress_level : integer
+        gzip compression level of the output image, 0 writes an
+        uncompressed image
+
+    Returns
+    -------
+    scrubbed_image : string
+        path to the scrubbed 4D file
+
+    """
+
+    import os
+    import numpy as np
+    import nibabel as nb
+    from CPAC.scrubbing.scrubbing import parse_scrub_input
+    from CPAC.utils.nifti_utils import save_nifti_image
+
+    in_file, indx = parse_scrub_input(scrub_input)
+
+    img = nb.load(in_file, mmap=True)
+    data = np.asanyarray(img.dataobj)
+
+    if data.ndim != 4:
+        raise ValueError("Expected a 4D image to scrub, {0} has shape "
+                         "{1}".format(in_file, data.shape))
+
+    scrubbed = np.empty(data.shape[:3] + (len(indx),), dtype=data.dtype)
+    np.take(data, indx, axis=3, out=scrubbed)
+
+    header = img.header.copy()
+    header.set_data_dtype(scrubbed.dtype)
+    scrubbed_img = nb.Nifti1Image(scrubbed, img.affine, header=header)
+
+    if compress_level:
+        scrubbed_image = os.path.join(os.getcwd(),
+                                      "scrubbed_preprocessed.nii.gz")
+    else:
+        scrubbed_image = os.path.join(os.getcwd(),
+                                      "scrubbed_preprocessed.nii")
+
+    return save_nifti_image(scrubbed_img, scrubbed_image, compress_level)
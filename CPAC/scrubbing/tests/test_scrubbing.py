@@ -0,0 +1,45 @@
+import os
+
+import numpy as np
+import nibabel as nb
+import pytest
+
+from CPAC.scrubbing import get_indx, scrub_image_in_process
+from CPAC.scrubbing.scrubbing import parse_scrub_input
+
+
+def test_parse_scrub_input():
+
+    assert parse_scrub_input('/data/rest.nii.gz[0,1,5]') == \
+        ('/data/rest.nii.gz', [0, 1, 5])
+    assert parse_scrub_input(('/data/rest.nii.gz', ['2', 3])) == \
+        ('/data/rest.nii.gz', [2, 3])
+
+    with pytest.raises(ValueError):
+        parse_scrub_input('/data/rest.nii.gz')
+
+
+@pytest.mark.parametrize('ext,compress_level', [('.nii', 0),
+                                                ('.nii.gz', 1)])
+def test_scrub_image_in_process(tmpdir, ext, compress_level):
+
+    data = np.arange(3 * 4 * 5 * 10, dtype=np.int16).reshape((3, 4, 5, 10))
+    in_file = str(tmpdir.join('rest' + ext))
+    nb.Nifti1Image(data, np.eye(4)).to_filename(in_file)
+
+    frames_in = str(tmpdir.join('frames_in.1D'))
+    with open(frames_in, 'w') as f:
+        f.write('0,1,4,7,9,')
+
+    scrub_input = get_indx(in_file, frames_in)
+
+    with tmpdir.as_cwd():
+        scrubbed = scrub_image_in_process(scrub_input, compress_level)
+
+    assert scrubbed.endswith('.nii.gz' if compress_level else '.nii')
+    assert os.path.dirname(scrubbed) == str(tmpdir)
+
+    scrubbed_img = nb.load(scrubbed)
+    assert scrubbed_img.get_data_dtype() == np.int16
+    np.testing.assert_array_equal(np.asanyarray(scrubbed_img.dataobj),
+                                  data[..., [0, 1, 4, 7, 9]])
@@ -233,6 +233,8 @@ def mask_erosion(roi_mask = None, skullstrip_mask = None, mask_erosion_mm = None
         Path to eroded skull-stripped brain mask
 
     """
+    from CPAC.utils.nifti_utils import intermediate_ext
+
     skullstrip_mask_img =  nb.load(skullstrip_mask)
     skullstrip_mask_data = skullstrip_mask_img.get_fdata()
 
@@ -254,13 +256,17 @@ def mask_erosion(roi_mask = None, skullstrip_mask = None, mask_erosion_mm = None
     hdr = roi_mask_img.get_header()
     output_roi_mask_img = nb.Nifti1Image(roi_mask_data, header=hdr,
                                  affine=roi_mask_img.get_affine())
-    output_roi_mask = os.path.join(os.getcwd(), 'segment_tissue_eroded_mask.nii.gz')
+    output_roi_mask = os.path.join(os.getcwd(),
+                                   'segment_tissue_eroded_mask' +
+                                   intermediate_ext())
     output_roi_mask_img.to_filename(output_roi_mask)
 
     hdr = skullstrip_mask_img.get_header()
     output_skullstrip_mask_img = nb.Nifti1Image(skullstrip_mask_data, header=hdr,
                                  affine=skullstrip_mask_img.get_affine())
-    eroded_skullstrip_mask = os.path.join(os.getcwd(), 'eroded_skullstrip_mask.nii.gz')
+    eroded_skullstrip_mask = os.path.join(os.getcwd(),
+                                          'eroded_skullstrip_mask' +
+                                          intermediate_ext())
 
     output_skullstrip_mask_img.to_filename(eroded_skullstrip_mask)
 
@@ -296,6 +302,8 @@ def erosion(roi_mask = None, erosion_mm = None, erosion_prop = None):
 
     """
 
+    from CPAC.utils.nifti_utils import intermediate_ext
+
     roi_mask_img = nb.load(roi_mask)
     roi_mask_data = roi_mask_img.get_fdata()
     orig_vol = np.sum(roi_mask_data > 0)
@@ -314,7 +322,8 @@ def erosion(roi_mask = None, erosion_mm = None, erosion_prop = None):
     hdr = roi_mask_img.get_header()
     output_img = nb.Nifti1Image(roi_mask_data, header=hdr,
                                  affine=roi_mask_img.get_affine())
-    eroded_roi_mask = os.path.join(os.getcwd(), 'segment_tissue_mask.nii.gz')
+    eroded_roi_mask = os.path.join(os.getcwd(),
+                                   'segment_tissue_mask' + intermediate_ext())
 
     output_img.to_filename(eroded_roi_mask)
 
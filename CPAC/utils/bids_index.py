@@ -0,0 +1,369 @@
+"""Persistent SQLite index of a (BIDS) data directory
+
+Walking a large dataset and parsing every filename is repeated by each data
+configuration build and each run started directly on a BIDS directory. The
+index stores every file with its parsed BIDS entities, its size and
+modification time, and the contents of its JSON sidecars, along with the
+modification time of each directory. Updating it only lists the directories
+whose modification time changed (i.e. where files were added, removed or
+renamed), and re-reads the sidecars that changed in place.
+"""
+import json
+import os
+import sqlite3
+
+from CPAC.utils.bids_utils import bids_decode_fname
+
+
+INDEX_VERSION = '1'
+
+ENTITIES = ['site', 'sub', 'ses', 'task', 'run', 'acq', 'scantype']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime REAL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT,
+    mtime REAL,
+    size INTEGER,
+    site TEXT,
+    sub TEXT,
+    ses TEXT,
+    task TEXT,
+    run TEXT,
+    acq TEXT,
+    scantype TEXT,
+    entities TEXT,
+    content TEXT
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE INDEX IF NOT EXISTS files_sub ON files (sub, ses, task);
+"""
+
+
+def parse_entities(rel_path):
+    """
+    Parse the BIDS entities of a file path relative to the dataset root
+
+    Returns
+    -------
+    f_dict : dictionary or None
+        entities as returned by bids_decode_fname, or None for files that
+        are not BIDS NIfTI or JSON files
+    """
+    fname = os.path.basename(rel_path).lower()
+    if 'nii' not in fname and not fname.endswith('.json'):
+        return None
+    try:
+        return bids_decode_fname(rel_path)
+    except (IOError, ValueError, KeyError):
+        return None
+
+
+class BIDSIndex(object):
+    """
+    On-disk index of the files in a data directory
+
+    Parameters
+    ----------
+    base_directory : string
+        root of the dataset
+    index_path : string
+        SQLite database file; created if missing. An index built for
+        another directory is discarded.
+    update : boolean
+        whether to bring the index up to date on opening
+
+    Examples
+    --------
+    >>> with BIDSIndex('/data/bids', '/tmp/bids.db') as index:  # doctest: +SKIP
+    ...     index.query(participant='0025427', task='rest')
+    """
+
+    def __init__(self, base_directory, index_path, update=True):
+
+        self.base_directory = os.path.abspath(base_directory).rstrip('/')
+        self.index_path = os.path.abspath(index_path)
+
+        index_dir = os.path.dirname(self.index_path)
+        if not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+
+        self.conn = sqlite3.connect(self.index_path)
+        self.conn.executescript(SCHEMA)
+
+        meta = dict(self.conn.execute('SELECT key, value FROM meta'))
+        if meta.get('base_directory') != self.base_directory or \
+                meta.get('version') != INDEX_VERSION:
+            with self.conn:
+                self.conn.execute('DELETE FROM dirs')
+                self.conn.execute('DELETE FROM files')
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                    [('base_directory', self.base_directory),
+                     ('version', INDEX_VERSION)])
+
+        if update:
+            self.update()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def _abs(self, rel_path):
+        return os.path.join(self.base_directory, rel_path) \
+            if rel_path else self.base_directory
+
+    def _file_row(self, rel_path, rel_dir, stat):
+        entities = parse_entities(rel_path)
+        content = None
+        if rel_path.endswith('.json'):
+            try:
+                with open(self._abs(rel_path), 'r') as f:
+                    content = f.read()
+            except (IOError, UnicodeDecodeError):
+                content = None
+        values = [entities.get(key) if entities else None
+                  for key in ENTITIES]
+        return [rel_path, rel_dir, stat.st_mtime, stat.st_size] + values + \
+            [json.dumps(entities) if entities else None, content]
+
+    def _remove_dir(self, rel_dir):
+        # drop a directory and everything indexed below it
+        like = rel_dir.replace('%', r'\%').replace('_', r'\_') + '/%'
+        self.conn.execute("DELETE FROM files WHERE dir = ? OR "
+                          "dir LIKE ? ESCAPE '\\'", (rel_dir, like))
+        self.conn.execute("DELETE FROM dirs WHERE path = ? OR "
+                          "path LIKE ? ESCAPE '\\'", (rel_dir, like))
+
+    def update(self):
+        """
+        Bring the index up to date with the directory
+
+        Returns
+        -------
+        rescanned : integer
+            number of directories whose contents were listed again
+        """
+        rescanned = 0
+        insert = 'INSERT OR REPLACE INTO files VALUES ({0})'.format(
+            ', '.join(['?'] * (6 + len(ENTITIES))))
+
+        with self.conn:
+            stack = ['']
+            while stack:
+                rel_dir = stack.pop()
+                try:
+                    dir_mtime = os.stat(self._abs(rel_dir)).st_mtime
+                except OSError:
+                    self._remove_dir(rel_dir)
+                    continue
+
+                row = self.conn.execute('SELECT mtime FROM dirs WHERE '
+                                        'path = ?', (rel_dir,)).fetchone()
+                known_files = {
+                    path: (mtime, size) for path, mtime, size in
+                    self.conn.execute('SELECT path, mtime, size FROM files '
+                                      'WHERE dir = ?', (rel_dir,))
+                }
+
+                if row is not None and row[0] == dir_mtime:
+                    # same entries; only sidecars edited in place can differ
+                    stack.extend(path for path, in self.conn.execute(
+                        'SELECT path FROM dirs WHERE parent = ?',
+                        (rel_dir,)))
+                    for rel_path, (mtime, size) in known_files.items():
+                        if not rel_path.endswith('.json'):
+                            continue
+                        try:
+                            stat = os.stat(self._abs(rel_path))
+                        except OSError:
+                            continue
+                        if (stat.st_mtime, stat.st_size) != (mtime, size):
+                            self.conn.execute(
+                                insert,
+                                self._file_row(rel_path, rel_dir, stat))
+                    continue
+
+                rescanned += 1
+                sub_dirs = []
+                files = {}
+                for entry in os.scandir(self._abs(rel_dir)):
+                    rel_path = os.path.join(rel_dir, entry.name) \
+                        if rel_dir else entry.name
+                    try:
+                        if entry.is_dir():
+                            sub_dirs.append(rel_path)
+                        elif entry.is_file():
+                            files[rel_path] = entry.stat()
+                    except OSError:
+                        continue
+
+                for path, in self.conn.execute(
+                        'SELECT path FROM dirs WHERE parent = ?',
+                        (rel_dir,)).fetchall():
+                    if path not in sub_dirs:
+                        self._remove_dir(path)
+
+                self.conn.executemany(
+                    'DELETE FROM files WHERE path = ?',
+                    [(path,) for path in known_files if path not in files])
+
+                for rel_path, stat in files.items():
+                    if known_files.get(rel_path) == (stat.st_mtime,
+                                                     stat.st_size):
+                        continue
+                    self.conn.execute(insert,
+                                      self._file_row(rel_path, rel_dir, stat))
+
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)',
+                    (rel_dir, os.path.dirname(rel_dir) if rel_dir else None,
+                     dir_mtime))
+                stack.extend(sub_dirs)
+
+        return rescanned
+
+    def file_paths(self, relative=False):
+        """
+        All the indexed files, sorted
+        """
+        return [path if relative else self._abs(path) for path, in
+                self.conn.execute('SELECT path FROM files ORDER BY path')]
+
+    def query(self, participant=None, session=None, task=None,
+              scantype=None, site=None, relative=False):
+        """
+        Indexed files matching BIDS entities, sorted
+
+        Parameters
+        ----------
+        participant : string or None
+            participant label, with or without the 'sub-' prefix
+        session : string or None
+            session label, with or without the 'ses-' prefix
+        task : string or None
+            task label, with or without the 'task-' prefix
+        scantype : string or None
+            BIDS suffix, e.g. 'T1w' or 'bold'
+        site : string or None
+            site directory, for datasets with a site level
+        relative : boolean
+            return paths relative to the dataset root
+
+        Returns
+        -------
+        file_paths : list
+        """
+        clauses = []
+        values = []
+        for column, value, prefix in [('sub', participant, 'sub-'),
+                                      ('ses', session, 'ses-'),
+                                      ('task', task, 'task-'),
+                                      ('scantype', scantype, ''),
+                                      ('site', site, '')]:
+            if value is None:
+                continue
+            value = str(value)
+            if prefix and value.startswith(prefix):
+                value = value[len(prefix):]
+            clauses.append('{0} = ?'.format(column))
+            values.append(value)
+
+        sql = 'SELECT path FROM files'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY path'
+
+        return [path if relative else self._abs(path)
+                for path, in self.conn.execute(sql, values)]
+
+    def select(self, inclusion_dct=None, exclusion_dct=None,
+               relative=False):
+        """
+        Indexed files of the participants, sessions and scans of the
+        inclusion and exclusion lists of a data configuration, sorted
+
+        Files without the entity filtered on, such as dataset-level sidecars
+        or participants.tsv, are kept. Sites and scan exclusions are left to
+        the data configuration build: sites can come from participants.tsv,
+        and scan IDs hold run and acquisition labels on top of the task.
+
+        Parameters
+        ----------
+        inclusion_dct : dictionary or None
+            lists of 'participants', 'sessions' and 'scans' to include, as
+            format_incl_excl_dct returns them
+        exclusion_dct : dictionary or None
+            lists of 'participants' and 'sessions' to exclude
+        relative : boolean
+            return paths relative to the dataset root
+
+        Returns
+        -------
+        file_paths : list
+        """
+        clauses = []
+        values = []
+        for incl_excl, include in [(inclusion_dct, True),
+                                   (exclusion_dct, False)]:
+            for info_type, column, prefix in [('participants', 'sub', 'sub-'),
+                                              ('sessions', 'ses', 'ses-'),
+                                              ('scans', 'task', 'task-')]:
+                labels = (incl_excl or {}).get(info_type)
+                if not labels or (column == 'task' and not include):
+                    continue
+                if isinstance(labels, str):
+                    labels = [labels]
+                labels = set(str(label) for label in labels)
+                labels = sorted(set(
+                    label[len(prefix):] if label.startswith(prefix)
+                    else label for label in labels))
+                if column == 'task':
+                    labels = sorted(set(label.split('_')[0]
+                                        for label in labels))
+                clauses.append('({0} IS NULL OR {0} {1}IN ({2}))'.format(
+                    column, '' if include else 'NOT ',
+                    ', '.join(['?'] * len(labels))))
+                values += labels
+
+        sql = 'SELECT path FROM files'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY path'
+
+        return [path if relative else self._abs(path)
+                for path, in self.conn.execute(sql, values)]
+
+    def collect_files_configs(self, suffixes):
+        """
+        Relative NIfTI paths and parsed JSON sidecars whose names contain
+        any of the given suffixes, as collect_bids_files_configs returns them
+        """
+        file_paths = []
+        config_dict = {}
+        for path, content in self.conn.execute(
+                'SELECT path, content FROM files ORDER BY path'):
+            fname = os.path.basename(path)
+            if not any(suf in fname for suf in suffixes):
+                continue
+            if 'nii' in fname:
+                file_paths.append(path)
+            if fname.endswith('json') and content is not None:
+                config_dict[path] = json.loads(content)
+
+        return file_paths, config_dict
@@ -3,6 +3,12 @@ import yaml
 import json
 
 
+# filename entities, from the most general to the most specific, along which
+# sidecar parameters are inherited
+BIDS_LEVELS = ['scantype', 'site', 'sub', 'ses', 'task', 'acq', 'rec', 'dir',
+               'run']
+
+
 def bids_decode_fname(file_path, dbg=False):
     import re
 
@@ -97,8 +103,7 @@ def bids_retrieve_params(bids_config_dict, f_dict, dbg=False):
     t_dict = bids_config_dict  # pointer to current dictionary
     # try to populate the configuration using information
     # already in the list
-    for level in ['scantype', 'site', 'sub', 'ses', 'task', 'acq',
-                  'rec', 'dir', 'run']:
+    for level in BIDS_LEVELS:
         if level in f_dict:
             key = "-".join([level, f_dict[level]])
         else:
@@ -161,8 +166,7 @@ def bids_parse_sidecar(config_dict, dbg=False):
     # initialize 'default' entries, this essentially is a pointer traversal
     # of the dictionary
     t_dict = bids_config_dict
-    for level in ['scantype', 'site', 'sub', 'ses', 'task',
-                  'acq', 'rec', 'dir', 'run']:
+    for level in BIDS_LEVELS:
         key = '-'.join([level, 'none'])
         t_dict[key] = {}
         t_dict = t_dict[key]
@@ -228,8 +232,7 @@ def bids_parse_sidecar(config_dict, dbg=False):
         # e.g. run-1, run-2, ... will all map to run-none if no jsons
         # explicitly define values for those runs
         t_dict = bids_config_dict  # pointer to current dictionary
-        for level in ['scantype', 'site', 'sub', 'ses', 'task', 'acq',
-                      'rec', 'dir', 'run']:
+        for level in BIDS_LEVELS:
             if level in f_dict:
                 key = "-".join([level, f_dict[level]])
             else:
@@ -245,6 +248,75 @@ def bids_parse_sidecar(config_dict, dbg=False):
     return (bids_config_dict)
 
 
+class BIDSSidecarResolver(object):
+    """
+    Resolves the scan parameters of BIDS files from their JSON sidecars.
+
+    The sidecars are merged along the inheritance hierarchy once, and the
+    parameters resolved for a combination of filename entities are cached,
+    so every further scan sharing them (e.g. all the runs of a task under a
+    dataset-level sidecar) is resolved with a dictionary lookup.
+
+    :param config_dict: dictionary that maps paths of sidecar json files
+       (the key) to a dictionary containing the contents of the files
+    :param dbg: boolean flag that indicates whether or not debug statements
+       should be printed
+    """
+
+    def __init__(self, config_dict, dbg=False):
+        self.bids_config_dict = bids_parse_sidecar(config_dict, dbg=dbg) \
+            if config_dict else {}
+        self._params = {}
+
+    def __call__(self, f_dict):
+        """
+        :param f_dict: dictionary built from the name of a BIDS file by
+           bids_decode_fname
+        :return: the BIDS parameters that apply to the file, as returned by
+           bids_retrieve_params
+        """
+        key = tuple(f_dict.get(level, 'none') for level in BIDS_LEVELS)
+        if key not in self._params:
+            self._params[key] = bids_retrieve_params(self.bids_config_dict,
+                                                     f_dict)
+        return self._params[key]
+
+
+def fetch_s3_sidecars(bucket, keys, prefix='', n_threads=16):
+    """
+    Download and parse JSON sidecars from an S3 bucket concurrently
+
+    :param bucket: boto3 Bucket holding the sidecars
+    :param keys: S3 keys of the sidecars
+    :param prefix: prefix removed from the keys to form the returned paths
+    :param n_threads: number of concurrent downloads
+    :return: dictionary mapping the paths of the sidecars, relative to
+       prefix, to their parsed contents
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    # boto3 clients, unlike resources, can be shared between threads
+    client = bucket.meta.client
+    keys = sorted(set(keys))
+
+    def _fetch(key):
+        try:
+            return json.loads(client.get_object(Bucket=bucket.name,
+                                                Key=key)["Body"].read())
+        except Exception as e:
+            print("Error retrieving %s (%s)" % (key.replace(prefix, ""), e))
+            raise
+
+    if not keys:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=min(n_threads, len(keys))) as pool:
+        contents = list(pool.map(_fetch, keys))
+
+    return {key.replace(prefix, "").lstrip('/'): content
+            for key, content in zip(keys, contents)}
+
+
 def gen_bids_outputs_sublist(base_path, paths_list, key_list, creds_path):
     import copy
 
@@ -361,7 +433,7 @@ def bids_gen_cpac_sublist(bids_dir, paths_list, config_dict, creds_path,
     # otherwise parse the information in the sidecar json files into a dict
     # we can use to extract data for our nifti files
     if config_dict:
-        bids_config_dict = bids_parse_sidecar(config_dict)
+        resolve_params = BIDSSidecarResolver(config_dict)
 
     subdict = {}
 
@@ -374,8 +446,7 @@ def bids_gen_cpac_sublist(bids_dir, paths_list, config_dict, creds_path,
             f_dict = bids_decode_fname(p)
 
             if config_dict:
-                t_params = bids_retrieve_params(bids_config_dict,
-                                                f_dict)
+                t_params = resolve_params(f_dict)
                 if not t_params:
                     print(f_dict)
                     print("Did not receive any parameters for %s," % (p) +
@@ -494,10 +565,13 @@ def bids_gen_cpac_sublist(bids_dir, paths_list, config_dict, creds_path,
     return sublist
 
 
-def collect_bids_files_configs(bids_dir, aws_input_creds=''):
+def collect_bids_files_configs(bids_dir, aws_input_creds='',
+                               index_path=None):
     """
     :param bids_dir:
     :param aws_input_creds:
+    :param index_path: SQLite index of a local bids_dir, created or
+        incrementally updated instead of walking the whole directory
     :return:
     """
 
@@ -523,22 +597,23 @@ def collect_bids_files_configs(bids_dir, aws_input_creds=''):
 
         print("gathering files from S3 bucket (%s) for %s" % (bucket, prefix))
 
+        # list first, then download all the sidecars at once
+        sidecar_keys = []
         for s3_obj in bucket.objects.filter(Prefix=prefix):
-            for suf in suffixes:
-                if suf in str(s3_obj.key):
-                    if str(s3_obj.key).endswith("json"):
-                        try:
-                            config_dict[
-                                s3_obj.key.replace(prefix, "").lstrip('/')] \
-                                = json.loads(s3_obj.get()["Body"].read())
-                        except Exception as e:
-                            print("Error retrieving %s (%s)" %
-                                   (s3_obj.key.replace(prefix, ""),
-                                    e.message))
-                            raise
-                    elif 'nii' in str(s3_obj.key):
-                        file_paths.append(str(s3_obj.key)
-                                          .replace(prefix, '').lstrip('/'))
+            if not any(suf in str(s3_obj.key) for suf in suffixes):
+                continue
+            if str(s3_obj.key).endswith("json"):
+                sidecar_keys.append(str(s3_obj.key))
+            elif 'nii' in str(s3_obj.key):
+                file_paths.append(str(s3_obj.key)
+                                  .replace(prefix, '').lstrip('/'))
+
+        config_dict.update(fetch_s3_sidecars(bucket, sidecar_keys, prefix))
+
+    elif index_path:
+        from CPAC.utils.bids_index import BIDSIndex
+        with BIDSIndex(bids_dir, index_path) as index:
+            file_paths, config_dict = index.collect_files_configs(suffixes)
 
     else:
         for root, dirs, files in os.walk(bids_dir, topdown=False):
@@ -549,13 +624,14 @@ def collect_bids_files_configs(bids_dir, aws_input_creds=''):
                             file_paths += [
                                 os.path.join(root, f).replace(bids_dir, '')
                                     .lstrip('/')]
-                        if f.endswith('json') and suf in f:
+                    # parse each sidecar once, whatever suffixes it matches
+                    if f.endswith('json') and \
+                            any(suf in f for suf in suffixes):
+                        with open(os.path.join(root, f), 'r') as json_file:
                             config_dict.update(
                                 {os.path.join(
                                     root.replace(bids_dir, '').lstrip('/'),
-                                    f):
-                                     json.load(
-                                         open(os.path.join(root, f), 'r'))})
+                                    f): json.load(json_file)})
 
     if not file_paths and not config_dict:
         raise IOError("Didn't find any files in {0}. Please verify that the "
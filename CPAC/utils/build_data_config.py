@@ -1,6 +1,7 @@
 
 
-def gather_file_paths(base_directory, verbose=False):
+def gather_file_paths(base_directory, verbose=False, index_path=None,
+                      inclusion_dct=None, exclusion_dct=None):
 
     # this will go into core tools eventually
 
@@ -16,10 +17,17 @@ def gather_file_paths(base_directory, verbose=False):
 
     path_list = []
 
-    for root, dirs, files in os.walk(base_directory):
-        for path in files:
-            fullpath = os.path.join(root, path)
-            path_list.append(fullpath)
+    if index_path:
+        # only rescan the directories changed since the index was updated,
+        # and only list the files of the included participants/sessions/scans
+        from CPAC.utils.bids_index import BIDSIndex
+        with BIDSIndex(base_directory, index_path) as index:
+            path_list = index.select(inclusion_dct, exclusion_dct)
+    else:
+        for root, dirs, files in os.walk(base_directory):
+            for path in files:
+                fullpath = os.path.join(root, path)
+                path_list.append(fullpath)
 
     if verbose:
         print("Number of paths: {0}".format(len(path_list)))
@@ -27,12 +35,17 @@ def gather_file_paths(base_directory, verbose=False):
     return path_list
 
 
-def pull_s3_sublist(data_folder, creds_path=None, keep_prefix=True):
+def pull_s3_sublist(data_folder, creds_path=None, keep_prefix=True,
+                    cache_dir=None, cache_ttl=3600, n_threads=8):
     """Return a list of input data file paths that are available on an AWS S3
-    bucket on the cloud."""
+    bucket on the cloud.
+
+    The prefix is listed with n_threads concurrent listings, and the listing
+    is cached in cache_dir (if given) and reused for cache_ttl seconds."""
 
     import os
     from indi_aws import fetch_creds
+    from CPAC.utils.s3_listing import cached_list_s3_objects
 
     if creds_path:
         creds_path = os.path.abspath(creds_path)
@@ -53,12 +66,13 @@ def pull_s3_sublist(data_folder, creds_path=None, keep_prefix=True):
         bucket_prefix += "/"
 
     # Build S3-subjects to download
-    for bk in bucket.objects.filter(Prefix=bucket_prefix):
+    for bk in cached_list_s3_objects(bucket, bucket_prefix, cache_dir,
+                                     cache_ttl, n_threads):
         if keep_prefix:
-            fullpath = os.path.join("s3://", bucket_name, str(bk.key))
+            fullpath = os.path.join("s3://", bucket_name, str(bk['Key']))
             s3_list.append(fullpath)
         else:
-            s3_list.append(str(bk.key).replace(bucket_prefix, ""))
+            s3_list.append(str(bk['Key']).replace(bucket_prefix, ""))
 
     print("Finished pulling from S3. " \
           "{0} file paths found.".format(len(s3_list)))
@@ -72,19 +86,29 @@ def pull_s3_sublist(data_folder, creds_path=None, keep_prefix=True):
 
 
 def get_file_list(base_directory, creds_path=None, write_txt=None,
-                  write_pkl=None, write_info=False):
+                  write_pkl=None, write_info=False, index_path=None,
+                  s3_cache_dir=None, s3_cache_ttl=3600, inclusion_dct=None,
+                  exclusion_dct=None):
     """Return a list of input and data file paths either stored locally or on
-    an AWS S3 bucket on the cloud."""
+    an AWS S3 bucket on the cloud. Local directories can be listed through a
+    persistent index (see CPAC.utils.bids_index) by providing index_path,
+    narrowed down to the inclusion_dct/exclusion_dct participants, sessions
+    and scans, and S3 listings cached in s3_cache_dir (see pull_s3_sublist).
+    """
 
     import os
 
     if "s3://" in base_directory:
         # AWS S3 bucket
-        file_list = pull_s3_sublist(base_directory, creds_path)
+        file_list = pull_s3_sublist(base_directory, creds_path,
+                                    cache_dir=s3_cache_dir,
+                                    cache_ttl=s3_cache_ttl)
     else:
         # local
         base_directory = os.path.abspath(base_directory)
-        file_list = gather_file_paths(base_directory)
+        file_list = gather_file_paths(base_directory, index_path=index_path,
+                                      inclusion_dct=inclusion_dct,
+                                      exclusion_dct=exclusion_dct)
 
     if len(file_list) == 0:
         warn = "\n\n[!] No files were found in the base directory you " \
@@ -198,48 +222,6 @@ def download_single_s3_path(s3_path, download_dir=None, creds_path=None,
     return local_dl
 
 
-def pull_s3_sublist(data_folder, creds_path=None, keep_prefix=True):
-
-    import os
-    from indi_aws import fetch_creds
-
-    if creds_path:
-        creds_path = os.path.abspath(creds_path)
-
-    s3_path = data_folder.split("s3://")[1]
-    bucket_name = s3_path.split("/")[0]
-    bucket_prefix = s3_path.split(bucket_name + "/")[1]
-
-    print("Pulling from {0} ...".format(data_folder))
-
-    s3_list = []
-    bucket = fetch_creds.return_bucket(creds_path, bucket_name)
-
-    # ensure slash at end of bucket_prefix, so that if the final
-    # directory name is a substring in other directory names, these
-    # other directories will not be pulled into the file list
-    if "/" not in bucket_prefix[-1]:
-        bucket_prefix += "/"
-
-    # Build S3-subjects to download
-    for bk in bucket.objects.filter(Prefix=bucket_prefix):
-        if keep_prefix:
-            fullpath = os.path.join("s3://", bucket_name, str(bk.key))
-            s3_list.append(fullpath)
-        else:
-            s3_list.append(str(bk.key).replace(bucket_prefix, ""))
-
-    print("Finished pulling from S3. " \
-          "{0} file paths found.".format(len(s3_list)))
-
-    if not s3_list:
-        err = "\n\n[!] No input data found matching your data settings in " \
-              "the AWS S3 bucket provided:\n{0}\n\n".format(data_folder)
-        raise Exception(err)
-
-    return s3_list
-
-
 def generate_group_analysis_files(data_config_outdir, data_config_name):
     """Create the group-level analysis inclusion list.
     """
@@ -504,7 +486,7 @@ def format_incl_excl_dct(incl_list, info_type='participants'):
 def get_BIDS_data_dct(bids_base_dir, file_list=None, anat_scan=None,
                       aws_creds_path=None, brain_mask_template=None,
                       inclusion_dct=None, exclusion_dct=None,
-                      config_dir=None):
+                      config_dir=None, n_procs=1):
     """Return a data dictionary mapping input file paths to participant,
     session, scan, and site IDs (where applicable) for a BIDS-formatted data
     directory.
@@ -902,7 +884,8 @@ def get_BIDS_data_dct(bids_base_dir, file_list=None, anat_scan=None,
                                     aws_creds_path=aws_creds_path,
                                     inclusion_dct=inclusion_dct,
                                     exclusion_dct=exclusion_dct,
-                                    sites_dct=sites_subs_dct)
+                                    sites_dct=sites_subs_dct,
+                                    n_procs=n_procs)
     else:
         # no session level
         data_dct = get_nonBIDS_data(anat, func, file_list=file_list,
@@ -915,7 +898,8 @@ def get_BIDS_data_dct(bids_base_dir, file_list=None, anat_scan=None,
                                     aws_creds_path=aws_creds_path,
                                     inclusion_dct=inclusion_dct,
                                     exclusion_dct=exclusion_dct,
-                                    sites_dct=sites_subs_dct)
+                                    sites_dct=sites_subs_dct,
+                                    n_procs=n_procs)
 
     return data_dct
 
@@ -977,12 +961,136 @@ def find_unique_scan_params(scan_params_dct, site_id, sub_id, ses_id,
     return scan_params
 
 
+def compile_file_template(file_template, data_type="anat"):
+    """Compile a file path template, such as
+    /data/{site}/sub-{participant}/ses-{session}/func/{scan}_bold.nii.gz,
+    into an anchored regular expression with one named group per ID label.
+
+    Labels appearing more than once get numbered groups for their repeats
+    (participant_1, participant_2, ..) so conflicting IDs can be reported.
+    Like the '*' wildcards, IDs never span several directory levels. The
+    {scan} label is only parsed for functional and field map templates.
+    """
+
+    import re
+
+    keywords = ['site', 'participant', 'session']
+    if data_type != "anat" and data_type != "brain_mask":
+        keywords.append('scan')
+
+    tokens = re.split(r'(\{(?:%s)\}|\*)' % '|'.join(keywords),
+                      file_template)
+
+    pattern = ''
+    seen = {}
+    for token in tokens:
+        if token == '*':
+            pattern += '[^/]*?'
+        elif token.startswith('{') and token[1:-1] in keywords:
+            label = token[1:-1]
+            if label in seen:
+                seen[label] += 1
+                label = '{0}_{1}'.format(label, seen[label])
+            else:
+                seen[label] = 0
+            pattern += '(?P<{0}>[^/]+?)'.format(label)
+        else:
+            pattern += re.escape(token)
+
+    return re.compile('{0}$'.format(pattern))
+
+
+def parse_file_path(file_path, template_regex):
+    """Return the {label: ID} dictionary of a file path matched against a
+    template compiled with compile_file_template, None if it does not match,
+    or False if the same label is given conflicting IDs."""
+
+    match = template_regex.match(file_path)
+    if not match:
+        return None
+
+    path_dct = {}
+    for label, id in match.groupdict().items():
+        label = '{{{0}}}'.format(label.split('_')[0])
+        if label in path_dct and path_dct[label] != id:
+            warn = "\n\n[!] WARNING: While parsing your input data " \
+                   "files, a file path was found with conflicting " \
+                   "IDs for the same data level.\n\n" \
+                   "File path: {0}\n" \
+                   "Level: {1}\n" \
+                   "Conflicting IDs: {2}, {3}\n\n" \
+                   "Thus, we can't tell which {4} it belongs to, and " \
+                   "whether this file should be included or excluded! " \
+                   "Therefore, this file has not been added to the " \
+                   "data configuration.".format(file_path, label,
+                                                path_dct[label], id,
+                                                label.replace("{", "").replace("}", ""))
+            print(warn)
+            return False
+        path_dct[label] = id
+
+    return path_dct
+
+
+def _parse_file_paths(args):
+    file_paths, template_regex = args
+    return [parse_file_path(file_path, template_regex)
+            for file_path in file_paths]
+
+
+def match_file_templates(file_paths, file_template, data_type="anat",
+                         n_procs=1):
+    """Match a list of file paths against a file path template in bulk.
+
+    Returns a list of (file path, {label: ID} dictionary) pairs for the file
+    paths matching the template, in order; the dictionary is False for paths
+    with conflicting IDs. With n_procs > 1, the list is split across a pool
+    of processes.
+    """
+
+    template_regex = compile_file_template(file_template, data_type)
+    file_paths = list(file_paths)
+
+    if n_procs > 1 and len(file_paths) > 10000:
+        from multiprocessing import Pool
+        n_chunks = n_procs * 4
+        chunk_size = -(-len(file_paths) // n_chunks)
+        chunks = [file_paths[i:i + chunk_size]
+                  for i in range(0, len(file_paths), chunk_size)]
+        with Pool(n_procs) as pool:
+            path_dcts = [
+                path_dct for chunk in pool.map(
+                    _parse_file_paths,
+                    [(chunk, template_regex) for chunk in chunks])
+                for path_dct in chunk]
+    else:
+        path_dcts = _parse_file_paths((file_paths, template_regex))
+
+    return [(file_path, path_dct)
+            for file_path, path_dct in zip(file_paths, path_dcts)
+            if path_dct is not None]
+
+
+def incl_excl_sets(incl_dct):
+    """Return an inclusion or exclusion dictionary with its lists turned
+    into sets, for constant-time lookups."""
+
+    if not incl_dct:
+        return incl_dct
+
+    return {info_type: {ids} if isinstance(ids, str) else set(ids)
+            for info_type, ids in incl_dct.items()}
+
+
 def update_data_dct(file_path, file_template, data_dct=None, data_type="anat",
                     anat_scan=None, sites_dct=None, scan_params_dct=None,
                     inclusion_dct=None, exclusion_dct=None,
-                    aws_creds_path=None, verbose=True):
+                    aws_creds_path=None, verbose=True, path_dct=None):
     """Return a data dictionary with a new file path parsed and added in,
-    keyed with its appropriate ID labels."""
+    keyed with its appropriate ID labels.
+
+    path_dct can be given when the file path was already parsed, by
+    match_file_templates."""
 
     import os
     import glob
@@ -1034,118 +1142,15 @@ def update_data_dct(file_path, file_template, data_dct=None, data_type="anat",
                     # TODO: more involved processing here? or not necessary?
                     pass
 
-    # reduce the template down to only the sub-strings that do not have
-    # these tags or IDs
-
-    # Example
-    #   file_template =
-    #     /path/to/{site}/sub-{participant}/ses-{session}/func/
-    #         sub-{participant}_ses-{session}_task-{scan}_bold.nii.gz
-    site_parts = file_template.split('{site}')
-
-    # Example, cont.
-    # site_parts =
-    #   ['/path/to/', '/sub-{participant}/ses-{session}/..']
-
-    partic_parts = []
-    for part in site_parts:
-        partic_parts = partic_parts + part.split('{participant}')
-
-    # Example, cont.
-    # partic_parts =
-    #   ['/path/to/', '/sub-', '/ses-{session}/func/sub-', '_ses-{session}..']
-
-    ses_parts = []
-    for part in partic_parts:
-        ses_parts = ses_parts + part.split('{session}')
-
-    # Example, cont.
-    # ses_parts =
-    #   ['/path/to/', '/sub-', '/ses-', '/func/sub-', '_ses-',
-    #    '_task-{scan}_bold.nii.gz']
-
-    if data_type == "anat" or data_type == "brain_mask":
-        parts = ses_parts
-    else:
-        # if functional, or field map files
-        parts = []
-        for part in ses_parts:
-            parts = parts + part.split('{scan}')
-
-        # Example, cont.
-        #   parts = ['/path/to/', '/sub-', '/ses-', '/func/sub-', '_ses-',
-        #            '_task-', '_bold.nii.gz']
-
-    if "*" in file_template:
-        wild_parts = []
-        for part in parts:
-            wild_parts = wild_parts + part.split('*')
-        parts = wild_parts
-
-    new_template = file_template
-    new_path = file_path
-
-    # go through the non-label/non-ID substrings and parse them out,
-    # going from left to right and chopping out both sides of the whole
-    # string until only the tag, and the ID, are left
-    path_dct = {}
-    for idx in range(0, len(parts)):
-        part1 = parts[idx]
-        try:
-            part2 = parts[idx + 1]
-        except IndexError:
-            break
-
-        label = new_template.split(part1, 1)[1]
-        label = label.split(part2, 1)[0]
-
-        if label in path_dct.keys():
-            continue
-
-        if label == "*":
-            # if current key is a wildcard
-            continue
-
-        try:
-            id = new_path.split(part1, 1)[1]
-            id = id.split(part2, 1)[0]
-        except:
-            print(f"Path split exception: {new_path} // {part1}, {part2}")
-
-        # example, ideally at this point, something like this:
-        #   template: /path/to/sub-{participant}/etc.
-        #   filepath: /path/to/sub-200/etc.
-        #   label = {participant}
-        #   id    = '200'
-
-        if label not in path_dct.keys():
-            path_dct[label] = id
-            skip = False
-        else:
-            if path_dct[label] != id:
-                warn = "\n\n[!] WARNING: While parsing your input data " \
-                       "files, a file path was found with conflicting " \
-                       "IDs for the same data level.\n\n" \
-                       "File path: {0}\n" \
-                       "Level: {1}\n" \
-                       "Conflicting IDs: {2}, {3}\n\n" \
-                       "Thus, we can't tell which {4} it belongs to, and " \
-                       "whether this file should be included or excluded! " \
-                       "Therefore, this file has not been added to the " \
-                       "data configuration.".format(file_path, label,
-                                                    path_dct[label], id,
-                                                    label.replace("{", "").replace("}", ""))
-                print(warn)
-                skip = True
-                break
-
-        new_template = new_template.replace(part1, '', 1)
-        new_template = new_template.replace(label, '', 1)
-
-        new_path = new_path.replace(part1, '', 1)
-        new_path = new_path.replace(id, '', 1)
-
-    if skip:
+    # parse the IDs out of the file path, e.g.
+    #   template: /path/to/sub-{participant}/etc.
+    #   filepath: /path/to/sub-200/etc.
+    #   path_dct: {'{participant}': '200'}
+    if path_dct is None:
+        path_dct = parse_file_path(file_path,
+                                   compile_file_template(file_template,
+                                                         data_type))
+    if not path_dct:
         return data_dct
 
     sub_id = path_dct['{participant}']
@@ -1389,12 +1394,18 @@ def get_nonBIDS_data(anat_template, func_template, file_list=None,
                      brain_mask_template=None, fmap_phase_template=None,
                      fmap_mag_template=None, fmap_pedir_template=None,
                      aws_creds_path=None, inclusion_dct=None,
-                     exclusion_dct=None, sites_dct=None, verbose=False):
+                     exclusion_dct=None, sites_dct=None, verbose=False,
+                     n_procs=1):
     """Prepare a data dictionary for the data configuration file when given
-    file path templates describing the input data directories."""
+    file path templates describing the input data directories.
+
+    The templates are compiled into regular expressions once, and matched
+    against the file paths in bulk (across n_procs processes)."""
 
     import glob
-    import fnmatch
+
+    inclusion_dct = incl_excl_sets(inclusion_dct)
+    exclusion_dct = incl_excl_sets(exclusion_dct)
 
     if not func_template:
         func_template = ''
@@ -1446,27 +1457,33 @@ def get_nonBIDS_data(anat_template, func_template, file_list=None,
             func_glob = func_glob.replace(keyword, '*')
 
     # presumably, the paths contained in each of these pools should be anat
-    # and func files only, respectively, if the templates were set up properly
+    # and func files only, respectively, if the templates were set up
+    # properly; each pool pairs the file paths with their parsed IDs
     anat_pool = []
     func_pool = []
 
     if file_list:
         # mainly for AWS S3-stored data sets
-        for filepath in file_list:
-            if fnmatch.fnmatch(filepath, anat_glob):
-                anat_pool.append(filepath)
-            elif fnmatch.fnmatch(filepath, func_glob):
-                func_pool.append(filepath)
+        anat_pool = match_file_templates(file_list, anat_template, "anat",
+                                         n_procs)
+        if func_template:
+            anat_paths = set(path for path, _ in anat_pool)
+            func_pool = match_file_templates(
+                [x for x in file_list if x not in anat_paths],
+                func_template, "func", n_procs)
 
     # run it anyway in case we're pulling anat from S3 and func from local or
     # vice versa - and if there is no file_list, this will run normally
-    anat_local_pool = glob.glob(anat_glob)
-    func_local_pool = glob.glob(func_glob)
-
-    # anat_pool and func_pool are now lists with (presumably) all of the file
-    # paths that match the templates entered
-    anat_pool = anat_pool + [x for x in anat_local_pool if x not in anat_pool]
-    func_pool = func_pool + [x for x in func_local_pool if x not in func_pool]
+    if "s3://" not in anat_glob:
+        anat_paths = set(path for path, _ in anat_pool)
+        anat_pool += match_file_templates(
+            [x for x in glob.glob(anat_glob) if x not in anat_paths],
+            anat_template, "anat", n_procs)
+    if func_template and "s3://" not in func_glob:
+        func_paths = set(path for path, _ in func_pool)
+        func_pool += match_file_templates(
+            [x for x in glob.glob(func_glob) if x not in func_paths],
+            func_template, "func", n_procs)
 
     if not anat_pool:
         err = "\n\n[!] No anatomical input file paths found given the data " \
@@ -1480,17 +1497,18 @@ def get_nonBIDS_data(anat_template, func_template, file_list=None,
     # pull out the site/participant/etc. IDs from each path and connect them
     # for the anatomicals
     data_dct = {}
-    for anat_path in anat_pool:
+    for anat_path, path_dct in anat_pool:
         data_dct = update_data_dct(anat_path, anat_template, data_dct, "anat",
                                    anat_scan, sites_dct, None, inclusion_dct,
-                                   exclusion_dct, aws_creds_path)
+                                   exclusion_dct, aws_creds_path,
+                                   path_dct=path_dct)
 
     if not data_dct:
         # this fires if no anatomicals were found
         # collect some possible examples of anat files that got missed
         possible_anats = []
         all_tags = []
-        for anat_path in anat_pool:
+        for anat_path, _ in anat_pool:
             if "T1w" in anat_path or "mprage" in anat_path or \
                     "anat" in anat_path:
                 possible_anats.append(anat_path)
@@ -1532,11 +1550,11 @@ def get_nonBIDS_data(anat_template, func_template, file_list=None,
         raise Exception(err)
 
     # now gather the functionals
-    for func_path in func_pool:
+    for func_path, path_dct in func_pool:
         data_dct = update_data_dct(func_path, func_template, data_dct, "func",
                                    None, sites_dct, scan_params_dct,
                                    inclusion_dct, exclusion_dct,
-                                   aws_creds_path)
+                                   aws_creds_path, path_dct=path_dct)
 
     if brain_mask_template:
         # make globby templates, to use them to filter down the path_list into
@@ -1551,19 +1569,19 @@ def get_nonBIDS_data(anat_template, func_template, file_list=None,
         # field map files only, if the templates were set up properly
         if file_list:
             # mainly for AWS S3-stored data sets
-            brain_mask_pool = []
-            for filepath in file_list:
-                if fnmatch.fnmatch(filepath, brain_mask_glob):
-                    brain_mask_pool.append(filepath)
+            brain_mask_pool = match_file_templates(
+                file_list, brain_mask_template, "brain_mask", n_procs)
         else:
-            brain_mask_pool = glob.glob(brain_mask_glob)
+            brain_mask_pool = match_file_templates(
+                glob.glob(brain_mask_glob), brain_mask_template,
+                "brain_mask", n_procs)
 
-        for brain_mask in brain_mask_pool:
+        for brain_mask, path_dct in brain_mask_pool:
             data_dct = update_data_dct(brain_mask, brain_mask_template,
                                        data_dct, "brain_mask", None,
                                        sites_dct, scan_params_dct,
                                        inclusion_dct, exclusion_dct,
-                                       aws_creds_path)
+                                       aws_creds_path, path_dct=path_dct)
 
     # do the same for the fieldmap files, if applicable
     if fmap_phase_template and fmap_mag_template:
@@ -1592,35 +1610,38 @@ def get_nonBIDS_data(anat_template, func_template, file_list=None,
         # field map files only, if the templates were set up properly
         if file_list:
             # mainly for AWS S3-stored data sets
-            fmap_phase_pool = []
-            fmap_mag_pool = []
-            for filepath in file_list:
-                if fnmatch.fnmatch(filepath, fmap_phase_glob):
-                    fmap_phase_pool.append(filepath)
-                elif fnmatch.fnmatch(filepath, fmap_mag_glob):
-                    fmap_mag_pool.append(filepath)
+            fmap_phase_pool = match_file_templates(
+                file_list, fmap_phase_template, "diff_phase", n_procs)
+            fmap_phase_paths = set(path for path, _ in fmap_phase_pool)
+            fmap_mag_pool = match_file_templates(
+                [x for x in file_list if x not in fmap_phase_paths],
+                fmap_mag_template, "diff_mag", n_procs)
         else:
-            fmap_phase_pool = glob.glob(fmap_phase_glob)
-            fmap_mag_pool = glob.glob(fmap_mag_glob)
-
-        for fmap_phase in fmap_phase_pool:
+            fmap_phase_pool = match_file_templates(
+                glob.glob(fmap_phase_glob), fmap_phase_template,
+                "diff_phase", n_procs)
+            fmap_mag_pool = match_file_templates(
+                glob.glob(fmap_mag_glob), fmap_mag_template, "diff_mag",
+                n_procs)
+
+        for fmap_phase, path_dct in fmap_phase_pool:
             data_dct = update_data_dct(fmap_phase, fmap_phase_template,
                                        data_dct, "diff_phase", None,
                                        sites_dct, scan_params_dct,
                                        inclusion_dct, exclusion_dct,
-                                       aws_creds_path)
+                                       aws_creds_path, path_dct=path_dct)
 
-        for fmap_mag in fmap_mag_pool:
+        for fmap_mag, path_dct in fmap_mag_pool:
             data_dct = update_data_dct(fmap_mag, fmap_mag_template,
                                        data_dct, "diff_mag", None,
                                        sites_dct, scan_params_dct,
                                        inclusion_dct, exclusion_dct,
-                                       aws_creds_path)
+                                       aws_creds_path, path_dct=path_dct)
 
     if fmap_pedir_template:
         # make globby templates, to use them to filter down the path_list into
         # only paths that will work with the templates
-        fmap_pedir_glob = fmap_phase_template
+        fmap_pedir_glob = fmap_pedir_template
 
         for keyword in keywords:
             if keyword in fmap_pedir_glob:
@@ -1630,22 +1651,22 @@ def get_nonBIDS_data(anat_template, func_template, file_list=None,
         # field map files only, if the templates were set up properly
         if file_list:
             # mainly for AWS S3-stored data sets
-            fmap_pedir_pool = []
-            for filepath in file_list:
-                if fnmatch.fnmatch(filepath, fmap_pedir_glob):
-                    fmap_pedir_pool.append(filepath)
+            fmap_pedir_pool = match_file_templates(
+                file_list, fmap_pedir_template, "fmap_pedir", n_procs)
         else:
-            fmap_pedir_pool = glob.glob(fmap_pedir_glob)
+            fmap_pedir_pool = match_file_templates(
+                glob.glob(fmap_pedir_glob), fmap_pedir_template,
+                "fmap_pedir", n_procs)
 
         #TODO: must now deal with phase encoding direction!!!!
         #TODO: have to check scan params, first!!!
 
-        for fmap_pedir in fmap_pedir_pool:
+        for fmap_pedir, path_dct in fmap_pedir_pool:
             data_dct = update_data_dct(fmap_pedir, fmap_pedir_template,
                                        data_dct, "fmap_pedir", None,
                                        sites_dct, scan_params_dct,
                                        inclusion_dct, exclusion_dct,
-                                       aws_creds_path)
+                                       aws_creds_path, path_dct=path_dct)
 
     return data_dct
 
@@ -1723,6 +1744,13 @@ def run(data_settings_yml):
             "none" in settings_dct["awsCredentialsFile"]:
         settings_dct["awsCredentialsFile"] = None
 
+    if "bidsIndexFile" not in settings_dct or \
+            not settings_dct["bidsIndexFile"]:
+        settings_dct["bidsIndexFile"] = None
+    elif "None" in settings_dct["bidsIndexFile"] or \
+            "none" in settings_dct["bidsIndexFile"]:
+        settings_dct["bidsIndexFile"] = None
+
     if "anatomical_scan" not in settings_dct or \
         not settings_dct["anatomical_scan"]:
         settings_dct["anatomical_scan"] = None
@@ -1730,6 +1758,21 @@ def run(data_settings_yml):
             "none" in settings_dct["anatomical_scan"]:
         settings_dct["anatomical_scan"] = None
 
+    # reuse recent listings of data sets on AWS S3
+    s3_cache_dir = settings_dct.get("awsListingCacheDirectory")
+    if not s3_cache_dir or "None" in s3_cache_dir or "none" in s3_cache_dir:
+        s3_cache_dir = None
+    try:
+        s3_cache_ttl = float(settings_dct.get("awsListingCacheTTL", 3600))
+    except (TypeError, ValueError):
+        s3_cache_ttl = 3600
+
+    # number of processes to match file paths against the templates with
+    try:
+        n_procs = max(1, int(settings_dct.get("numProcesses", 1)))
+    except (TypeError, ValueError):
+        n_procs = 1
+
     # inclusion lists
     incl_dct = format_incl_excl_dct(settings_dct.get('siteList', None), 'sites')
     incl_dct.update(format_incl_excl_dct(settings_dct.get('subjectList', None),
@@ -1751,7 +1794,12 @@ def run(data_settings_yml):
     if 'bids' in settings_dct['dataFormat'].lower():
 
         file_list = get_file_list(settings_dct["bidsBaseDir"],
-                                  creds_path=settings_dct["awsCredentialsFile"])
+                                  creds_path=settings_dct["awsCredentialsFile"],
+                                  index_path=settings_dct["bidsIndexFile"],
+                                  s3_cache_dir=s3_cache_dir,
+                                  s3_cache_ttl=s3_cache_ttl,
+                                  inclusion_dct=incl_dct,
+                                  exclusion_dct=excl_dct)
 
         data_dct = get_BIDS_data_dct(settings_dct['bidsBaseDir'],
                                      file_list=file_list,
@@ -1760,7 +1808,8 @@ def run(data_settings_yml):
                                      aws_creds_path=settings_dct['awsCredentialsFile'],
                                      inclusion_dct=incl_dct,
                                      exclusion_dct=excl_dct,
-                                     config_dir=settings_dct["outputSubjectListLocation"])
+                                     config_dir=settings_dct["outputSubjectListLocation"],
+                                     n_procs=n_procs)
 
     elif 'custom' in settings_dct['dataFormat'].lower():
 
@@ -1788,7 +1837,9 @@ def run(data_settings_yml):
 
         if base_dir:
             file_list = pull_s3_sublist(base_dir,
-                                        settings_dct['awsCredentialsFile'])
+                                        settings_dct['awsCredentialsFile'],
+                                        cache_dir=s3_cache_dir,
+                                        cache_ttl=s3_cache_ttl)
 
         params_dct = None
         if settings_dct['scanParametersCSV']:
@@ -1806,7 +1857,8 @@ def run(data_settings_yml):
                                     fmap_mag_template=settings_dct['fieldMapMagnitude'],
                                     aws_creds_path=settings_dct['awsCredentialsFile'],
                                     inclusion_dct=incl_dct,
-                                    exclusion_dct=excl_dct)
+                                    exclusion_dct=excl_dct,
+                                    n_procs=n_procs)
 
     else:
         err = "\n\n[!] You must select a data format- either 'BIDS' or " \
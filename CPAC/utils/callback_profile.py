@@ -0,0 +1,311 @@
+"""Critical path, waits and utilization of a run, from its callback log
+
+log_nodes_cb records, for every node that ran, its start and finish times,
+its peak memory and CPU usage, its working directory and the directories of
+the nodes it takes inputs from. From those records the executed graph is
+rebuilt, to find:
+
+- the critical path: the chain of nodes, each waiting for the previous one
+  to finish, that ends with the last node of the run;
+- for each node, its self time (run time) and wait time (between its inputs
+  being ready and its start, i.e. waiting for cores or memory);
+- the cores and memory used over time.
+
+The report is an HTML page with a Gantt chart of the nodes, in SVG.
+"""
+import json
+from xml.sax.saxutils import escape
+
+import networkx as nx
+
+from CPAC.utils.monitoring import _parse_time
+
+
+def load_callback_log(callback_log):
+    """
+    Node runs recorded in a callback log
+
+    Parameters
+    ----------
+    callback_log : string
+        path to a callback log written by log_nodes_cb
+
+    Returns
+    -------
+    runs : dictionary
+        latest finished run of each node, by node ID, with its start and
+        finish as seconds since the start of the first node
+    """
+    runs = {}
+    with open(callback_log, 'r') as f:
+        for line in f:
+            try:
+                run = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(run, dict) or 'id' not in run:
+                continue
+            start = _parse_time(run.get('start'))
+            finish = _parse_time(run.get('finish'))
+            if start is None or finish is None:
+                continue
+            run['start'], run['finish'] = start, finish
+            runs[run['id']] = run
+
+    if runs:
+        t0 = min(run['start'] for run in runs.values())
+        for run in runs.values():
+            run['start'] = (run['start'] - t0).total_seconds()
+            run['finish'] = (run['finish'] - t0).total_seconds()
+
+    return runs
+
+
+def executed_graph(runs):
+    """
+    Graph of the node runs, from the directories of the nodes they took
+    inputs from
+
+    Parameters
+    ----------
+    runs : dictionary
+        see load_callback_log
+
+    Returns
+    -------
+    graph : networkx.DiGraph
+    """
+    graph = nx.DiGraph()
+    graph.add_nodes_from(runs)
+    by_dir = {run['output_dir']: node_id for node_id, run in runs.items()
+              if run.get('output_dir')}
+    for node_id, run in runs.items():
+        for upstream in run.get('upstream', []):
+            if upstream in by_dir and by_dir[upstream] != node_id:
+                graph.add_edge(by_dir[upstream], node_id)
+    return graph
+
+
+def _number(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+
+def node_times(runs, graph):
+    """
+    Self time, ready time and wait time of every node run
+
+    A node is ready when the last of its inputs finishes, or at the start of
+    the run without inputs.
+
+    Returns
+    -------
+    times : dictionary
+        {'self': seconds, 'ready': seconds, 'wait': seconds} by node ID
+    """
+    times = {}
+    for node_id, run in runs.items():
+        ready = max([runs[upstream]['finish']
+                     for upstream in graph.predecessors(node_id)] or [0.0])
+        times[node_id] = {
+            'self': run['finish'] - run['start'],
+            'ready': ready,
+            'wait': max(0.0, run['start'] - ready),
+        }
+    return times
+
+
+def critical_path(runs, graph):
+    """
+    Chain of node runs ending with the last one, each preceded by the input
+    it waited for (the last one to finish)
+
+    Returns
+    -------
+    path : list
+        node IDs, in run order
+    """
+    if not runs:
+        return []
+    node_id = max(runs, key=lambda node: runs[node]['finish'])
+    path = [node_id]
+    while True:
+        upstream = list(graph.predecessors(node_id))
+        if not upstream:
+            break
+        node_id = max(upstream, key=lambda node: runs[node]['finish'])
+        path.append(node_id)
+    return path[::-1]
+
+
+def utilization(runs):
+    """
+    Cores and memory used by the running nodes over time
+
+    Cores are the CPU usage recorded for the node, or the cores it was given
+    when not recorded.
+
+    Returns
+    -------
+    samples : list
+        (time, running nodes, cores, memory GB, estimated memory GB) tuples,
+        at every start and finish, in time order
+    """
+    events = []
+    for run in runs.values():
+        cores = _number(run.get('runtime_threads'))
+        cores = cores / 100.0 if cores is not None else \
+            _number(run.get('num_threads')) or 1.0
+        usage = (1, cores, _number(run.get('runtime_memory_gb')) or 0.0,
+                 _number(run.get('estimated_memory_gb')) or 0.0)
+        events.append((run['start'], 1, usage))
+        events.append((run['finish'], -1, usage))
+
+    # finishes before starts at the same time
+    events.sort(key=lambda event: (event[0], event[1]))
+    current = [0, 0.0, 0.0, 0.0]
+    samples = []
+    for time, sign, usage in events:
+        current = [value + sign * delta
+                   for value, delta in zip(current, usage)]
+        sample = (time, current[0], round(current[1], 6),
+                  round(current[2], 6), round(current[3], 6))
+        if samples and samples[-1][0] == time:
+            samples[-1] = sample
+        else:
+            samples.append(sample)
+    return samples
+
+
+def profile_callback_log(callback_log):
+    """
+    Analysis of a run from its callback log
+
+    Returns
+    -------
+    profile : dictionary
+        runs, graph, times, critical_path, utilization and the run's
+        duration
+    """
+    runs = load_callback_log(callback_log)
+    graph = executed_graph(runs)
+    return {
+        'runs': runs,
+        'graph': graph,
+        'times': node_times(runs, graph),
+        'critical_path': critical_path(runs, graph),
+        'utilization': utilization(runs),
+        'duration': max([run['finish'] for run in runs.values()] or [0.0]),
+    }
+
+
+def _format_seconds(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{0}:{1:02d}:{2:02d}'.format(hours, minutes, seconds)
+
+
+def gantt_svg(profile, width=1200, row_height=14):
+    """
+    Gantt chart of the node runs, followed by the cores and memory used,
+    as SVG
+
+    Nodes on the critical path are drawn in red, and the wait before each
+    node in grey.
+    """
+    runs = profile['runs']
+    duration = profile['duration'] or 1.0
+    label_width = 360
+    scale = (width - label_width - 10) / duration
+    critical = set(profile['critical_path'])
+    order = sorted(runs, key=lambda node: (runs[node]['start'], node))
+    chart_height = 80
+
+    height = row_height * len(order) + 2 * (chart_height + 30) + 20
+    svg = ['<svg xmlns="http://www.w3.org/2000/svg" width="{0}" '
+           'height="{1}" font-family="sans-serif" font-size="10">'.format(
+               width, height)]
+
+    for row, node_id in enumerate(order):
+        run = runs[node_id]
+        times = profile['times'][node_id]
+        y = row * row_height
+        svg.append('<text x="0" y="{0}">{1}</text>'.format(
+            y + row_height - 3, escape(node_id[-60:])))
+        if times['wait'] > 0:
+            svg.append('<rect x="{0:.1f}" y="{1}" width="{2:.1f}" '
+                       'height="{3}" fill="#ddd"/>'.format(
+                           label_width + times['ready'] * scale, y + 2,
+                           times['wait'] * scale, row_height - 4))
+        svg.append(
+            '<rect x="{0:.1f}" y="{1}" width="{2:.1f}" height="{3}" '
+            'fill="{4}"><title>{5}\nself {6}, wait {7}, {8} GB</title>'
+            '</rect>'.format(
+                label_width + run['start'] * scale, y + 1,
+                max(1.0, times['self'] * scale), row_height - 2,
+                '#c0392b' if node_id in critical else '#2e86c1',
+                escape(node_id), _format_seconds(times['self']),
+                _format_seconds(times['wait']),
+                run.get('runtime_memory_gb', 'N/A')))
+
+    samples = profile['utilization']
+    top = row_height * len(order) + 20
+    for index, name in [(2, 'cores'), (3, 'memory (GB)')]:
+        peak = max([sample[index] for sample in samples] or [0.0]) or 1.0
+        points = []
+        previous_y = top + chart_height
+        for sample in samples:
+            # steps: the usage holds until the next sample
+            x = label_width + sample[0] * scale
+            y = top + chart_height * (1 - sample[index] / peak)
+            points.append('{0:.1f},{1:.1f}'.format(x, previous_y))
+            points.append('{0:.1f},{1:.1f}'.format(x, y))
+            previous_y = y
+        svg.append('<text x="0" y="{0}">{1}, peak {2:g}</text>'.format(
+            top + chart_height / 2, name, round(peak, 2)))
+        svg.append('<polyline fill="none" stroke="#2e86c1" '
+                   'points="{0}"/>'.format(' '.join(points)))
+        top += chart_height + 30
+
+    svg.append('</svg>')
+    return '\n'.join(svg)
+
+
+def html_report(profile, title='C-PAC run profile', top=20):
+    """HTML page with the critical path, the longest nodes and waits, and
+    the Gantt chart"""
+    runs = profile['runs']
+    times = profile['times']
+
+    def table(node_ids):
+        rows = ['<tr><th>node</th><th>start</th><th>self</th>'
+                '<th>wait</th><th>memory (GB)</th><th>threads</th></tr>']
+        for node_id in node_ids:
+            rows.append(
+                '<tr><td>{0}</td><td>{1}</td><td>{2}</td><td>{3}</td>'
+                '<td>{4}</td><td>{5}</td></tr>'.format(
+                    escape(node_id), _format_seconds(runs[node_id]['start']),
+                    _format_seconds(times[node_id]['self']),
+                    _format_seconds(times[node_id]['wait']),
+                    runs[node_id].get('runtime_memory_gb', 'N/A'),
+                    runs[node_id].get('runtime_threads', 'N/A')))
+        return '<table>' + ''.join(rows) + '</table>'
+
+    by_self = sorted(runs, key=lambda node: -times[node]['self'])[:top]
+    by_wait = sorted(runs, key=lambda node: -times[node]['wait'])[:top]
+    return '\n'.join([
+        '<!DOCTYPE html>',
+        '<html><head><meta charset="utf-8"><title>{0}</title>'.format(
+            escape(title)),
+        '<style>body {font-family: sans-serif} td, th {padding: 0 8px; '
+        'text-align: left}</style></head><body>',
+        '<h1>{0}</h1>'.format(escape(title)),
+        '<p>{0} nodes, run time {1}</p>'.format(
+            len(runs), _format_seconds(profile['duration'])),
+        '<h2>Critical path</h2>', table(profile['critical_path']),
+        '<h2>Longest nodes</h2>', table(by_self),
+        '<h2>Longest waits</h2>', table(by_wait),
+        '<h2>Timeline</h2>', gantt_svg(profile),
+        '</body></html>'
+    ])
@@ -432,8 +432,28 @@ def check_for_s3(file_path, creds_path=None, dl_dir=None, img_type='other',
         local_path = file_path
         return local_path
 
-    if file_path.lower().startswith(s3_str):
-        
+    if file_path.lower().startswith(s3_str) and \
+            os.environ.get('CPAC_S3_INPUT_CACHE'):
+
+        # shared, content-addressed cache populated by the runner's
+        # prefetcher; identical inputs are only downloaded once per host
+        from CPAC.utils.s3_cache import S3InputCache, split_s3_path
+
+        file_path = s3_str + file_path[len(s3_str):]
+        cache = S3InputCache(os.environ['CPAC_S3_INPUT_CACHE'],
+                             os.environ.get('CPAC_S3_INPUT_CACHE_MAX_GB'),
+                             creds_path=creds_path)
+        try:
+            # linked into the node's directory, which keeps the file if
+            # the cache evicts it while the participant still uses it
+            local_path = cache.link(
+                cache.fetch(file_path),
+                os.path.join(dl_dir, *split_s3_path(file_path)))
+        finally:
+            cache.release()
+
+    elif file_path.lower().startswith(s3_str):
+
         file_path = s3_str + file_path[len(s3_str):]
 
         # Get bucket name and bucket object
@@ -541,6 +561,7 @@ def check_for_s3(file_path, creds_path=None, dl_dir=None, img_type='other',
 
 def resolve_resolution(resolution, template, template_name, tag = None):
 
+    import os
     import nipype.interfaces.afni as afni
     import nipype.pipeline.engine as pe
     from CPAC.utils.datasource import check_for_s3
@@ -576,6 +597,12 @@ def resolve_resolution(resolution, template, template_name, tag = None):
         else:
             resolution = (float(resolution.replace('mm', '')), ) * 3
 
+        if os.environ.get('CPAC_TEMPLATE_CACHE'):
+            # shared by the participants of the run, and later runs
+            from CPAC.utils.template_cache import resample_template
+            return resample_template(local_path, resolution,
+                                     os.environ['CPAC_TEMPLATE_CACHE'])
+
         resample = pe.Node(interface = afni.Resample(), name=template_name)
         resample.inputs.voxel_size = resolution
         resample.inputs.outputtype = 'NIFTI_GZ'
@@ -866,12 +893,29 @@ def resample_func_roi(in_func, in_roi, realignment, identity_matrix):
             out_roi = out_file
             interp = 'nearestneighbour'
 
-        cmd = ['flirt', '-in', in_file, 
-                '-ref', reference, 
-                '-out', out_file, 
-                '-interp', interp, 
-                '-applyxfm', '-init', identity_matrix]
-        subprocess.check_output(cmd)
+        def flirt(out_file):
+            cmd = ['flirt', '-in', in_file, 
+                    '-ref', reference, 
+                    '-out', out_file, 
+                    '-interp', interp, 
+                    '-applyxfm', '-init', identity_matrix]
+            subprocess.check_output(cmd)
+            return out_file
+
+        if 'ROI_to_func' in realignment and \
+                os.environ.get('CPAC_TEMPLATE_CACHE'):
+            # the resampled ROI only depends on the grid of the functional
+            # image, which the participants registered to the same template
+            # share
+            from CPAC.utils.template_cache import (ImageCache, file_sha1,
+                                                   grid_signature)
+            out_roi = ImageCache(os.environ['CPAC_TEMPLATE_CACHE']).get(
+                ['flirt', file_sha1(in_roi), grid_signature(func_img),
+                 interp, file_sha1(identity_matrix)],
+                lambda tmp_dir: flirt(os.path.join(
+                    tmp_dir, os.path.basename(out_file))))
+        else:
+            flirt(out_file)
 
     else:
         out_func = in_func
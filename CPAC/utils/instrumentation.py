@@ -0,0 +1,179 @@
+"""Resource usage of nodes, beyond nipype's peak memory and CPU percentage
+
+The C-PAC MultiProc plugins run each node through run_node_instrumented,
+which measures, in the worker process, the CPU user and system time and the
+bytes read and written by the node (and the commands it runs), and stores
+them next to the node's results. log_nodes_cb then adds them to the callback
+log, with the size of the node's directory, the dimensions of its input and
+output images, and the stage timings of Function nodes (see
+CPAC.utils.interfaces.function.stage).
+"""
+import json
+import os
+import resource
+
+# file, next to the node's results, with its resource usage
+USAGE_FILE = '_resource_usage.json'
+
+# images whose dimensions are logged, per node
+MAX_IMAGES = 20
+
+IMAGE_EXTENSIONS = ('.nii', '.nii.gz', '.mgz')
+
+
+def resource_usage():
+    """
+    Cumulative CPU time and I/O of this process and its finished children
+
+    The bytes of this process are those read from and written to storage;
+    for its children, the kernel only reports blocks of 512 bytes.
+
+    Returns
+    -------
+    usage : dictionary
+    """
+    import psutil
+
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    usage = {
+        'cpu_user_s': own.ru_utime + children.ru_utime,
+        'cpu_system_s': own.ru_stime + children.ru_stime,
+        'read_bytes': 512 * children.ru_inblock,
+        'write_bytes': 512 * children.ru_oublock,
+    }
+    try:
+        io = psutil.Process().io_counters()
+        usage['read_bytes'] += io.read_bytes
+        usage['write_bytes'] += io.write_bytes
+    except (AttributeError, psutil.Error):
+        usage['read_bytes'] += 512 * own.ru_inblock
+        usage['write_bytes'] += 512 * own.ru_oublock
+    return usage
+
+
+def run_node_instrumented(node, updatehash, taskid):
+    """
+    nipype's MultiProc run_node, storing the resource usage of the node in
+    its directory
+    """
+    from nipype.pipeline.plugins.multiproc import run_node
+
+    before = resource_usage()
+    result = run_node(node, updatehash, taskid)
+    after = resource_usage()
+
+    try:
+        with open(os.path.join(node.output_dir(), USAGE_FILE), 'w') as f:
+            json.dump({key: after[key] - before[key] for key in after}, f)
+    except (IOError, OSError):
+        pass
+
+    return result
+
+
+def directory_size(path):
+    """Bytes used by the files of a directory tree, symbolic links excluded"""
+    size = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            file_path = os.path.join(root, f)
+            if not os.path.islink(file_path):
+                try:
+                    size += os.stat(file_path).st_blocks * 512
+                except OSError:
+                    pass
+    return size
+
+
+def _image_paths(value):
+    if isinstance(value, str):
+        if value.endswith(IMAGE_EXTENSIONS):
+            yield value
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            for path in _image_paths(item):
+                yield path
+    elif isinstance(value, dict):
+        for item in value.values():
+            for path in _image_paths(item):
+                yield path
+
+
+def image_dimensions(values):
+    """
+    Dimensions of the images among the values of a node's inputs or outputs
+
+    Parameters
+    ----------
+    values : dictionary
+        values by input or output name
+
+    Returns
+    -------
+    dimensions : dictionary
+        list of image dimensions by input or output name, for at most
+        MAX_IMAGES images
+    """
+    import nibabel as nb
+
+    dimensions = {}
+    n_images = 0
+    for name, value in sorted(values.items()):
+        for path in _image_paths(value):
+            if n_images >= MAX_IMAGES:
+                return dimensions
+            if not os.path.isfile(path):
+                continue
+            try:
+                shape = nb.load(path).header.get_data_shape()
+            except Exception:
+                continue
+            dimensions.setdefault(name, []).append(
+                [int(n) for n in shape])
+            n_images += 1
+    return dimensions
+
+
+def node_instrumentation(node):
+    """
+    Resource usage of a node that ran, for the callback log
+
+    Parameters
+    ----------
+    node : nipype.pipeline.engine.Node
+
+    Returns
+    -------
+    usage : dictionary
+    """
+    from nipype.interfaces.base import isdefined
+
+    usage = {}
+    outdir = node.output_dir()
+
+    try:
+        with open(os.path.join(outdir, USAGE_FILE), 'r') as f:
+            usage.update(json.load(f))
+    except (IOError, OSError, ValueError):
+        pass
+
+    usage['output_bytes'] = directory_size(outdir)
+
+    inputs = {name: value for name, value in node.inputs.trait_get().items()
+              if isdefined(value)}
+    usage['input_dimensions'] = image_dimensions(inputs)
+
+    result = node.result
+    if result is not None and result.outputs is not None:
+        outputs = {name: value
+                   for name, value in result.outputs.trait_get().items()
+                   if isdefined(value)}
+        usage['output_dimensions'] = image_dimensions(outputs)
+
+    stage_timings = getattr(getattr(result, 'runtime', None),
+                            'stage_timings', None)
+    if stage_timings:
+        usage['stage_timings'] = stage_timings
+
+    return usage
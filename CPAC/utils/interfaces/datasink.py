@@ -14,7 +14,9 @@ import tempfile
 from os.path import join, dirname
 from shutil import SameFileError
 from warnings import warn
-from nipype.interfaces.io import IOBase, DataSinkInputSpec, DataSinkOutputSpec, ProgressPercentage, copytree
+from concurrent.futures import ThreadPoolExecutor
+from nipype.interfaces.io import IOBase, DataSinkInputSpec as \
+    BaseDataSinkInputSpec, DataSinkOutputSpec, ProgressPercentage, copytree
 
 from nipype import config, logging
 from nipype.utils.misc import human_order_sorted, str2bool
@@ -33,6 +35,7 @@ iflogger = logging.getLogger('nipype.interface')
 
 RETRY = 5
 RETRY_WAIT = 5
+RETRY_WAIT_MAX = 60
 
 
 def _get_head_bucket(s3_resource, bucket_name):
@@ -73,6 +76,96 @@ def _get_head_bucket(s3_resource, bucket_name):
         raise Exception(err_msg)
 
 
+def _gzip_file(src, dst, compress_level):
+    """ Compress src into dst, only putting dst in place once complete
+
+    The gzip header carries no file name or time, so identical files always
+    compress to identical bytes
+    """
+
+    import gzip
+
+    partial = dst + '.part'
+    with open(src, 'rb') as f_in, open(partial, 'wb') as f_raw:
+        with gzip.GzipFile(filename='', mode='wb', fileobj=f_raw, mtime=0,
+                           compresslevel=compress_level) as f_out:
+            shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+    os.rename(partial, dst)
+
+    return dst
+
+
+def _file_md5(src, blocksize=8 * 1024 * 1024):
+    """ MD5 hex digest of a file, read in blocks
+    """
+
+    import hashlib
+
+    md5 = hashlib.md5()
+    with open(src, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            md5.update(block)
+
+    return md5.hexdigest()
+
+
+def _load_manifest(manifest_file):
+    """ Read an upload manifest, {s3 path: {md5, size, etag}}
+    """
+
+    if not manifest_file or not os.path.exists(manifest_file):
+        return {}
+    try:
+        with open(manifest_file, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        iflogger.warning('Ignoring unreadable upload manifest %s',
+                         manifest_file)
+        return {}
+
+
+def _write_manifest(manifest_file, manifest):
+    """ Write an upload manifest, only putting it in place once complete
+    """
+
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_file))
+    if not os.path.exists(manifest_dir):
+        try:
+            os.makedirs(manifest_dir)
+        except OSError:
+            if not os.path.isdir(manifest_dir):
+                raise
+
+    partial = manifest_file + '.part'
+    with open(partial, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(partial, manifest_file)
+
+
+class DataSinkInputSpec(BaseDataSinkInputSpec):
+
+    compress_nifti = traits.Bool(
+        False, usedefault=True,
+        desc='gzip uncompressed NIfTI (.nii) files as they are sunk')
+    compress_level = traits.Range(
+        low=1, high=9, value=6, usedefault=True,
+        desc='gzip compression level for compress_nifti')
+    compress_threads = traits.Range(
+        low=1, value=1, usedefault=True,
+        desc='number of files to compress in parallel')
+    upload_threads = traits.Range(
+        low=1, value=1, usedefault=True,
+        desc='number of files to upload to S3 in parallel')
+    multipart_threshold = traits.Range(
+        low=5, value=64, usedefault=True,
+        desc='size (MB) from which files are uploaded to S3 in parts, '
+             'and of each part')
+    upload_manifest = File(
+        desc='JSON file recording the S3 keys, MD5 checksums and sizes '
+             'uploaded by this sink; files matching it are not uploaded '
+             'again')
+
+
 class DataSink(IOBase):
     """ Generic datasink module to store structured outputs
         Primarily for use within a workflow. This interface allows arbitrary
@@ -377,83 +470,148 @@ class DataSink(IOBase):
         Method to upload outputs to S3 bucket instead of on local disk
         '''
 
-        # Import packages
-        import hashlib
-        import os
+        self._upload_files(bucket, [(src, dst)])
 
-        from botocore.exceptions import ClientError
+    # Concurrent S3 upload method
+    def _upload_files(self, bucket, upload_jobs):
+        '''
+        Method to upload (src, dst) pairs to an S3 bucket on a bounded
+        thread pool, skipping the files recorded as unchanged in the upload
+        manifest or already on S3
+        '''
 
         # Init variables
         s3_str = 's3://'
-        s3_prefix = s3_str + bucket.name
 
-        # Explicitly lower-case the "s3"
-        if dst[:len(s3_str)].lower() == s3_str:
-            dst = s3_str + dst[len(s3_str):]
-
-        # If src is a directory, collect files (this assumes dst is a dir too)
-        if os.path.isdir(src):
-            src_files = []
-            for root, dirs, files in os.walk(src):
-                src_files.extend([os.path.join(root, fil) for fil in files])
-            # Make the dst files have the dst folder as base dir
-            dst_files = [
-                os.path.join(dst,
-                             src_f.split(src)[1]) for src_f in src_files
+        file_jobs = []
+        for src, dst in upload_jobs:
+            # Explicitly lower-case the "s3"
+            if dst[:len(s3_str)].lower() == s3_str:
+                dst = s3_str + dst[len(s3_str):]
+
+            # If src is a directory, collect files (this assumes dst is a
+            # dir too)
+            if os.path.isdir(src):
+                for root, dirs, files in os.walk(src):
+                    for fil in files:
+                        src_f = os.path.join(root, fil)
+                        file_jobs.append(
+                            (src_f, os.path.join(dst, src_f.split(src)[1])))
+            else:
+                file_jobs.append((src, dst))
+
+        if not file_jobs:
+            return
+
+        manifest_file = self.inputs.upload_manifest \
+            if isdefined(self.inputs.upload_manifest) else None
+        manifest = _load_manifest(manifest_file)
+
+        n_threads = min(self.inputs.upload_threads, len(file_jobs))
+        with ThreadPoolExecutor(max_workers=n_threads) as pool:
+            futures = [
+                pool.submit(self._upload_file, bucket, src_f, dst_f,
+                            manifest.get(dst_f))
+                for src_f, dst_f in file_jobs
             ]
-        else:
-            src_files = [src]
-            dst_files = [dst]
+            try:
+                for (src_f, dst_f), future in zip(file_jobs, futures):
+                    manifest[dst_f] = future.result()
+            finally:
+                if manifest_file:
+                    _write_manifest(manifest_file, manifest)
+
+    # Send a single file up to S3 method
+    def _upload_file(self, bucket, src_f, dst_f, record=None):
+        '''
+        Method to upload one file to S3, in parts if it is large, retrying
+        with exponential backoff; returns its manifest record
+        '''
+
+        from boto3.s3.transfer import TransferConfig
+        from botocore.exceptions import ClientError
+
+        # boto3 clients, unlike resources, can be shared between threads
+        client = bucket.meta.client
+        s3_prefix = 's3://' + bucket.name
+        dst_k = dst_f.replace(s3_prefix, '').lstrip('/')
 
-        # Iterate over src and copy to dst
-        for src_idx, src_f in enumerate(src_files):
-            # Get destination filename/keyname
-            dst_f = dst_files[src_idx]
-            dst_k = dst_f.replace(s3_prefix, '').lstrip('/')
+        src_size = os.path.getsize(src_f)
+        src_md5 = _file_md5(src_f)
 
-            # See if same file is already up there
+        if record and record.get('md5') == src_md5 and \
+                record.get('size') == src_size:
+            iflogger.info('File %s unchanged since last upload, skipping...',
+                          dst_f)
+            return record
+
+        # See if same file is already up there; multipart ETags are not
+        # MD5s, so uploads also carry the MD5 as metadata
+        try:
+            head = client.head_object(Bucket=bucket.name, Key=dst_k)
+            dst_etag = head['ETag'].strip('"')
+            if src_md5 in (dst_etag, head.get('Metadata', {}).get('md5')):
+                iflogger.info('File %s already exists on S3, skipping...',
+                              dst_f)
+                return {'md5': src_md5, 'size': src_size, 'etag': dst_etag}
+            iflogger.info('Overwriting previous S3 file...')
+        except ClientError:
+            iflogger.info('New file to S3')
+
+        # Copy file up to S3 (either encrypted or not)
+        iflogger.info('Uploading %s to S3 bucket, %s, as %s...', src_f,
+                      bucket.name, dst_f)
+        extra_args = {'Metadata': {'md5': src_md5}}
+        if self.inputs.encrypt_bucket_keys:
+            extra_args['ServerSideEncryption'] = 'AES256'
+
+        part_size = self.inputs.multipart_threshold * 1024 * 1024
+        transfer_config = TransferConfig(multipart_threshold=part_size,
+                                         multipart_chunksize=part_size)
+
+        for attempt in range(RETRY):
             try:
-                dst_obj = bucket.Object(key=dst_k)
-                dst_md5 = dst_obj.e_tag.strip('"')
-
-                # See if same file is already there
-                src_read = open(src_f, 'rb').read()
-                src_md5 = hashlib.md5(src_read).hexdigest()
-                # Move to next loop iteration
-                if dst_md5 == src_md5:
-                    iflogger.info('File %s already exists on S3, skipping...',
-                                  dst_f)
-                    continue
-                else:
-                    iflogger.info('Overwriting previous S3 file...')
+                client.upload_file(
+                    src_f,
+                    bucket.name,
+                    dst_k,
+                    ExtraArgs=extra_args,
+                    Callback=ProgressPercentage(src_f),
+                    Config=transfer_config
+                )
+                break
+            except Exception as exc:
+                if attempt == RETRY - 1:
+                    raise
+                iflogger.warning('Upload of %s failed (%s), retrying...',
+                                 src_f, exc)
+                time.sleep(min(RETRY_WAIT * 2 ** attempt, RETRY_WAIT_MAX))
 
-            except ClientError:
-                iflogger.info('New file to S3')
+        dst_etag = client.head_object(Bucket=bucket.name,
+                                      Key=dst_k)['ETag'].strip('"')
 
-            # Copy file up to S3 (either encrypted or not)
-            iflogger.info('Uploading %s to S3 bucket, %s, as %s...', src_f,
-                          bucket.name, dst_f)
-            if self.inputs.encrypt_bucket_keys:
-                extra_args = {'ServerSideEncryption': 'AES256'}
-            else:
-                extra_args = {}
+        return {'md5': src_md5, 'size': src_size, 'etag': dst_etag}
 
-            retry_exc = None
-            for _ in range(RETRY):
-                try:
-                    bucket.upload_file(
-                        src_f,
-                        dst_k,
-                        ExtraArgs=extra_args,
-                        Callback=ProgressPercentage(src_f)
-                    )
-                    break
-                except Exception as exc:
-                    time.sleep(RETRY_WAIT)
-                    retry_exc = exc
+    # Compress NIfTI files method
+    def _compress_files(self, compress_jobs):
+        '''
+        Method to gzip (src, dst) pairs of files, in parallel since zlib
+        releases the GIL while compressing
+        '''
+
+        compress_level = self.inputs.compress_level
+        n_threads = min(self.inputs.compress_threads, len(compress_jobs))
 
-            if retry_exc is not None:
-                raise retry_exc
+        for src, dst in compress_jobs:
+            iflogger.debug('compress: %s %s', src, dst)
+
+        with ThreadPoolExecutor(max_workers=n_threads) as pool:
+            futures = [
+                pool.submit(_gzip_file, src, dst, compress_level)
+                for src, dst in compress_jobs
+            ]
+            for future in futures:
+                future.result()
 
     # List outputs, main run routine
     def _list_outputs(self):
@@ -521,6 +679,11 @@ class DataSink(IOBase):
                     else:
                         raise (inst)
 
+        # (src, dst) NIfTI files to gzip, and S3 uploads
+        compress_jobs = []
+        compressed_uploads = []
+        upload_jobs = []
+
         # Iterate through outputs attributes {key : path(s)}
         for key, files in list(self.inputs._outputs.items()):
             if not isdefined(files):
@@ -556,9 +719,27 @@ class DataSink(IOBase):
                 dst = self._substitute(dst)
                 path, _ = os.path.split(dst)
 
+                # Intermediates stay uncompressed in the working directory,
+                # and are only compressed on their way out
+                compress = self.inputs.compress_nifti and \
+                    src.endswith('.nii') and os.path.isfile(src)
+                if compress:
+                    dst = dst + '.gz'
+                    if s3_flag:
+                        s3dst = s3dst + '.gz'
+                        gz_src = os.path.join(
+                            os.getcwd(), 'compressed',
+                            str(len(compressed_uploads)),
+                            os.path.basename(dst))
+                        if not os.path.exists(os.path.dirname(gz_src)):
+                            os.makedirs(os.path.dirname(gz_src))
+                        compress_jobs.append((src, gz_src))
+                        compressed_uploads.append((gz_src, s3dst))
+                        out_files.append(s3dst)
+
                 # If we're uploading to S3
-                if s3_flag:
-                    self._upload_to_s3(bucket, src, s3dst)
+                if s3_flag and not compress:
+                    upload_jobs.append((src, s3dst))
                     out_files.append(s3dst)
                 # Otherwise, copy locally src -> dst
                 if not s3_flag or isdefined(self.inputs.local_copy):
@@ -571,8 +752,14 @@ class DataSink(IOBase):
                                 pass
                             else:
                                 raise (inst)
+                    if compress:
+                        # Skip if already compressed since the last change
+                        if (not os.path.exists(dst)) or (
+                            os.stat(dst).st_mtime < os.stat(src).st_mtime
+                        ):
+                            compress_jobs.append((src, dst))
                     # If src == dst, it's already home
-                    if (not os.path.exists(dst)) or (
+                    elif (not os.path.exists(dst)) or (
                         os.stat(src) != os.stat(dst)
                     ):
                         # If src is a file, copy it to dst
@@ -597,6 +784,12 @@ class DataSink(IOBase):
                             copytree(src, dst)
                             out_files.append(dst)
 
+        if compress_jobs:
+            self._compress_files(compress_jobs)
+
+        if upload_jobs or compressed_uploads:
+            self._upload_files(bucket, upload_jobs + compressed_uploads)
+
         # Return outputs dictionary
         outputs['out_file'] = out_files
 
@@ -1,5 +1,8 @@
 from builtins import str, bytes
 import inspect
+import os
+import time
+from contextlib import contextmanager
 
 from nipype import logging
 from nipype.interfaces.base import (traits, DynamicTraitedSpec, Undefined, isdefined,
@@ -10,6 +13,59 @@ from nipype.utils.functions import getsource, create_function_from_source
 
 iflogger = logging.getLogger('nipype.interface')
 
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+THREAD_VARIABLES = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS',
+                    'OPENBLAS_NUM_THREADS']
+
+
+@contextmanager
+def thread_limits(num_threads):
+    """Run with num_threads BLAS/OpenMP threads, in this process (if
+    threadpoolctl is installed) and in the processes it starts"""
+    previous = {name: os.environ.get(name) for name in THREAD_VARIABLES}
+    for name in THREAD_VARIABLES:
+        os.environ[name] = str(num_threads)
+    try:
+        if threadpool_limits is not None:
+            with threadpool_limits(limits=num_threads):
+                yield
+        else:
+            yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+# seconds spent in each stage of the function being run, see stage
+_stage_timings = None
+
+
+@contextmanager
+def stage(name):
+    """Time a stage of a function run by a Function node
+
+    The timings are recorded in the node's runtime (stage_timings), and in
+    the callback log. Outside of a Function node, stages are not recorded.
+
+    >>> from CPAC.utils.interfaces.function import stage
+    >>> with stage('compute'):
+    ...     pass
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        if _stage_timings is not None:
+            _stage_timings[name] = _stage_timings.get(name, 0.0) + \
+                time.time() - start
+
 
 class FunctionInputSpec(DynamicTraitedSpec, BaseInterfaceInputSpec):
     function_str = traits.Str(mandatory=True, desc='code for function')
@@ -39,6 +95,7 @@ class Function(IOBase):
                  function=None,
                  imports=None,
                  as_module=False,
+                 threaded=False,
                  **inputs):
         """
 
@@ -58,6 +115,9 @@ class Function(IOBase):
         imports : list of strings
             list of import statements that allow the function to execute
             in an otherwise empty namespace
+        threaded : boolean
+            whether the function can use several BLAS/OpenMP threads, that
+            the plugin running the node sets in num_threads
         """
 
         super(Function, self).__init__(**inputs)
@@ -87,6 +147,8 @@ class Function(IOBase):
                 input_names = fninfo.co_varnames[:fninfo.co_argcount]
 
         self.as_module = as_module
+        self.threaded = threaded
+        self.num_threads = 1
         self.inputs.on_trait_change(self._set_function_string, 'function_str')
         self._input_names = ensure_list(input_names)
         self._output_names = ensure_list(output_names)
@@ -149,7 +211,18 @@ class Function(IOBase):
             if isdefined(value):
                 args[name] = value
 
-        out = function_handle(**args)
+        global _stage_timings
+        _stage_timings = {}
+        try:
+            if getattr(self, 'threaded', False):
+                with thread_limits(self.num_threads):
+                    out = function_handle(**args)
+            else:
+                out = function_handle(**args)
+            if _stage_timings:
+                runtime.stage_timings = _stage_timings
+        finally:
+            _stage_timings = None
         if len(self._output_names) == 1:
             self._out[self._output_names[0]] = out
         else:
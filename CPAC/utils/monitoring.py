@@ -1,14 +1,18 @@
 import os
-import glob
 import json
+import time
 import logging
 import datetime
 import threading
 import socketserver
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import unquote, urlparse
 
 import networkx as nx
 import nipype.pipeline.engine as pe
 
+from CPAC.utils.instrumentation import node_instrumentation
+
 
 # Log initial information from all the nodes
 def recurse_nodes(workflow, prefix=''):
@@ -39,7 +43,8 @@ def log_nodes_cb(node, status):
         the node being logged
     status : string
         acceptable values are 'start', 'end'; otherwise it is
-        considered and error
+        considered and error. Nodes that end, or fail ('exception'), are
+        logged
 
     Returns
     -------
@@ -48,7 +53,7 @@ def log_nodes_cb(node, status):
         status info to the callback logger
     """
 
-    if status != 'end':
+    if status not in ('end', 'exception'):
         return
 
     import nipype.pipeline.engine.nodes as nodes
@@ -58,6 +63,24 @@ def log_nodes_cb(node, status):
     if isinstance(node, nodes.MapNode):
         return
 
+    if status == 'exception':
+        status_dict = {
+            'id': str(node),
+            'hash': node.inputs.get_hashval()[1],
+            'start': None,
+            'finish': None,
+            'error': True,
+            'output_dir': node.output_dir(),
+        }
+        try:
+            runtime = node.result.runtime
+            status_dict['start'] = getattr(runtime, 'startTime', None)
+            status_dict['finish'] = getattr(runtime, 'endTime', None)
+        except Exception:
+            pass
+        logger.debug(json.dumps(status_dict))
+        return
+
     runtime = node.result.runtime
 
     status_dict = {
@@ -69,75 +92,350 @@ def log_nodes_cb(node, status):
         'runtime_memory_gb': getattr(runtime, 'mem_peak_gb', 'N/A'),
         'estimated_memory_gb': node.mem_gb,
         'num_threads': node.n_procs,
+        # directories of the node and of the nodes it takes inputs from,
+        # to rebuild the executed graph (see CPAC.utils.callback_profile)
+        'output_dir': node.output_dir(),
+        'upstream': sorted(set(
+            os.path.dirname(source[0])
+            for source in getattr(node, 'input_source', {}).values()
+        )),
     }
 
     if status_dict['start'] is None or status_dict['finish'] is None:
         status_dict['error'] = True
+    else:
+        # CPU time, I/O, output size, image dimensions and stage timings
+        try:
+            status_dict.update(node_instrumentation(node))
+        except Exception:
+            pass
 
     logger.debug(json.dumps(status_dict))
 
 
-class LoggingRequestHandler(socketserver.BaseRequestHandler):
+# upper bounds of the node duration histogram, in seconds
+DURATION_BUCKETS = [1, 5, 15, 60, 300, 900, 3600, 4 * 3600, float('inf')]
 
-    def handle(self):
 
-        tree = {}
+def _parse_time(value):
+    if not isinstance(value, str):
+        return None
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S',
+                '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S'):
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    return None
 
-        logs = glob.glob(
-            os.path.join(
-                self.server.logging_dir,
-                "pipeline_" + self.server.pipeline_name,
-                "*"
-            )
-        )
 
-        for log in logs:
-            subject = log.split('/')[-1]
-            tree[subject] = {}
+def _number(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return None
 
-            callback_file = os.path.join(log, "callback.log")
 
-            if not os.path.exists(callback_file):
+class ParticipantLog(object):
+    """
+    Nodes of a participant, read incrementally from its callback log
+
+    Parameters
+    ----------
+    callback_file : string
+    """
+
+    def __init__(self, callback_file):
+        self.callback_file = callback_file
+        self.offset = 0
+        self.nodes = {}
+        self.stats = {}
+
+    def update(self):
+        """Read the lines appended to the callback log since the last call"""
+        try:
+            if os.path.getsize(self.callback_file) <= self.offset:
+                return
+            with open(self.callback_file, 'rb') as lf:
+                lf.seek(self.offset)
+                content = lf.read()
+        except (IOError, OSError):
+            return
+
+        # a line being written is read at the next update
+        end = content.rfind(b'\n') + 1
+        self.offset += end
+        for line in content[:end].splitlines():
+            try:
+                node = json.loads(line.strip())
+                self._add(node)
+            except (ValueError, KeyError, TypeError):
                 continue
 
-            with open(callback_file, 'rb') as lf:
-                for l in lf.readlines():
-                    l = l.strip()
-                    try:
-                        node = json.loads(l)
-                        if node["id"] not in tree[subject]:
-                            tree[subject][node["id"]] = {
-                                "hash": node["hash"]
-                            }
-                            if "start" in node and "finish" in node:
-                                tree[subject][node["id"]]["start"] = node["start"]
-                                tree[subject][node["id"]]["finish"] = node["finish"]
+    def _add(self, node):
+        node_id = node['id']
+        # failed nodes are logged with an error, and times when known
+        finished = 'start' in node and 'finish' in node or \
+            bool(node.get('error'))
+        node.setdefault('start', None)
+        node.setdefault('finish', None)
+
+        if node_id not in self.nodes:
+            self.nodes[node_id] = {'hash': node['hash']}
+            if finished:
+                self.nodes[node_id]['start'] = node['start']
+                self.nodes[node_id]['finish'] = node['finish']
+        elif finished:
+            if self.nodes[node_id]['hash'] == node['hash']:
+                self.nodes[node_id]['cached'] = {
+                    'start': node['start'],
+                    'finish': node['finish'],
+                }
+            # pipeline was changed, and we have a new hash
+            else:
+                self.nodes[node_id]['start'] = node['start']
+                self.nodes[node_id]['finish'] = node['finish']
+
+        if finished:
+            start = _parse_time(node['start'])
+            finish = _parse_time(node['finish'])
+            self.stats[node_id] = {
+                'error': bool(node.get('error')),
+                'duration': (finish - start).total_seconds()
+                if start and finish else None,
+                'memory_gb': _number(node.get('runtime_memory_gb')),
+                'estimated_memory_gb': _number(
+                    node.get('estimated_memory_gb')),
+                'finish': node['finish'],
+            }
+
+    def summary(self):
+        """Progress of the participant"""
+        errors = sum(1 for stats in self.stats.values() if stats['error'])
+        finishes = [stats['finish'] for stats in self.stats.values()
+                    if isinstance(stats['finish'], str)]
+        memory = [stats['memory_gb'] for stats in self.stats.values()
+                  if stats['memory_gb'] is not None]
+        return {
+            'nodes': len(self.nodes),
+            'finished': len(self.stats) - errors,
+            'errors': errors,
+            'pending': len(self.nodes) - len(self.stats),
+            'peak_memory_gb': max(memory) if memory else None,
+            'last_finish': max(finishes) if finishes else None,
+        }
+
+
+class CallbackLogIndex(object):
+    """
+    In-memory index of the callback logs of a pipeline's participants
+
+    Each log is read from where the previous refresh stopped, so polling the
+    index costs a directory listing and a stat per participant, plus the new
+    lines.
+
+    Parameters
+    ----------
+    logging_dir : string
+    pipeline_name : string
+    refresh_interval : float
+        minimum number of seconds between two reads of the logs
+    """
 
-                        else:
-                            if "start" in node and "finish" in node:
-                                if tree[subject][node["id"]]["hash"] == node["hash"]:
-                                    tree[subject][node["id"]]["cached"] = {
-                                        "start": node["start"],
-                                        "finish": node["finish"],
-                                    }
+    def __init__(self, logging_dir, pipeline_name, refresh_interval=1.0):
+        self.pipeline_dir = os.path.join(logging_dir,
+                                         'pipeline_' + pipeline_name)
+        self.pipeline_name = pipeline_name
+        self.refresh_interval = refresh_interval
+        self.participants = {}
+        self._refreshed = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        with self._lock:
+            if self._refreshed is not None and \
+                    time.time() - self._refreshed < self.refresh_interval:
+                return
+            try:
+                entries = list(os.scandir(self.pipeline_dir))
+            except OSError:
+                entries = []
+            for entry in entries:
+                if entry.is_dir() and entry.name not in self.participants:
+                    callback_file = os.path.join(entry.path, 'callback.log')
+                    if os.path.exists(callback_file):
+                        self.participants[entry.name] = \
+                            ParticipantLog(callback_file)
+            for participant in self.participants.values():
+                participant.update()
+            self._refreshed = time.time()
+
+    def tree(self):
+        """Nodes of every participant, by participant and node ID"""
+        self.refresh()
+        with self._lock:
+            return {subject: dict(log.nodes)
+                    for subject, log in self.participants.items()
+                    if log.nodes}
+
+    def run(self):
+        """Progress of the run"""
+        self.refresh()
+        with self._lock:
+            summaries = [log.summary()
+                         for log in self.participants.values()]
+        return {
+            'pipeline': self.pipeline_name,
+            'participants': len(summaries),
+            'participants_completed': sum(
+                1 for summary in summaries
+                if summary['nodes'] and not summary['pending']),
+            'nodes': sum(summary['nodes'] for summary in summaries),
+            'nodes_finished': sum(summary['finished']
+                                  for summary in summaries),
+            'nodes_errors': sum(summary['errors'] for summary in summaries),
+            'nodes_pending': sum(summary['pending']
+                                 for summary in summaries),
+        }
+
+    def participants_progress(self):
+        """Progress of every participant"""
+        self.refresh()
+        with self._lock:
+            return {subject: log.summary()
+                    for subject, log in self.participants.items()}
+
+    def participant_nodes(self, subject):
+        """Nodes of a participant, with their run statistics, or None"""
+        self.refresh()
+        with self._lock:
+            log = self.participants.get(subject)
+            if log is None:
+                return None
+            return {node_id: dict(node, **log.stats.get(node_id, {}))
+                    for node_id, node in log.nodes.items()}
+
+    def metrics(self):
+        """Prometheus text exposition of the run"""
+        self.refresh()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append('# HELP {0} {1}'.format(name, help_text))
+            lines.append('# TYPE {0} {1}'.format(name, kind))
+            for labels, value in samples:
+                label_text = ','.join(
+                    '{0}="{1}"'.format(key, str(label).replace('\\', '\\\\')
+                                       .replace('"', '\\"'))
+                    for key, label in labels)
+                lines.append('{0}{1} {2}'.format(
+                    name, '{' + label_text + '}' if label_text else '',
+                    repr(float(value))))
+
+        with self._lock:
+            participants = sorted(self.participants.items())
+            summaries = [(subject, log.summary())
+                         for subject, log in participants]
+            durations = [stats['duration'] for _, log in participants
+                         for stats in log.stats.values()
+                         if stats['duration'] is not None]
+            memory = [(subject, stats['memory_gb'])
+                      for subject, log in participants
+                      for stats in log.stats.values()
+                      if stats['memory_gb'] is not None]
+
+        metric('cpac_participants', 'gauge',
+               'Participants with a callback log', [((), len(summaries))])
+        metric('cpac_nodes', 'gauge', 'Nodes of the participants, by state',
+               [((('participant', subject), ('state', state)), summary[state])
+                for subject, summary in summaries
+                for state in ('finished', 'errors', 'pending')])
+        metric('cpac_node_queue_depth', 'gauge',
+               'Nodes of all participants not run yet',
+               [((), sum(summary['pending'] for _, summary in summaries))])
+
+        lines.append('# HELP cpac_node_duration_seconds '
+                     'Run time of the finished nodes')
+        lines.append('# TYPE cpac_node_duration_seconds histogram')
+        for bound in DURATION_BUCKETS:
+            lines.append('cpac_node_duration_seconds_bucket{{le="{0}"}} '
+                         '{1}'.format(
+                             '+Inf' if bound == float('inf') else
+                             repr(float(bound)),
+                             sum(1 for duration in durations
+                                 if duration <= bound)))
+        lines.append('cpac_node_duration_seconds_sum {0}'.format(
+            repr(float(sum(durations)))))
+        lines.append('cpac_node_duration_seconds_count {0}'.format(
+            len(durations)))
+
+        peak = {}
+        for subject, memory_gb in memory:
+            peak[subject] = max(peak.get(subject, 0.0), memory_gb)
+        metric('cpac_node_peak_memory_gb', 'gauge',
+               'Largest peak memory of the finished nodes of a participant',
+               [((('participant', subject),), value)
+                for subject, value in sorted(peak.items())])
+
+        return '\n'.join(lines) + '\n'
+
+
+class LoggingRequestHandler(BaseHTTPRequestHandler):
+    """
+    Monitoring endpoints
+
+    /                               nodes of every participant
+    /api/run                        progress of the run
+    /api/participants               progress of every participant
+    /api/participants/<participant> nodes of a participant, with their run
+                                    statistics
+    /metrics                        Prometheus metrics
+    """
+
+    def do_GET(self):
+        index = self.server.index
+        path = urlparse(self.path).path.rstrip('/')
+
+        if path == '':
+            self._send_json(index.tree())
+        elif path == '/api/run':
+            self._send_json(index.run())
+        elif path == '/api/participants':
+            self._send_json(index.participants_progress())
+        elif path.startswith('/api/participants/'):
+            nodes = index.participant_nodes(
+                unquote(path[len('/api/participants/'):]))
+            if nodes is None:
+                self._send(404, 'application/json',
+                           json.dumps({'error': 'unknown participant'}))
+            else:
+                self._send_json(nodes)
+        elif path == '/metrics':
+            self._send(200, 'text/plain; version=0.0.4', index.metrics())
+        else:
+            self._send(404, 'application/json',
+                       json.dumps({'error': 'not found'}))
 
-                                # pipeline was changed, and we have a new hash
-                                else:
-                                    tree[subject][node["id"]]["start"] = node["start"]
-                                    tree[subject][node["id"]]["finish"] = node["finish"]
+    def _send_json(self, content):
+        self._send(200, 'application/json', json.dumps(content) + '\n')
 
-                    except:
-                        break
+    def _send(self, code, content_type, body):
+        body = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
-                tree = {s: t for s, t in tree.items() if t}
+    def log_message(self, format, *args):
+        pass
 
-        headers = 'HTTP/1.1 200 OK\nConnection: close\n\n'
-        self.request.sendall(headers + json.dumps(tree) + "\n")
 
+class LoggingHTTPServer(socketserver.ThreadingMixIn, HTTPServer, object):
 
-class LoggingHTTPServer(socketserver.ThreadingTCPServer, object):
+    daemon_threads = True
 
-    def __init__(self, pipeline_name, logging_dir='', host='', port=8080, request=LoggingRequestHandler):
+    def __init__(self, pipeline_name, logging_dir='', host='', port=8080,
+                 request=LoggingRequestHandler, refresh_interval=1.0):
         super(LoggingHTTPServer, self).__init__((host, port), request)
 
         if not logging_dir:
@@ -145,13 +443,15 @@ class LoggingHTTPServer(socketserver.ThreadingTCPServer, object):
 
         self.logging_dir = logging_dir
         self.pipeline_name = pipeline_name
+        self.index = CallbackLogIndex(logging_dir, pipeline_name,
+                                      refresh_interval)
 
 
 def monitor_server(pipeline_name, logging_dir, host='0.0.0.0', port=8080):
     httpd = LoggingHTTPServer(pipeline_name, logging_dir, host, port, LoggingRequestHandler)
 
     server_thread = threading.Thread(target=httpd.serve_forever)
-    server_thread.isDaemon = True
+    server_thread.daemon = True
     server_thread.start()
 
     return server_thread
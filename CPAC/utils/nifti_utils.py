@@ -89,3 +89,85 @@ def inverse_nifti_values(image):
     out_data[zeros] = 0
 
     return nib.nifti1.Nifti1Image(out_data, img.affine)
+
+
+def save_nifti_image(img, out_file, compress_level=1):
+    """
+    Write a nifti image to disk, controlling the gzip compression level
+    Parameters
+    ----------
+    img: nibabel.nifti1.Nifti1Image
+        the image to be written
+    out_file: str
+        path of the output file; it is only compressed if it ends in '.gz'
+    compress_level: int
+        gzip compression level, from 1 (fastest) to 9 (smallest)
+
+    Returns
+    -------
+    out_file: str
+        path to the written image
+    """
+    import gzip
+    from nibabel.fileholders import FileHolder
+
+    if not out_file.endswith('.gz'):
+        img.to_filename(out_file)
+        return out_file
+
+    if compress_level not in range(1, 10):
+        raise ValueError("compress_level must be between 1 and 9, got "
+                         "{0}".format(compress_level))
+
+    # no timestamp or file name in the gzip header, so that the same image
+    # is always written to the same bytes
+    with open(out_file, 'wb') as f_raw:
+        with gzip.GzipFile(filename='', mode='wb', fileobj=f_raw, mtime=0,
+                           compresslevel=compress_level) as f:
+            img.to_file_map({'image': FileHolder(fileobj=f)})
+
+    return out_file
+
+
+def intermediate_ext():
+    """
+    Return the extension function nodes should give the images they write
+    into the working directory, according to the working directory format
+    policy ('CPAC_INTERMEDIATE_FORMAT', set by run_workflow)
+
+    Returns
+    -------
+    ext: str
+        '.nii' if intermediates are written uncompressed, '.nii.gz'
+        otherwise
+    """
+    if os.environ.get('CPAC_INTERMEDIATE_FORMAT', 'NIFTI_GZ') == 'NIFTI':
+        return '.nii'
+    return '.nii.gz'
+
+
+def set_intermediate_format(workflow, output_type='NIFTI'):
+    """
+    Switch every AFNI and FSL node of a workflow that writes gzipped
+    NIfTI to another output type
+    Parameters
+    ----------
+    workflow: nipype.pipeline.engine.Workflow
+        the workflow to update, including its sub-workflows
+    output_type: str
+        the AFNI/FSL output type to write instead of 'NIFTI_GZ'
+
+    Returns
+    -------
+    updated: list of str
+        full names of the nodes that were switched
+    """
+    updated = []
+    for node in workflow._get_all_nodes():
+        inputs = node.inputs
+        for trait_name in ('outputtype', 'output_type'):
+            if trait_name in inputs.copyable_trait_names() and \
+                    getattr(inputs, trait_name) == 'NIFTI_GZ':
+                setattr(inputs, trait_name, output_type)
+                updated.append(node.fullname)
+    return updated
@@ -0,0 +1,252 @@
+"""Node memory and thread profiles, learned from the callback logs
+
+log_nodes_cb records the peak memory and CPU usage of every node next to the
+memory it was given. After each participant, those observations are
+aggregated per node (its path in the workflow, without the participant and
+strategy numbers) into a profile file, with the peak memory relative to the
+size of the participant's largest image. Later runs set the mem_gb and
+n_procs of the nodes from the profiles, with a safety margin, so nipype's
+MultiProc scheduler packs nodes by what they use rather than by hand-set
+estimates.
+"""
+import fcntl
+import json
+import math
+import os
+import re
+
+import networkx as nx
+import numpy as np
+import nipype.pipeline.engine as pe
+
+
+def node_profile_key(node_id):
+    """
+    Profile key of a node: its path in the workflow, without the
+    participant's workflow, iterable expansions and strategy numbers
+
+    >>> node_profile_key('resting_preproc_sub-1_ses-1.func_preproc_afni_0'
+    ...                  '.func_motion_correct_A.a0')
+    'func_preproc_afni.func_motion_correct_A'
+    """
+    parts = node_id.split('.')[1:]
+    parts = [part for part in parts if not re.match(r'^a\d+$', part)]
+    return '.'.join(re.sub(r'_\d+$', '', part) for part in parts)
+
+
+def participant_input_gb(sub_dict):
+    """
+    In-memory size, as 32-bit floats, of the largest local image of a
+    participant, or None if none can be read
+
+    Parameters
+    ----------
+    sub_dict : dictionary
+        participant entry of the data configuration
+
+    Returns
+    -------
+    input_gb : float or None
+    """
+    import nibabel as nb
+
+    paths = [sub_dict.get('anat')]
+    for scan in (sub_dict.get('func') or sub_dict.get('rest') or {}).values():
+        paths.append(scan.get('scan') if isinstance(scan, dict) else scan)
+
+    sizes = []
+    for path in paths:
+        if not isinstance(path, str) or not os.path.exists(path):
+            continue
+        try:
+            shape = nb.load(path).header.get_data_shape()
+        except Exception:
+            continue
+        sizes.append(4 * float(np.prod(shape)) / 1024 ** 3)
+
+    return max(sizes) if sizes else None
+
+
+def _number(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool) \
+            and value >= 0:
+        return float(value)
+    return None
+
+
+class NodeProfileStore(object):
+    """
+    JSON file of node profiles, shared by the participants of a pipeline
+
+    Each profile holds the number of observed runs, the largest peak memory
+    (memory_gb), the largest peak memory per GB of participant input
+    (memory_per_input_gb) and the largest number of threads used.
+
+    Parameters
+    ----------
+    path : string
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.profiles = self._read()
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f).get('nodes', {})
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def update(self, callback_log, input_gb=None, offset=0):
+        """
+        Aggregate the node runs recorded in a callback log into the profiles
+
+        Parameters
+        ----------
+        callback_log : string
+            path to a callback log written by log_nodes_cb
+        input_gb : float or None
+            size of the participant's largest image, see participant_input_gb
+        offset : integer
+            position in the log where the runs to aggregate start
+
+        Returns
+        -------
+        n_runs : integer
+            number of node runs aggregated
+        """
+        runs = []
+        with open(callback_log, 'r') as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    run = json.loads(line)
+                except ValueError:
+                    continue
+                memory_gb = _number(run.get('runtime_memory_gb'))
+                if 'finish' not in run or run.get('error') or \
+                        memory_gb is None:
+                    continue
+                threads = _number(run.get('runtime_threads'))
+                runs.append((node_profile_key(run['id']), memory_gb,
+                             threads / 100.0 if threads is not None else None))
+
+        if not runs:
+            return 0
+
+        directory = os.path.dirname(self.path)
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+
+        # participants running at the same time update the same profiles
+        with open(self.path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            self.profiles = self._read()
+            for key, memory_gb, threads in runs:
+                profile = self.profiles.setdefault(
+                    key, {'runs': 0, 'memory_gb': 0.0})
+                profile['runs'] += 1
+                profile['memory_gb'] = max(profile['memory_gb'], memory_gb)
+                if input_gb:
+                    profile['memory_per_input_gb'] = max(
+                        profile.get('memory_per_input_gb', 0.0),
+                        memory_gb / input_gb)
+                if threads is not None:
+                    profile['threads'] = max(profile.get('threads', 0.0),
+                                             threads)
+
+            partial = '{0}.part-{1}'.format(self.path, os.getpid())
+            with open(partial, 'w') as f:
+                json.dump({'nodes': self.profiles}, f, indent=1,
+                          sort_keys=True)
+            os.rename(partial, self.path)
+
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+        return len(runs)
+
+    def estimate(self, key, input_gb=None):
+        """
+        Peak memory and threads expected for a node
+
+        Returns
+        -------
+        estimate : tuple or None
+            (memory_gb, threads) from the profile of the node, threads being
+            None if never observed, or None without a profile
+        """
+        profile = self.profiles.get(key)
+        if not profile:
+            return None
+
+        memory_gb = profile['memory_gb']
+        if input_gb and profile.get('memory_per_input_gb'):
+            memory_gb = profile['memory_per_input_gb'] * input_gb
+
+        return memory_gb, profile.get('threads')
+
+    def apply(self, workflow, input_gb=None, margin=1.2, max_memory_gb=None,
+              max_procs=None):
+        """
+        Set the mem_gb and n_procs of the profiled nodes of a workflow
+
+        Parameters
+        ----------
+        workflow : nipype.pipeline.engine.Workflow
+        input_gb : float or None
+            size of the participant's largest image
+        margin : float
+            factor applied to the observed peaks
+        max_memory_gb : float or None
+            memory of the participant, that no node can exceed
+        max_procs : integer or None
+            cores of the participant, that no node can exceed
+
+        Returns
+        -------
+        n_tuned : integer
+            number of nodes whose resources were set
+        """
+        n_tuned = 0
+        for node_id, node in _workflow_nodes(workflow):
+            if isinstance(node, pe.MapNode):
+                continue
+            estimate = self.estimate(node_profile_key(node_id), input_gb)
+            if estimate is None:
+                continue
+
+            memory_gb, threads = estimate
+            memory_gb = max(0.1, memory_gb * margin)
+            if max_memory_gb:
+                memory_gb = min(memory_gb, max_memory_gb)
+            node._mem_gb = memory_gb
+
+            if threads is not None:
+                # threads are only lowered: the interfaces were configured
+                # for the cores the node was given
+                n_procs = min(node.n_procs,
+                              max(1, int(math.ceil(threads * margin))))
+                if max_procs:
+                    n_procs = min(n_procs, max_procs)
+                node.n_procs = n_procs
+
+            n_tuned += 1
+
+        return n_tuned
+
+
+def _workflow_nodes(workflow, prefix=''):
+    """Nodes of a workflow with their ids, as recorded by log_nodes_cb"""
+    for node in nx.topological_sort(workflow._graph):
+        if isinstance(node, pe.Workflow):
+            for subnode in _workflow_nodes(node,
+                                           prefix + workflow.name + '.'):
+                yield subnode
+        else:
+            yield prefix + workflow.name + '.' + node.name, node
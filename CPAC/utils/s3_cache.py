@@ -0,0 +1,545 @@
+"""Shared local cache for participant input files stored on S3
+
+Files are stored by content (their S3 ETag) under the cache directory, so
+every participant, node and process on a host that asks for the same object
+reuses a single download. Downloads are written to a temporary file and
+renamed into place, which makes concurrent writers safe, and the cache is
+kept under a size cap by evicting the least-recently-used files.
+
+Files in use are pinned, by owner (a participant, or a cache instance), with
+pin files under the cache directory, so that no process evicts them. Pins of
+processes that are no longer running are ignored.
+"""
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+S3_STR = 's3://'
+
+# boto3's default multipart chunk size, used to recompute multipart ETags
+MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+
+
+def split_s3_path(file_path):
+    """
+    Split an S3 path into its bucket name and key
+
+    Parameters
+    ----------
+    file_path : string
+        path in the form s3://bucket_name/key
+
+    Returns
+    -------
+    bucket_name : string
+
+    s3_key : string
+    """
+    if not file_path.lower().startswith(S3_STR):
+        raise ValueError('{0} is not an S3 path'.format(file_path))
+
+    bucket_name, _, s3_key = file_path[len(S3_STR):].partition('/')
+
+    return bucket_name, s3_key
+
+
+def participant_s3_paths(sub_dict):
+    """
+    Collect every S3 path referenced by a participant's data configuration
+    entry (anatomical and functional scans, field maps, scan parameters...)
+
+    Parameters
+    ----------
+    sub_dict : dictionary
+        one entry of the data configuration
+
+    Returns
+    -------
+    s3_paths : list
+        S3 paths, in the order they appear
+    """
+    s3_paths = []
+
+    def _collect(value):
+        if isinstance(value, str):
+            if value.lower().startswith(S3_STR) and value not in s3_paths:
+                s3_paths.append(value)
+        elif isinstance(value, dict):
+            for key in value:
+                _collect(value[key])
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                _collect(item)
+
+    _collect(sub_dict)
+
+    return s3_paths
+
+
+def participant_owner(sub_dict):
+    """Owner of the pins of a participant's inputs"""
+    owner = 'participant-{0}'.format(sub_dict.get('subject_id'))
+    if sub_dict.get('unique_id'):
+        owner += '_{0}'.format(sub_dict['unique_id'])
+    return owner
+
+
+def _pid_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def file_etag(local_path, n_parts=None):
+    """
+    Compute the S3 ETag of a local file, either a plain MD5 or, for files
+    uploaded in n_parts parts, the MD5 of the part MD5s
+    """
+    if not n_parts:
+        md5 = hashlib.md5()
+        with open(local_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(MULTIPART_CHUNKSIZE), b''):
+                md5.update(chunk)
+        return md5.hexdigest()
+
+    part_md5s = []
+    with open(local_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(MULTIPART_CHUNKSIZE), b''):
+            part_md5s.append(hashlib.md5(chunk).digest())
+
+    return '{0}-{1}'.format(hashlib.md5(b''.join(part_md5s)).hexdigest(),
+                            len(part_md5s))
+
+
+class S3InputCache(object):
+    """
+    Content-addressed local cache of S3 input files
+
+    Parameters
+    ----------
+    cache_dir : string
+        directory holding the cached files; it can be shared by several
+        C-PAC processes on the same host
+    max_size_gb : float or None
+        disk cap of the cache; least-recently-used files are evicted past it
+    creds_path : string or None
+        AWS credentials file, as in the data configuration
+    n_threads : integer
+        number of concurrent downloads when prefetching
+    bucket_getter : callable or None
+        function (creds_path, bucket_name) -> boto3 Bucket; defaults to
+        indi_aws.fetch_creds.return_bucket
+    """
+
+    def __init__(self, cache_dir, max_size_gb=None, creds_path=None,
+                 n_threads=8, bucket_getter=None):
+
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.objects_dir = os.path.join(self.cache_dir, 'objects')
+        self.pins_dir = os.path.join(self.cache_dir, 'pins')
+        self.owner = 'instance-{0:x}'.format(id(self))
+        self.max_size = int(float(max_size_gb) * 1024 ** 3) \
+            if max_size_gb else None
+        self.creds_path = creds_path
+        self.n_threads = int(n_threads)
+
+        if bucket_getter is None:
+            from indi_aws import fetch_creds
+            bucket_getter = fetch_creds.return_bucket
+        self._bucket_getter = bucket_getter
+
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._in_flight = {}
+        self._pool = None
+
+        for directory in [self.objects_dir, self.pins_dir]:
+            if not os.path.exists(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    if not os.path.isdir(directory):
+                        raise
+
+    def _bucket(self, bucket_name):
+        # boto3 resources are not thread-safe, keep one per thread
+        buckets = getattr(self._local, 'buckets', None)
+        if buckets is None:
+            buckets = self._local.buckets = {}
+        if bucket_name not in buckets:
+            buckets[bucket_name] = self._bucket_getter(self.creds_path,
+                                                       bucket_name)
+        return buckets[bucket_name]
+
+    def _head(self, file_path):
+        import botocore.exceptions
+
+        bucket_name, s3_key = split_s3_path(file_path)
+        try:
+            s3_object = self._bucket(bucket_name).Object(key=s3_key)
+            return s3_object.e_tag.strip('"'), s3_object.content_length
+        except botocore.exceptions.ClientError as exc:
+            error_code = exc.response['Error']['Code']
+            if str(error_code) in ('403', 'AccessDenied'):
+                err_msg = 'Access to bucket: "%s" is denied; using ' \
+                          'credentials "%s"; cannot access the file "%s"' \
+                          % (bucket_name, self.creds_path, file_path)
+            elif str(error_code) in ('404', 'NoSuchKey', 'NotFound'):
+                err_msg = 'File: {0} does not exist; check spelling and ' \
+                          'try again'.format(file_path)
+            else:
+                err_msg = 'Unable to connect to bucket: "%s". Error ' \
+                          'message:\n%s' % (bucket_name, exc)
+            raise Exception(err_msg)
+
+    def cache_path(self, file_path, etag):
+        """
+        Local path of an S3 object with a given ETag
+        """
+        digest = hashlib.sha1(etag.encode('utf-8')).hexdigest()
+        return os.path.join(self.objects_dir, digest[:2], digest,
+                            os.path.basename(split_s3_path(file_path)[1]))
+
+    def _cache_lock(self):
+        """File lock serializing pins and evictions across processes"""
+        lock = open(os.path.join(self.cache_dir, '.lock'), 'w')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def _owner_dir(self, owner):
+        return os.path.join(self.pins_dir, '{0}-{1}'.format(
+            os.getpid(),
+            hashlib.sha1(owner.encode('utf-8')).hexdigest()[:16]))
+
+    def _pin(self, local_path, owner):
+        owner_dir = self._owner_dir(owner)
+        if not os.path.exists(owner_dir):
+            try:
+                os.makedirs(owner_dir)
+            except OSError:
+                if not os.path.isdir(owner_dir):
+                    raise
+        pin = os.path.join(owner_dir, hashlib.sha1(
+            local_path.encode('utf-8')).hexdigest())
+        with open(pin, 'w') as f:
+            f.write(local_path)
+
+    def pinned(self):
+        """
+        Cached files pinned by running processes; the pins of the processes
+        no longer running are removed
+
+        Returns
+        -------
+        pinned : set
+            local paths
+        """
+        pinned = set()
+        for owner_dir in os.listdir(self.pins_dir):
+            path = os.path.join(self.pins_dir, owner_dir)
+            try:
+                pid = int(owner_dir.split('-')[0])
+            except ValueError:
+                continue
+            if not _pid_running(pid):
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            try:
+                pins = os.listdir(path)
+            except OSError:
+                continue
+            for pin in pins:
+                try:
+                    with open(os.path.join(path, pin), 'r') as f:
+                        pinned.add(f.read())
+                except (IOError, OSError):
+                    continue
+        return pinned
+
+    def _verify(self, local_path, etag, size):
+        if os.path.getsize(local_path) != size:
+            return False
+        if '-' in etag:
+            # multipart ETags depend on the uploader's part size, which is
+            # unknown; only trust them if they match boto3's default
+            n_parts = int(etag.split('-')[-1])
+            expected_parts = max(1, -(-size // MULTIPART_CHUNKSIZE))
+            if n_parts != expected_parts:
+                return True
+            return file_etag(local_path, n_parts) == etag
+        return file_etag(local_path) == etag
+
+    def fetch(self, file_path, owner=None):
+        """
+        Return the local path of an S3 file, downloading it into the cache
+        unless an identical copy is already there
+
+        Parameters
+        ----------
+        file_path : string
+            path in the form s3://bucket_name/key
+        owner : string or None
+            owner pinning the file until it releases it; this cache instance
+            if None
+
+        Returns
+        -------
+        local_path : string
+            path of the cached copy
+        """
+        etag, size = self._head(file_path)
+        local_path = self.cache_path(file_path, etag)
+
+        lock = self._cache_lock()
+        try:
+            self._pin(local_path, owner or self.owner)
+            if os.path.exists(local_path):
+                # mark as recently used
+                os.utime(local_path, None)
+                return local_path
+        finally:
+            lock.close()
+
+        local_dir = os.path.dirname(local_path)
+        if not os.path.exists(local_dir):
+            try:
+                os.makedirs(local_dir)
+            except OSError:
+                if not os.path.isdir(local_dir):
+                    raise
+
+        bucket_name, s3_key = split_s3_path(file_path)
+        partial = '{0}.part-{1}-{2}'.format(local_path, os.getpid(),
+                                            threading.get_ident())
+
+        print("Attempting to download from AWS S3: {0}".format(file_path))
+        try:
+            self._bucket(bucket_name).download_file(Key=s3_key,
+                                                    Filename=partial)
+            if not self._verify(partial, etag, size):
+                raise IOError('Downloaded file {0} does not match its S3 '
+                              'size or ETag'.format(file_path))
+            os.rename(partial, local_path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+        self.evict()
+
+        return local_path
+
+    def prefetch(self, file_paths, owner=None):
+        """
+        Start downloading files in the background
+
+        Parameters
+        ----------
+        file_paths : list
+            S3 paths to download; local paths and files already being
+            fetched are ignored. Files whose download failed, or that were
+            evicted since, are downloaded again.
+        owner : string or None
+            owner pinning the files, see fetch
+
+        Returns
+        -------
+        futures : dictionary
+            S3 path -> concurrent.futures.Future of the local path
+        """
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.n_threads)
+
+            futures = {}
+            for file_path in file_paths:
+                if not isinstance(file_path, str) or \
+                        not file_path.lower().startswith(S3_STR):
+                    continue
+                if not self._reusable(self._in_flight.get(file_path)):
+                    future = self._pool.submit(self.fetch, file_path, owner)
+                    self._in_flight[file_path] = future
+                    future.add_done_callback(
+                        lambda future, file_path=file_path:
+                        self._forget_failed(file_path, future))
+                elif owner is not None:
+                    # fetched for another owner: pin it for this one too
+                    self._in_flight[file_path].add_done_callback(
+                        lambda future, owner=owner:
+                        self._pin_future(future, owner))
+                futures[file_path] = self._in_flight[file_path]
+
+        return futures
+
+    @staticmethod
+    def _reusable(future):
+        """Whether a prefetch still is, or was successfully, downloading a
+        file that is still cached"""
+        if future is None:
+            return False
+        if not future.done():
+            return True
+        return future.exception() is None and \
+            os.path.exists(future.result())
+
+    def _forget_failed(self, file_path, future):
+        if future.exception() is not None:
+            with self._lock:
+                if self._in_flight.get(file_path) is future:
+                    del self._in_flight[file_path]
+
+    def _forget_evicted(self, evicted):
+        evicted = set(evicted)
+        with self._lock:
+            for file_path, future in list(self._in_flight.items()):
+                if future.done() and future.exception() is None and \
+                        future.result() in evicted:
+                    del self._in_flight[file_path]
+
+    def _pin_future(self, future, owner):
+        if future.exception() is None:
+            lock = self._cache_lock()
+            try:
+                # evicted meanwhile: prefetch downloads it again
+                if os.path.exists(future.result()):
+                    self._pin(future.result(), owner)
+            finally:
+                lock.close()
+
+    def prefetch_participants(self, sublist):
+        """
+        Prefetch the S3 inputs of the given participants, in order, pinned
+        by each participant (see participant_owner) until released
+        """
+        futures = {}
+        for sub_dict in sublist:
+            futures.update(self.prefetch(participant_s3_paths(sub_dict),
+                                         participant_owner(sub_dict)))
+        return futures
+
+    def size(self):
+        """
+        Total size of the cached files, in bytes
+        """
+        return sum(os.path.getsize(path) for path, _ in self._entries())
+
+    def _entries(self):
+        entries = []
+        for root, _, files in os.walk(self.objects_dir):
+            for name in files:
+                if '.part-' in name:
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    entries.append((path, os.stat(path)))
+                except OSError:
+                    # evicted by another process meanwhile
+                    continue
+        return entries
+
+    def evict(self):
+        """
+        Remove least-recently-used files until the cache fits its cap.
+        Files pinned by running processes are kept.
+
+        Returns
+        -------
+        evicted : list
+            paths of the removed files
+        """
+        evicted = []
+        if self.max_size is None:
+            return evicted
+
+        entries = self._entries()
+        total = sum(stat.st_size for _, stat in entries)
+        if total <= self.max_size:
+            return evicted
+
+        lock = self._cache_lock()
+        try:
+            pinned = self.pinned()
+            for path, stat in sorted(entries, key=lambda e: e[1].st_mtime):
+                if total <= self.max_size:
+                    break
+                if path in pinned:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= stat.st_size
+                evicted.append(path)
+        finally:
+            lock.close()
+
+        # after the file lock, which _pin_future takes under self._lock
+        self._forget_evicted(evicted)
+
+        return evicted
+
+    def release(self, owner=None):
+        """
+        Allow the files pinned by an owner to be evicted again
+
+        Parameters
+        ----------
+        owner : string or None
+            owner of the pins, see fetch; this cache instance if None
+        """
+        lock = self._cache_lock()
+        try:
+            shutil.rmtree(self._owner_dir(owner or self.owner),
+                          ignore_errors=True)
+        finally:
+            lock.close()
+
+    def release_participant(self, sub_dict):
+        """
+        Release the inputs of a participant that finished, and evict files
+        past the cap
+        """
+        self.release(participant_owner(sub_dict))
+        self.evict()
+
+    def link(self, local_path, dest_path):
+        """
+        Hard-link (or copy, across file systems) a cached file out of the
+        cache, so that evicting it does not remove the copy in use
+
+        Parameters
+        ----------
+        local_path : string
+            path of the cached copy
+        dest_path : string
+
+        Returns
+        -------
+        dest_path : string
+        """
+        dest_dir = os.path.dirname(dest_path)
+        if not os.path.exists(dest_dir):
+            try:
+                os.makedirs(dest_dir)
+            except OSError:
+                if not os.path.isdir(dest_dir):
+                    raise
+        partial = '{0}.part-{1}'.format(dest_path, os.getpid())
+        try:
+            os.link(local_path, partial)
+        except OSError:
+            shutil.copyfile(local_path, partial)
+        os.rename(partial, dest_path)
+        return dest_path
+
+    def shutdown(self, wait=True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
@@ -0,0 +1,134 @@
+"""Parallel listing of S3 prefixes, with an optional local cache
+
+Listing a whole data set on S3 with a single paginator takes one request per
+thousand objects, one after the other. The listing is instead split on the
+first directory level under the prefix (typically one per participant or
+site), and the sub-prefixes are paginated concurrently. Listings can be kept
+in a local cache file, with the ETag, size and modification time of each
+object, and reused by later data configuration builds within a time-to-live.
+"""
+import hashlib
+import json
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _list_pages(client, bucket_name, prefix, delimiter=None):
+    kwargs = {'Bucket': bucket_name, 'Prefix': prefix}
+    if delimiter:
+        kwargs['Delimiter'] = delimiter
+
+    objects = []
+    sub_prefixes = []
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(**kwargs):
+        for obj in page.get('Contents', []):
+            objects.append({
+                'Key': obj['Key'],
+                'ETag': obj['ETag'].strip('"'),
+                'Size': obj['Size'],
+                'LastModified': obj['LastModified'].isoformat()
+            })
+        sub_prefixes += [p['Prefix'] for p in page.get('CommonPrefixes', [])]
+
+    return objects, sub_prefixes
+
+
+def list_s3_objects(bucket, prefix, n_threads=8):
+    """
+    List the objects under an S3 prefix, paginating its first-level
+    sub-prefixes concurrently
+
+    Parameters
+    ----------
+    bucket : boto3.resources.factory.s3.Bucket
+    prefix : string
+        key prefix to list
+    n_threads : integer
+        number of sub-prefixes listed at once
+
+    Returns
+    -------
+    objects : list
+        one dictionary per object, with its Key, ETag, Size and
+        LastModified (ISO 8601), sorted by key
+    """
+    # boto3 clients, unlike resources, can be shared between threads
+    client = bucket.meta.client
+
+    objects, sub_prefixes = _list_pages(client, bucket.name, prefix, '/')
+
+    if sub_prefixes:
+        with ThreadPoolExecutor(
+                max_workers=max(1, min(n_threads, len(sub_prefixes)))) as pool:
+            for sub_objects, _ in pool.map(
+                    lambda sub_prefix: _list_pages(client, bucket.name,
+                                                   sub_prefix),
+                    sub_prefixes):
+                objects += sub_objects
+
+    return sorted(objects, key=lambda obj: obj['Key'])
+
+
+def cached_list_s3_objects(bucket, prefix, cache_dir=None, ttl=3600,
+                           n_threads=8):
+    """
+    List the objects under an S3 prefix, reusing a listing cached in
+    cache_dir if it is less than ttl seconds old
+
+    Parameters
+    ----------
+    bucket : boto3.resources.factory.s3.Bucket
+    prefix : string
+        key prefix to list
+    cache_dir : string or None
+        directory of the cached listings; no caching if None
+    ttl : float
+        maximum age, in seconds, of a cached listing to reuse
+    n_threads : integer
+        number of sub-prefixes listed at once
+
+    Returns
+    -------
+    objects : list
+        as returned by list_s3_objects
+    """
+    if not cache_dir:
+        return list_s3_objects(bucket, prefix, n_threads)
+
+    s3_path = 's3://{0}/{1}'.format(bucket.name, prefix)
+    cache_file = os.path.join(
+        cache_dir,
+        '{0}.json'.format(hashlib.sha1(s3_path.encode('utf-8')).hexdigest()))
+
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r') as f:
+                listing = json.load(f)
+            if listing.get('s3_path') == s3_path and \
+                    time.time() - listing['listed_at'] < ttl:
+                print("Using the listing of {0} cached on {1}".format(
+                    s3_path, time.ctime(listing['listed_at'])))
+                return listing['objects']
+        except (ValueError, KeyError):
+            pass
+
+    listed_at = time.time()
+    objects = list_s3_objects(bucket, prefix, n_threads)
+
+    if not os.path.exists(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            if not os.path.isdir(cache_dir):
+                raise
+
+    partial = '{0}.part-{1}'.format(cache_file, os.getpid())
+    with open(partial, 'w') as f:
+        json.dump({'s3_path': s3_path, 'listed_at': listed_at,
+                   'objects': objects}, f)
+    os.rename(partial, cache_file)
+
+    return objects
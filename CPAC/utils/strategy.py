@@ -3,19 +3,123 @@ import six
 import warnings
 import logging
 
+from collections.abc import MutableMapping
+
 logger = logging.getLogger('workflow')
 
+class _Removed(object):
+    """Marks a resource removed from a fork but still in the layers it
+    shares, and stays the same object through pickling"""
+
+    def __reduce__(self):
+        return '_REMOVED'
+
+
+_REMOVED = _Removed()
+
+
+class ResourcePool(MutableMapping):
+    """
+    Resource pool of a strategy, sharing its unchanged entries with the
+    strategies it was forked from or into
+
+    A pool is a stack of layers: the entries set since the last fork, on top
+    of frozen layers shared with other forks. Forking freezes the top layer
+    instead of copying the whole pool, so forks only cost the entries they
+    add or replace.
+    """
+
+    # beyond this many shared layers, a fork gets a flattened copy, to keep
+    # lookups short
+    max_depth = 32
+
+    def __init__(self, resources=None, parent=None):
+        self._parent = parent
+        self._depth = parent._depth + 1 if parent is not None else 0
+        self._local = dict(resources) if resources else {}
+
+    def _lookup(self, key):
+        pool = self
+        while pool is not None:
+            if key in pool._local:
+                return pool._local[key]
+            pool = pool._parent
+        return _REMOVED
+
+    def _flatten(self):
+        layers = []
+        pool = self
+        while pool is not None:
+            layers.append(pool._local)
+            pool = pool._parent
+
+        resources = {}
+        for layer in reversed(layers):
+            resources.update(layer)
+        return {key: value for key, value in resources.items()
+                if value is not _REMOVED}
+
+    def __getitem__(self, key):
+        value = self._lookup(key)
+        if value is _REMOVED:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._local[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        if self._parent is not None and \
+                self._parent._lookup(key) is not _REMOVED:
+            self._local[key] = _REMOVED
+        else:
+            del self._local[key]
+
+    def __contains__(self, key):
+        return self._lookup(key) is not _REMOVED
+
+    def __iter__(self):
+        return iter(self._flatten())
+
+    def __len__(self):
+        return len(self._flatten())
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(type(self).__name__, self._flatten())
+
+    def fork(self):
+        """
+        Return a new pool with the same resources, sharing them with this one
+        """
+        if self._depth >= self.max_depth:
+            self._local = self._flatten()
+            self._parent = None
+            self._depth = 0
+
+        if self._local:
+            shared = ResourcePool(parent=self._parent)
+            shared._local = self._local
+            self._local = {}
+            self._parent = shared
+            self._depth = shared._depth + 1
+
+        return ResourcePool(parent=self._parent)
+
 
 class Strategy(object):
 
     def __init__(self):
-        self.resource_pool = {}
+        self.resource_pool = ResourcePool()
         self.leaf_node = None
         self.leaf_out_file = None
         self.name = []
+        self._nodes_names = None
 
     def append_name(self, name):
         self.name.append(name)
+        self._nodes_names = None
 
     def get_name(self):
         return self.name
@@ -31,9 +135,14 @@ class Strategy(object):
         return self.resource_pool
 
     def get_nodes_names(self):
+        if self._nodes_names is not None and \
+                self._nodes_names[0] == len(self.name):
+            return list(self._nodes_names[1])
         pieces = [n.split('_') for n in self.name]
         assert all(p[-1].isdigit() for p in pieces)
-        return ['_'.join(p[:-1]) for p in pieces]
+        nodes_names = ['_'.join(p[:-1]) for p in pieces]
+        self._nodes_names = (len(self.name), nodes_names)
+        return list(nodes_names)
 
     def get_node_from_resource_pool(self, resource_key):
         try:
@@ -68,32 +177,28 @@ class Strategy(object):
 
     def fork(self):
         fork = Strategy()
-        fork.resource_pool = dict(self.resource_pool)
+        fork.resource_pool = self.resource_pool.fork()
         fork.leaf_node = self.leaf_node
         fork.out_file = str(self.leaf_out_file)
         fork.leaf_out_file = str(self.leaf_out_file)
         fork.name = list(self.name)
+        fork._nodes_names = self._nodes_names
         return fork
 
     @staticmethod
     def get_forking_points(strategies):
 
-        forking_points = []
-
-        for strat in strategies:
-
-            strat_node_names = set(strat.get_nodes_names())
-
-            strat_forking = []
-            for counter_strat in strategies:
-                counter_strat_node_names = set(counter_strat.get_nodes_names())
-
-                strat_forking += list(strat_node_names - counter_strat_node_names)
+        # the nodes a strategy has and at least one other strategy lacks are
+        # the nodes it does not share with every strategy
+        strat_node_names = [set(strat.get_nodes_names())
+                            for strat in strategies]
+        if not strat_node_names:
+            return []
 
-            strat_forking = list(set(strat_forking))
-            forking_points += [strat_forking]
+        shared_node_names = set.intersection(*strat_node_names)
 
-        return forking_points
+        return [list(node_names - shared_node_names)
+                for node_names in strat_node_names]
 
     @staticmethod
     def get_forking_labels(strategies):
@@ -0,0 +1,184 @@
+"""Shared, content-addressed cache of resampled images
+
+Every participant of a run resamples the same templates, masks and priors to
+the same resolutions, and the same ROI atlases to the same functional grid.
+Resampled images are instead stored under a cache directory, keyed on the
+content of the input image and on the resampling parameters and target grid,
+so the first participant (of any run using the same cache) computes each of
+them and the others reuse it. Writers lock the entry they compute, and the
+result is renamed into place, which makes concurrent participants and
+processes safe.
+"""
+import fcntl
+import hashlib
+import os
+import shutil
+
+# hashes of the files already read by this process, by path, size and
+# modification time
+_file_hashes = {}
+
+
+def file_sha1(file_path):
+    """
+    SHA-1 of the content of a file, computed once per process and version of
+    the file
+
+    Parameters
+    ----------
+    file_path : string
+
+    Returns
+    -------
+    digest : string
+    """
+    stat = os.stat(file_path)
+    memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime)
+    if memo_key not in _file_hashes:
+        sha1 = hashlib.sha1()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha1.update(chunk)
+        _file_hashes[memo_key] = sha1.hexdigest()
+    return _file_hashes[memo_key]
+
+
+def grid_signature(img):
+    """
+    Spatial shape and affine of an image, which identify the grid images are
+    resampled to
+
+    Parameters
+    ----------
+    img : nibabel image
+
+    Returns
+    -------
+    signature : string
+    """
+    import numpy as np
+
+    affine = np.round(np.asarray(img.affine, dtype=float), 4) + 0.0
+    return '{0}:{1}'.format(tuple(int(n) for n in img.shape[:3]),
+                            ','.join(repr(float(n)) for n in affine.flat))
+
+
+class ImageCache(object):
+    """
+    Directory of computed images, one entry per key
+
+    Parameters
+    ----------
+    cache_dir : string
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.abspath(cache_dir)
+
+    def entry_dir(self, key_parts):
+        """Directory of the entry for a list of key parts (strings)"""
+        digest = hashlib.sha1(
+            '\0'.join(str(part) for part in key_parts).encode('utf-8')
+        ).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def get(self, key_parts, compute):
+        """
+        Path of the cached image for key_parts, computed first if needed
+
+        Parameters
+        ----------
+        key_parts : list
+            everything the image depends on, such as input file hashes and
+            parameters
+        compute : callable
+            called with a temporary directory when the entry is missing, it
+            writes the image there and returns its path
+
+        Returns
+        -------
+        cached_path : string
+        """
+        entry_dir = self.entry_dir(key_parts)
+        cached = self._cached_file(entry_dir)
+        if cached:
+            return cached
+
+        parent = os.path.dirname(entry_dir)
+        if not os.path.exists(parent):
+            try:
+                os.makedirs(parent)
+            except OSError:
+                if not os.path.isdir(parent):
+                    raise
+
+        with open(entry_dir + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # computed by another participant while waiting for the lock
+                cached = self._cached_file(entry_dir)
+                if cached:
+                    return cached
+
+                tmp_dir = '{0}.part-{1}'.format(entry_dir, os.getpid())
+                if os.path.exists(tmp_dir):
+                    shutil.rmtree(tmp_dir)
+                os.makedirs(tmp_dir)
+                try:
+                    out_file = compute(tmp_dir)
+                    os.makedirs(os.path.join(tmp_dir, 'image'))
+                    image = os.path.join(tmp_dir, 'image',
+                                         os.path.basename(out_file))
+                    shutil.move(out_file, image)
+                    os.rename(os.path.join(tmp_dir, 'image'), entry_dir)
+                finally:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+        return self._cached_file(entry_dir)
+
+    @staticmethod
+    def _cached_file(entry_dir):
+        if os.path.isdir(entry_dir):
+            files = os.listdir(entry_dir)
+            if len(files) == 1:
+                return os.path.join(entry_dir, files[0])
+        return None
+
+
+def resample_template(in_file, voxel_size, cache_dir, resample_mode='Cu',
+                      outputtype='NIFTI_GZ'):
+    """
+    Resample an image with AFNI's 3dresample, through the image cache
+
+    Parameters
+    ----------
+    in_file : string
+        local path of the image
+    voxel_size : tuple
+        target voxel size, in mm
+    cache_dir : string
+    resample_mode : string
+    outputtype : string
+
+    Returns
+    -------
+    out_file : string
+        path of the resampled image in the cache
+    """
+    import nipype.interfaces.afni as afni
+    import nipype.pipeline.engine as pe
+
+    def compute(tmp_dir):
+        resample = pe.Node(interface=afni.Resample(), name='resample')
+        resample.inputs.voxel_size = tuple(voxel_size)
+        resample.inputs.outputtype = outputtype
+        resample.inputs.resample_mode = resample_mode
+        resample.inputs.in_file = os.path.abspath(in_file)
+        resample.base_dir = tmp_dir
+        return resample.run().outputs.out_file
+
+    return ImageCache(cache_dir).get(
+        ['3dresample', file_sha1(in_file), tuple(voxel_size), resample_mode,
+         outputtype], compute)
@@ -0,0 +1,96 @@
+import json
+import os
+import shutil
+
+from CPAC.utils.bids_index import BIDSIndex
+from CPAC.utils.bids_utils import collect_bids_files_configs
+from CPAC.utils.build_data_config import gather_file_paths
+
+
+def _make_dataset(bids_dir):
+    os.makedirs(os.path.join(bids_dir, 'sub-01', 'ses-1', 'anat'))
+    os.makedirs(os.path.join(bids_dir, 'sub-01', 'ses-1', 'func'))
+    os.makedirs(os.path.join(bids_dir, 'sub-02', 'ses-1', 'func'))
+    files = [
+        'sub-01/ses-1/anat/sub-01_ses-1_T1w.nii.gz',
+        'sub-01/ses-1/func/sub-01_ses-1_task-rest_bold.nii.gz',
+        'sub-01/ses-1/func/sub-01_ses-1_task-nback_bold.nii.gz',
+        'sub-02/ses-1/func/sub-02_ses-1_task-rest_bold.nii.gz',
+        'README',
+    ]
+    for path in files:
+        with open(os.path.join(bids_dir, path), 'w') as f:
+            f.write(path)
+    with open(os.path.join(bids_dir, 'task-rest_bold.json'), 'w') as f:
+        json.dump({'RepetitionTime': 2.0}, f)
+
+
+def test_bids_index(tmpdir):
+    bids_dir = str(tmpdir.join('bids'))
+    index_path = str(tmpdir.join('index', 'bids.db'))
+    _make_dataset(bids_dir)
+
+    with BIDSIndex(bids_dir, index_path) as index:
+        assert sorted(index.file_paths(relative=True)) == sorted(
+            os.path.relpath(path, bids_dir)
+            for path in gather_file_paths(bids_dir))
+        assert index.query(participant='sub-01', task='rest',
+                           relative=True) == [
+            'sub-01/ses-1/func/sub-01_ses-1_task-rest_bold.nii.gz']
+        assert index.query(task='rest', scantype='bold',
+                           relative=True) == [
+            'sub-01/ses-1/func/sub-01_ses-1_task-rest_bold.nii.gz',
+            'sub-02/ses-1/func/sub-02_ses-1_task-rest_bold.nii.gz',
+            'task-rest_bold.json']
+
+    # unchanged: nothing to list again
+    with BIDSIndex(bids_dir, index_path, update=False) as index:
+        assert index.update() == 0
+
+    # added, removed and edited files
+    new_file = 'sub-02/ses-1/func/sub-02_ses-1_task-nback_bold.nii.gz'
+    with open(os.path.join(bids_dir, new_file), 'w') as f:
+        f.write(new_file)
+    shutil.rmtree(os.path.join(bids_dir, 'sub-01', 'ses-1', 'anat'))
+    with open(os.path.join(bids_dir, 'task-rest_bold.json'), 'w') as f:
+        json.dump({'RepetitionTime': 2.5, 'SliceTiming': [0, 1]}, f)
+
+    with BIDSIndex(bids_dir, index_path, update=False) as index:
+        assert index.update() == 2
+        assert new_file in index.query(participant='02', relative=True)
+        assert index.query(scantype='T1w') == []
+        _, config = index.collect_files_configs(['bold'])
+        assert config['task-rest_bold.json']['RepetitionTime'] == 2.5
+
+    # same result as walking the directory
+    walked = collect_bids_files_configs(bids_dir)
+    indexed = collect_bids_files_configs(bids_dir, index_path=index_path)
+    assert sorted(walked[0]) == indexed[0]
+    assert walked[1] == indexed[1]
+
+
+def test_bids_index_select(tmpdir):
+    bids_dir = str(tmpdir.join('bids'))
+    index_path = str(tmpdir.join('bids.db'))
+    _make_dataset(bids_dir)
+
+    with BIDSIndex(bids_dir, index_path) as index:
+        assert index.select(relative=True) == index.file_paths(relative=True)
+        # dataset-level files and anatomicals are kept
+        assert index.select({'participants': ['sub-01'],
+                             'scans': ['rest_run-1']}, relative=True) == [
+            'README',
+            'sub-01/ses-1/anat/sub-01_ses-1_T1w.nii.gz',
+            'sub-01/ses-1/func/sub-01_ses-1_task-rest_bold.nii.gz',
+            'task-rest_bold.json']
+        assert index.select(exclusion_dct={'participants': '01',
+                                           'scans': ['rest']},
+                            relative=True) == [
+            'README',
+            'sub-02/ses-1/func/sub-02_ses-1_task-rest_bold.nii.gz',
+            'task-rest_bold.json']
+
+    assert gather_file_paths(bids_dir, index_path=index_path,
+                             inclusion_dct={'sessions': ['2']}) == [
+        os.path.join(bids_dir, path) for path in ['README',
+                                                  'task-rest_bold.json']]
@@ -0,0 +1,68 @@
+import copy
+import json
+
+import pytest
+
+from CPAC.utils.bids_utils import BIDSSidecarResolver, bids_decode_fname, \
+    bids_parse_sidecar, bids_retrieve_params, fetch_s3_sidecars
+
+
+config_dict = {
+    'task-rest_bold.json': {'RepetitionTime': 2.0, 'EchoTime': 0.03},
+    'sub-02/sub-02_task-rest_bold.json': {'RepetitionTime': 2.5},
+    'sub-02/ses-2/func/sub-02_ses-2_task-rest_run-2_bold.json': {
+        'RepetitionTime': 3.0, 'SliceTiming': [0, 1]},
+}
+
+scans = [
+    'sub-01/ses-1/func/sub-01_ses-1_task-rest_run-1_bold.nii.gz',
+    'sub-01/ses-1/func/sub-01_ses-1_task-rest_run-2_bold.nii.gz',
+    'sub-02/ses-1/func/sub-02_ses-1_task-rest_bold.nii.gz',
+    'sub-02/ses-2/func/sub-02_ses-2_task-rest_run-1_bold.nii.gz',
+    'sub-02/ses-2/func/sub-02_ses-2_task-rest_run-2_bold.nii.gz',
+]
+
+
+def test_sidecar_resolver():
+    resolve_params = BIDSSidecarResolver(copy.deepcopy(config_dict))
+    bids_config_dict = bids_parse_sidecar(copy.deepcopy(config_dict))
+
+    for scan in scans:
+        f_dict = bids_decode_fname(scan)
+        assert resolve_params(f_dict) == \
+            bids_retrieve_params(bids_config_dict, f_dict)
+
+    assert resolve_params(bids_decode_fname(scans[0]))[
+        'RepetitionTime'] == 2.0
+    assert resolve_params(bids_decode_fname(scans[2]))[
+        'RepetitionTime'] == 2.5
+    assert resolve_params(bids_decode_fname(scans[4]))[
+        'SliceTiming'] == [0, 1]
+
+    # runs sharing the same sidecars share the same resolution
+    assert resolve_params(bids_decode_fname(scans[0])) is \
+        resolve_params(bids_decode_fname(scans[0]))
+
+
+def test_fetch_s3_sidecars(monkeypatch):
+    moto = pytest.importorskip('moto')
+    boto3 = pytest.importorskip('boto3')
+    mock_s3 = getattr(moto, 'mock_aws', None) or getattr(moto, 'mock_s3')
+
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+
+    with mock_s3():
+        s3 = boto3.resource('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='cpac-test')
+        for path, content in config_dict.items():
+            s3.Object('cpac-test', 'data/' + path).put(
+                Body=json.dumps(content).encode())
+
+        bucket = s3.Bucket('cpac-test')
+        keys = ['data/' + path for path in config_dict]
+        assert fetch_s3_sidecars(bucket, keys + keys[:1], 'data',
+                                 n_threads=2) == config_dict
+
+        with pytest.raises(Exception):
+            fetch_s3_sidecars(bucket, ['data/missing_bold.json'], 'data')
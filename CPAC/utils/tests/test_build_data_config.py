@@ -0,0 +1,67 @@
+import os
+
+from CPAC.utils.build_data_config import compile_file_template, \
+    get_nonBIDS_data, match_file_templates, parse_file_path
+
+
+def test_compile_file_template():
+    template = '/data/{site}/sub-{participant}/ses-{session}/func/' \
+               'sub-{participant}_ses-{session}_task-{scan}_bold.nii.gz'
+
+    regex = compile_file_template(template, 'func')
+    assert parse_file_path(
+        '/data/NYU/sub-01/ses-2/func/sub-01_ses-2_task-rest_bold.nii.gz',
+        regex) == {'{site}': 'NYU', '{participant}': '01',
+                   '{session}': '2', '{scan}': 'rest'}
+
+    # conflicting IDs for the same label
+    assert parse_file_path(
+        '/data/NYU/sub-01/ses-2/func/sub-02_ses-2_task-rest_bold.nii.gz',
+        regex) is False
+
+    # not matching the template
+    assert parse_file_path(
+        '/data/NYU/sub-01/ses-2/anat/sub-01_ses-2_T1w.nii.gz', regex) is None
+
+    # wildcards, and {scan} is not a label for anatomical templates
+    anat = compile_file_template('/data/{participant}/*mprage*.nii.gz')
+    assert parse_file_path('/data/0010/s_mprage_1.nii.gz', anat) == {
+        '{participant}': '0010'}
+    assert parse_file_path('/data/0010/x/mprage.nii.gz', anat) is None
+
+
+def test_match_file_templates():
+    template = '/data/sub-{participant}/func/rest_{scan}.nii.gz'
+    file_paths = ['/data/sub-{0}/func/rest_{1}.nii.gz'.format(sub, scan)
+                  for sub in range(3000) for scan in range(4)]
+    file_paths.append('/data/README')
+
+    serial = match_file_templates(file_paths, template, 'func')
+    assert len(serial) == 12000
+    assert serial[5] == (file_paths[5], {'{participant}': '1',
+                                         '{scan}': '1'})
+    assert match_file_templates(file_paths, template, 'func',
+                                n_procs=2) == serial
+
+
+def test_get_nonBIDS_data(tmpdir):
+    data_dir = str(tmpdir)
+    for site, sub in [('A', '01'), ('A', '02'), ('B', '03')]:
+        os.makedirs(os.path.join(data_dir, site, sub, 'func'))
+        for name in ['mprage.nii.gz', 'func/rest_1.nii.gz',
+                     'func/rest_2.nii.gz']:
+            open(os.path.join(data_dir, site, sub, name), 'w').close()
+
+    data_dct = get_nonBIDS_data(
+        os.path.join(data_dir, '{site}', '{participant}', 'mprage.nii.gz'),
+        os.path.join(data_dir, '{site}', '{participant}', 'func',
+                     'rest_{scan}.nii.gz'),
+        inclusion_dct={'sites': 'A'},
+        exclusion_dct={'participants': ['02'], 'scans': ['2']})
+
+    assert list(data_dct) == ['A']
+    assert list(data_dct['A']) == ['01']
+    sub_dct = data_dct['A']['01']['ses-1']
+    assert sub_dct['anat'] == os.path.join(data_dir, 'A', '01',
+                                           'mprage.nii.gz')
+    assert list(sub_dct['func']) == ['1']
@@ -0,0 +1,64 @@
+import json
+
+from click.testing import CliRunner
+
+from CPAC.utils.callback_profile import profile_callback_log
+
+
+def _write_log(callback_log):
+    runs = [
+        # id, start, finish, upstream, memory, cpu percent
+        ('anat', '00:00', '00:10', [], 1.0, 100.0),
+        ('func', '00:00', '00:05', [], 2.0, 200.0),
+        ('reg', '00:12', '00:30', ['anat', 'func'], 3.0, 'N/A'),
+        ('qc', '00:05', '00:08', ['func'], 0.5, 100.0),
+    ]
+    with open(callback_log, 'w') as f:
+        for node, _, _, _, _, _ in runs:
+            f.write(json.dumps({'id': 'wf.' + node, 'hash': node}) + '\n')
+        for node, start, finish, upstream, memory, threads in runs:
+            f.write(json.dumps({
+                'id': 'wf.' + node, 'hash': node,
+                'start': '2020-01-01T00:{0}.000000'.format(start),
+                'finish': '2020-01-01T00:{0}.000000'.format(finish),
+                'runtime_memory_gb': memory, 'runtime_threads': threads,
+                'estimated_memory_gb': 2.0, 'num_threads': 2,
+                'output_dir': '/working/wf/' + node,
+                'upstream': ['/working/wf/' + up for up in upstream]
+            }) + '\n')
+
+
+def test_profile_callback_log(tmpdir):
+    callback_log = str(tmpdir.join('callback.log'))
+    _write_log(callback_log)
+    profile = profile_callback_log(callback_log)
+
+    assert profile['duration'] == 30.0
+    assert profile['critical_path'] == ['wf.anat', 'wf.reg']
+    assert sorted(profile['graph'].edges()) == [
+        ('wf.anat', 'wf.reg'), ('wf.func', 'wf.qc'), ('wf.func', 'wf.reg')]
+    assert profile['times']['wf.reg'] == {'self': 18.0, 'ready': 10.0,
+                                          'wait': 2.0}
+    assert profile['times']['wf.qc']['wait'] == 0.0
+
+    # time, running nodes, cores, memory, estimated memory
+    assert profile['utilization'] == [
+        (0.0, 2, 3.0, 3.0, 4.0), (5.0, 2, 2.0, 1.5, 4.0),
+        (8.0, 1, 1.0, 1.0, 2.0), (10.0, 0, 0.0, 0.0, 0.0),
+        (12.0, 1, 2.0, 3.0, 2.0), (30.0, 0, 0.0, 0.0, 0.0)]
+
+
+def test_profile_command(tmpdir):
+    from CPAC.__main__ import main
+
+    callback_log = str(tmpdir.join('callback.log'))
+    report = str(tmpdir.join('report.html'))
+    _write_log(callback_log)
+
+    result = CliRunner().invoke(main, ['utils', 'profile', callback_log,
+                                       '--output', report])
+    assert result.exit_code == 0, result.output
+    assert 'Critical path' in result.output
+    with open(report) as f:
+        html = f.read()
+    assert '<svg' in html and 'wf.reg' in html
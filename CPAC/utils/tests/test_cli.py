@@ -0,0 +1,39 @@
+import subprocess
+import sys
+
+from click.testing import CliRunner
+
+# modules the workflows need, which the CLI only imports in the commands
+# running workflows
+HEAVY_MODULES = ['nipype', 'nibabel', 'numpy', 'pandas', 'matplotlib',
+                 'networkx', 'pkg_resources']
+
+# cumulative import time of the CLI module, in microseconds
+STARTUP_BUDGET_US = 500000
+
+
+def test_cli_importtime():
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import CPAC.__main__'],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+
+    imported = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        imported[module.strip()] = int(cumulative)
+
+    assert not [module for module in imported
+                if module.split('.')[0] in HEAVY_MODULES or
+                module.startswith('CPAC.pipeline')]
+    assert imported['CPAC.__main__'] < STARTUP_BUDGET_US
+
+
+def test_cli_version():
+    from CPAC import __version__
+    from CPAC.__main__ import main
+
+    result = CliRunner().invoke(main, ['version'])
+    assert result.exit_code == 0
+    assert __version__ in result.output
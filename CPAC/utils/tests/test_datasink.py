@@ -0,0 +1,177 @@
+import gzip
+import os
+
+import nipype.pipeline.engine as pe
+from nipype.interfaces import afni, fsl
+
+from CPAC.utils.interfaces.datasink import DataSink
+from CPAC.utils.nifti_utils import intermediate_ext, save_nifti_image, \
+    set_intermediate_format
+
+
+def test_datasink_compress_nifti(tmpdir):
+
+    work_dir = tmpdir.mkdir('working')
+    src = work_dir.join('func_preproc.nii')
+    src.write_binary(b'not really a nifti' * 100)
+    other = work_dir.join('motion.1D')
+    other.write('0 0 0')
+
+    out_dir = str(tmpdir.join('output'))
+
+    ds = DataSink()
+    ds.inputs.base_directory = out_dir
+    ds.inputs.container = 'sub-1'
+    ds.inputs.compress_nifti = True
+    ds.inputs.compress_level = 1
+    ds.inputs.compress_threads = 2
+    setattr(ds.inputs, 'functional_preprocessed', str(src))
+    setattr(ds.inputs, 'movement_parameters', str(other))
+
+    with work_dir.as_cwd():
+        ds.run()
+
+    sunk = os.path.join(out_dir, 'sub-1', 'functional_preprocessed',
+                        'func_preproc.nii.gz')
+    assert os.path.exists(sunk)
+    assert not os.path.exists(sunk[:-3])
+    with gzip.open(sunk, 'rb') as f:
+        assert f.read() == src.read_binary()
+
+    # compressed again to the same bytes
+    with open(sunk, 'rb') as f:
+        compressed = f.read()
+    # no file name flag, no modification time in the header
+    assert compressed[3:8] == b'\0' * 5
+    os.utime(str(src), (0, 0))
+    with work_dir.as_cwd():
+        ds.run()
+    with open(sunk, 'rb') as f:
+        assert f.read() == compressed
+
+    assert os.path.exists(os.path.join(out_dir, 'sub-1',
+                                       'movement_parameters', 'motion.1D'))
+
+
+def test_save_nifti_image_deterministic(tmpdir):
+    import time
+
+    import nibabel as nib
+    import numpy as np
+
+    img = nib.Nifti1Image(np.arange(24, dtype=np.float32).reshape(2, 3, 4),
+                          np.eye(4))
+
+    first = save_nifti_image(img, str(tmpdir.join('first.nii.gz')))
+    time.sleep(1.1)
+    second = save_nifti_image(img, str(tmpdir.join('second.nii.gz')))
+
+    with open(first, 'rb') as f_first, open(second, 'rb') as f_second:
+        compressed = f_first.read()
+        assert compressed == f_second.read()
+    assert compressed[3:8] == b'\0' * 5
+    assert np.array_equal(nib.load(first).get_fdata(), img.get_fdata())
+
+
+def test_set_intermediate_format(monkeypatch):
+
+    wf = pe.Workflow(name='intermediate_format')
+
+    calc = pe.Node(afni.Calc(expr='a', outputtype='NIFTI_GZ'), name='calc')
+    maths = pe.Node(fsl.ImageMaths(output_type='NIFTI_GZ'), name='maths')
+    resample = pe.Node(afni.Resample(outputtype='AFNI'), name='resample')
+    wf.add_nodes([calc, maths, resample])
+
+    updated = set_intermediate_format(wf, 'NIFTI')
+
+    assert sorted(updated) == ['intermediate_format.calc',
+                               'intermediate_format.maths']
+    assert calc.inputs.outputtype == 'NIFTI'
+    assert maths.inputs.output_type == 'NIFTI'
+    assert resample.inputs.outputtype == 'AFNI'
+
+    monkeypatch.setenv('CPAC_INTERMEDIATE_FORMAT', 'NIFTI')
+    assert intermediate_ext() == '.nii'
+    monkeypatch.setenv('CPAC_INTERMEDIATE_FORMAT', 'NIFTI_GZ')
+    assert intermediate_ext() == '.nii.gz'
+
+
+def test_datasink_s3_upload(tmpdir, monkeypatch):
+
+    import json
+    import pytest
+
+    moto = pytest.importorskip('moto')
+    boto3 = pytest.importorskip('boto3')
+    mock_s3 = getattr(moto, 'mock_aws', None) or getattr(moto, 'mock_s3')
+
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+
+    work_dir = tmpdir.mkdir('working')
+    small = work_dir.join('motion.1D')
+    small.write('0 0 0')
+    large = work_dir.join('func_preproc.nii.gz')
+    large.write_binary(os.urandom(6 * 1024 * 1024))
+    uncompressed = work_dir.join('anat_preproc.nii')
+    uncompressed.write_binary(b'not really a nifti' * 100)
+    manifest_file = str(tmpdir.join('manifests', 'sinker.json'))
+
+    def sink():
+        ds = DataSink()
+        ds.inputs.base_directory = 's3://cpac-test/output'
+        ds.inputs.bucket = boto3.resource(
+            's3', region_name='us-east-1').Bucket('cpac-test')
+        ds.inputs.container = 'sub-1'
+        ds.inputs.upload_threads = 2
+        ds.inputs.multipart_threshold = 5
+        ds.inputs.upload_manifest = manifest_file
+        ds.inputs.compress_nifti = True
+        setattr(ds.inputs, 'functional_preprocessed', str(large))
+        setattr(ds.inputs, 'anatomical_brain', str(uncompressed))
+        setattr(ds.inputs, 'movement_parameters', str(small))
+        with work_dir.as_cwd():
+            ds.run()
+
+    with mock_s3():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket='cpac-test')
+
+        sink()
+
+        large_key = 'output/sub-1/functional_preprocessed/func_preproc.nii.gz'
+        small_key = 'output/sub-1/movement_parameters/motion.1D'
+        head = client.head_object(Bucket='cpac-test', Key=large_key)
+        assert head['ContentLength'] == 6 * 1024 * 1024
+        # uploaded in two parts
+        assert head['ETag'].strip('"').endswith('-2')
+        assert client.get_object(Bucket='cpac-test', Key=large_key)[
+            'Body'].read() == large.read_binary()
+        assert client.get_object(Bucket='cpac-test', Key=small_key)[
+            'Body'].read() == b'0 0 0'
+        assert gzip.decompress(client.get_object(
+            Bucket='cpac-test',
+            Key='output/sub-1/anatomical_brain/anat_preproc.nii.gz')[
+                'Body'].read()) == uncompressed.read_binary()
+
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+        record = manifest['s3://cpac-test/' + large_key]
+        assert record['size'] == 6 * 1024 * 1024
+        assert record['etag'] == head['ETag'].strip('"')
+
+        # unchanged files, compressed ones included, are not uploaded
+        # again, with or without manifest
+        from CPAC.utils.interfaces import datasink
+        uploaded = []
+        monkeypatch.setattr(datasink, 'ProgressPercentage',
+                            lambda src_f: uploaded.append(src_f))
+        sink()
+        assert uploaded == []
+        os.remove(manifest_file)
+        sink()
+        assert uploaded == []
+
+        small.write('1 1 1')
+        sink()
+        assert uploaded == [str(small)]
@@ -0,0 +1,137 @@
+import json
+import threading
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+
+from CPAC.utils.monitoring import LoggingHTTPServer
+
+
+def _write(callback_file, *nodes):
+    with open(str(callback_file), 'a') as f:
+        for node in nodes:
+            f.write(json.dumps(node) + '\n')
+
+
+def _get(port, path):
+    with urlopen('http://127.0.0.1:{0}{1}'.format(port, path)) as response:
+        body = response.read().decode('utf-8')
+        if response.headers['Content-Type'] == 'application/json':
+            return json.loads(body)
+        return body
+
+
+@pytest.fixture
+def server(tmpdir):
+    httpd = LoggingHTTPServer('analysis', str(tmpdir), '127.0.0.1', 0,
+                              refresh_interval=0)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_monitoring_server(tmpdir, server):
+    port = server.server_address[1]
+    callback_file = tmpdir.join('pipeline_analysis', 'sub-01_ses-1',
+                                'callback.log')
+    callback_file.ensure()
+    _write(callback_file,
+           {'id': 'wf.anat_preproc', 'hash': 'a'},
+           {'id': 'wf.func_preproc', 'hash': 'b'})
+    # a line being written is not read yet
+    with open(str(callback_file), 'a') as f:
+        f.write('{"id": "wf.anat_preproc", "hash": "a", "start": "2020-')
+
+    assert _get(port, '/api/run')['nodes_pending'] == 2
+
+    with open(str(callback_file), 'a') as f:
+        f.write('01-01T00:00:00", "finish": "2020-01-01T00:00:30", '
+                '"runtime_memory_gb": 1.5}\n')
+
+    assert _get(port, '/') == {'sub-01_ses-1': {
+        'wf.anat_preproc': {'hash': 'a', 'cached': {
+            'start': '2020-01-01T00:00:00',
+            'finish': '2020-01-01T00:00:30'}},
+        'wf.func_preproc': {'hash': 'b'}}}
+    assert _get(port, '/api/run') == {
+        'pipeline': 'analysis', 'participants': 1,
+        'participants_completed': 0, 'nodes': 2, 'nodes_finished': 1,
+        'nodes_errors': 0, 'nodes_pending': 1}
+    nodes = _get(port, '/api/participants/sub-01_ses-1')
+    assert nodes['wf.anat_preproc']['duration'] == 30.0
+    assert nodes['wf.anat_preproc']['memory_gb'] == 1.5
+
+    _write(callback_file, {'id': 'wf.func_preproc', 'hash': 'b',
+                           'start': '2020-01-01T00:00:30',
+                           'finish': '2020-01-01T00:10:30',
+                           'runtime_memory_gb': 3.0})
+    assert _get(port, '/api/participants')['sub-01_ses-1'] == {
+        'nodes': 2, 'finished': 2, 'errors': 0, 'pending': 0,
+        'peak_memory_gb': 3.0, 'last_finish': '2020-01-01T00:10:30'}
+
+    metrics = _get(port, '/metrics').splitlines()
+    assert 'cpac_node_queue_depth 0.0' in metrics
+    assert 'cpac_node_duration_seconds_bucket{le="60.0"} 1' in metrics
+    assert 'cpac_node_duration_seconds_count 2' in metrics
+    assert 'cpac_node_peak_memory_gb{participant="sub-01_ses-1"} 3.0' in \
+        metrics
+
+    with pytest.raises(HTTPError):
+        _get(port, '/api/participants/sub-02')
+
+
+def test_monitoring_failed_node(tmpdir, server):
+    port = server.server_address[1]
+    callback_file = tmpdir.join('pipeline_analysis', 'sub-01_ses-1',
+                                'callback.log')
+    callback_file.ensure()
+    _write(callback_file,
+           {'id': 'wf.anat_preproc', 'hash': 'a',
+            'start': '2020-01-01T00:00:00', 'finish': '2020-01-01T00:00:30'},
+           {'id': 'wf.func_preproc', 'hash': 'b', 'start': None,
+            'finish': None, 'error': True})
+
+    assert _get(port, '/api/run') == {
+        'pipeline': 'analysis', 'participants': 1,
+        'participants_completed': 1, 'nodes': 2, 'nodes_finished': 1,
+        'nodes_errors': 1, 'nodes_pending': 0}
+    assert 'cpac_nodes{participant="sub-01_ses-1",state="errors"} 1.0' in \
+        _get(port, '/metrics').splitlines()
+
+
+def test_log_nodes_cb_exception(tmpdir):
+    import logging
+    import nipype.pipeline.engine as pe
+    from CPAC.utils.interfaces.function import Function
+    from CPAC.utils.monitoring import log_nodes_cb
+
+    def fail(in_value):
+        raise ValueError(in_value)
+
+    node = pe.Node(Function(input_names=['in_value'], output_names=['out'],
+                            function=fail), name='fail',
+                   base_dir=str(tmpdir))
+    node.inputs.in_value = 1
+
+    records = []
+    handler = logging.Handler()
+    handler.emit = lambda record: records.append(
+        json.loads(record.getMessage()))
+    logger = logging.getLogger('callback')
+    logger.addHandler(handler)
+    level = logger.level
+    logger.setLevel(logging.DEBUG)
+    try:
+        log_nodes_cb(node, 'start')
+        log_nodes_cb(node, 'exception')
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(level)
+
+    assert len(records) == 1
+    assert records[0]['id'] == 'fail'
+    assert records[0]['error'] is True
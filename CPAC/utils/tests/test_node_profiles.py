@@ -0,0 +1,72 @@
+import json
+
+import nipype.interfaces.utility as util
+import nipype.pipeline.engine as pe
+
+from CPAC.utils.node_profiles import NodeProfileStore, node_profile_key
+
+
+def _workflow(subject_id):
+    workflow = pe.Workflow(name='resting_preproc_' + subject_id)
+    func_preproc = pe.Workflow(name='func_preproc_afni_0')
+    motion_correct = pe.Node(util.IdentityInterface(fields=['in_file']),
+                             name='func_motion_correct_A', mem_gb=3.0,
+                             n_procs=4)
+    skullstrip = pe.Node(util.IdentityInterface(fields=['in_file']),
+                         name='func_skullstrip', mem_gb=2.0)
+    func_preproc.connect(motion_correct, 'in_file', skullstrip, 'in_file')
+    segment = pe.Node(util.IdentityInterface(fields=['in_file']),
+                      name='segment', mem_gb=1.5)
+    workflow.add_nodes([func_preproc, segment])
+    return workflow
+
+
+def test_node_profile_key():
+    assert node_profile_key(
+        'resting_preproc_sub-01_ses-1.func_preproc_afni_1.'
+        'func_motion_correct_A') == 'func_preproc_afni.func_motion_correct_A'
+    assert node_profile_key('resting_preproc_sub-01_ses-1.segment') == \
+        'segment'
+
+
+def test_node_profile_store(tmpdir):
+    callback_log = str(tmpdir.join('callback.log'))
+    with open(callback_log, 'w') as f:
+        f.write(json.dumps({'id': 'resting_preproc_sub-01_ses-1.'
+                                  'func_preproc_afni_0', 'hash': 'x'}) + '\n')
+        offset = f.tell()
+        for node_id, memory_gb, threads in [
+                ('func_preproc_afni_0.func_motion_correct_A', 0.5, 150.0),
+                ('func_preproc_afni_1.func_motion_correct_A', 0.8, 90.0),
+                ('func_preproc_afni_0.func_skullstrip', 0.2, 'N/A')]:
+            f.write(json.dumps({
+                'id': 'resting_preproc_sub-01_ses-1.' + node_id,
+                'start': '2020-01-01T00:00:00',
+                'finish': '2020-01-01T00:01:00',
+                'runtime_memory_gb': memory_gb,
+                'runtime_threads': threads}) + '\n')
+
+    store = NodeProfileStore(str(tmpdir.join('profiles', 'nodes.json')))
+    assert store.update(callback_log, input_gb=0.4, offset=offset) == 3
+
+    profiles = NodeProfileStore(store.path).profiles
+    assert profiles['func_preproc_afni.func_motion_correct_A'] == {
+        'runs': 2, 'memory_gb': 0.8, 'memory_per_input_gb': 2.0,
+        'threads': 1.5}
+    assert 'threads' not in profiles['func_preproc_afni.func_skullstrip']
+
+    workflow = _workflow('sub-02_ses-1')
+    assert store.apply(workflow, input_gb=0.5, margin=1.5,
+                       max_memory_gb=8) == 2
+
+    motion_correct = workflow.get_node('func_preproc_afni_0') \
+        .get_node('func_motion_correct_A')
+    # scaled to the participant's input
+    assert motion_correct.mem_gb == 1.5
+    assert motion_correct.n_procs == 3
+    skullstrip = workflow.get_node('func_preproc_afni_0') \
+        .get_node('func_skullstrip')
+    assert round(skullstrip.mem_gb, 2) == 0.38
+    assert skullstrip.n_procs == 1
+    # never run: left as built
+    assert workflow.get_node('segment').mem_gb == 1.5
@@ -0,0 +1,164 @@
+import os
+
+import pytest
+
+from CPAC.utils.s3_cache import S3InputCache, participant_s3_paths
+
+moto = pytest.importorskip('moto')
+boto3 = pytest.importorskip('boto3')
+
+mock_s3 = getattr(moto, 'mock_aws', None) or getattr(moto, 'mock_s3')
+
+
+def _bucket(creds_path, bucket_name):
+    return boto3.resource('s3', region_name='us-east-1').Bucket(bucket_name)
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with mock_s3():
+        s3 = boto3.resource('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='cpac-test')
+        for i in range(4):
+            s3.Object('cpac-test', 'sub-{0}/anat.nii.gz'.format(i)).put(
+                Body=os.urandom(1024))
+        yield s3.Bucket('cpac-test')
+
+
+def test_participant_s3_paths():
+    sub_dict = {
+        'subject_id': '0',
+        'anat': 's3://cpac-test/sub-0/anat.nii.gz',
+        'func': {'rest': {'scan': 's3://cpac-test/sub-0/func.nii.gz',
+                          'scan_parameters': '/local/params.json'}},
+        'fmap': ['s3://cpac-test/sub-0/fmap.nii.gz',
+                 's3://cpac-test/sub-0/anat.nii.gz'],
+    }
+    assert participant_s3_paths(sub_dict) == [
+        's3://cpac-test/sub-0/anat.nii.gz',
+        's3://cpac-test/sub-0/func.nii.gz',
+        's3://cpac-test/sub-0/fmap.nii.gz',
+    ]
+
+
+def test_fetch_and_reuse(bucket, tmpdir):
+    cache = S3InputCache(str(tmpdir), bucket_getter=_bucket)
+
+    local_path = cache.fetch('s3://cpac-test/sub-0/anat.nii.gz')
+    assert os.path.basename(local_path) == 'anat.nii.gz'
+    with open(local_path, 'rb') as f:
+        assert f.read() == \
+            bucket.Object('sub-0/anat.nii.gz').get()['Body'].read()
+
+    # a second cache on the same directory reuses the download
+    other = S3InputCache(str(tmpdir), bucket_getter=_bucket)
+    mtime = os.stat(local_path).st_mtime
+    assert other.fetch('s3://cpac-test/sub-0/anat.nii.gz') == local_path
+    assert os.stat(local_path).st_mtime >= mtime
+
+    # a changed object gets a new entry
+    bucket.Object('sub-0/anat.nii.gz').put(Body=b'updated')
+    assert cache.fetch('s3://cpac-test/sub-0/anat.nii.gz') != local_path
+
+
+def test_fetch_missing(bucket, tmpdir):
+    cache = S3InputCache(str(tmpdir), bucket_getter=_bucket)
+    with pytest.raises(Exception, match='does not exist'):
+        cache.fetch('s3://cpac-test/sub-9/anat.nii.gz')
+
+
+def test_prefetch(bucket, tmpdir):
+    cache = S3InputCache(str(tmpdir), n_threads=4, bucket_getter=_bucket)
+    sublist = [{'anat': 's3://cpac-test/sub-{0}/anat.nii.gz'.format(i),
+                'func': {'rest': '/local/func.nii.gz'}} for i in range(4)]
+
+    futures = cache.prefetch_participants(sublist)
+    assert sorted(futures) == sorted(sub['anat'] for sub in sublist)
+    for future in futures.values():
+        assert os.path.isfile(future.result())
+
+    # in-flight and finished downloads are not requested again
+    again = cache.prefetch([sublist[0]['anat']])
+    assert again[sublist[0]['anat']] is futures[sublist[0]['anat']]
+
+    # evicted files are downloaded again
+    os.remove(futures[sublist[0]['anat']].result())
+    again = cache.prefetch([sublist[0]['anat']])
+    assert again[sublist[0]['anat']] is not futures[sublist[0]['anat']]
+    assert os.path.isfile(again[sublist[0]['anat']].result())
+
+    # failed downloads are retried
+    missing = 's3://cpac-test/sub-9/anat.nii.gz'
+    failed = cache.prefetch([missing])[missing]
+    assert failed.exception() is not None
+    bucket.Object('sub-9/anat.nii.gz').put(Body=os.urandom(1024))
+    assert os.path.isfile(cache.prefetch([missing])[missing].result())
+    cache.shutdown()
+
+
+def test_prefetch_after_release(bucket, tmpdir):
+    cache = S3InputCache(str(tmpdir), max_size_gb=1500 / 1024 ** 3,
+                         bucket_getter=_bucket)
+    sub_dict = {'subject_id': '0', 'anat': 's3://cpac-test/sub-0/anat.nii.gz'}
+    first = cache.prefetch_participants([sub_dict])[sub_dict['anat']]
+    os.utime(first.result(), (0, 0))
+
+    cache.release_participant(sub_dict)
+    cache.fetch('s3://cpac-test/sub-1/anat.nii.gz')
+    assert not os.path.exists(first.result())
+    assert sub_dict['anat'] not in cache._in_flight
+
+    again = cache.prefetch_participants([sub_dict])[sub_dict['anat']]
+    assert again.result() == first.result()
+    assert os.path.isfile(again.result())
+    cache.shutdown()
+
+
+def test_evict(bucket, tmpdir):
+    cache = S3InputCache(str(tmpdir), max_size_gb=2500 / 1024 ** 3,
+                         bucket_getter=_bucket)
+
+    first = cache.fetch('s3://cpac-test/sub-0/anat.nii.gz')
+    second = cache.fetch('s3://cpac-test/sub-1/anat.nii.gz')
+    os.utime(first, (0, 0))
+    cache.release()
+
+    third = cache.fetch('s3://cpac-test/sub-2/anat.nii.gz')
+    assert not os.path.exists(first)
+    assert os.path.exists(second)
+    assert os.path.exists(third)
+    assert cache.size() <= cache.max_size
+
+
+def test_pins(bucket, tmpdir):
+    max_size_gb = 1500 / 1024 ** 3
+    runner = S3InputCache(str(tmpdir), max_size_gb, n_threads=2,
+                          bucket_getter=_bucket)
+    sublist = [{'subject_id': str(i),
+                'anat': 's3://cpac-test/sub-{0}/anat.nii.gz'.format(i)}
+               for i in range(2)]
+    futures = runner.prefetch_participants(sublist)
+    first, second = [futures[sub['anat']].result() for sub in sublist]
+    runner.shutdown()
+
+    # pinned by the runner's participants, for the other caches too
+    node = S3InputCache(str(tmpdir), max_size_gb, bucket_getter=_bucket)
+    third = node.fetch('s3://cpac-test/sub-2/anat.nii.gz')
+    assert all(os.path.exists(path) for path in [first, second, third])
+
+    # a copy linked out of the cache survives its eviction
+    linked = node.link(third, str(tmpdir.join('node', 'anat.nii.gz')))
+    node.release()
+    runner.release_participant(sublist[0])
+    assert not os.path.exists(first)
+    assert not os.path.exists(third)
+    assert os.path.exists(second)
+    assert os.path.getsize(linked) == 1024
+
+    # pins of processes no longer running are ignored
+    dead = tmpdir.join('pins', '999999999-0123456789abcdef', 'pin')
+    dead.write(first, ensure=True)
+    assert node.pinned() == {second}
+    assert not dead.dirpath().exists()
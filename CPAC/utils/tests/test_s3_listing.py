@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from CPAC.utils.s3_listing import cached_list_s3_objects, list_s3_objects
+
+moto = pytest.importorskip('moto')
+boto3 = pytest.importorskip('boto3')
+
+mock_s3 = getattr(moto, 'mock_aws', None) or getattr(moto, 'mock_s3')
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with mock_s3():
+        s3 = boto3.resource('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='cpac-test')
+        keys = ['data/participants.tsv', 'other/sub-99/anat.nii.gz']
+        for sub in range(20):
+            keys += ['data/sub-{0:02d}/anat/T1w.nii.gz'.format(sub),
+                     'data/sub-{0:02d}/func/bold.nii.gz'.format(sub)]
+        for key in keys:
+            s3.Object('cpac-test', key).put(Body=key.encode())
+        yield s3.Bucket('cpac-test')
+
+
+def test_list_s3_objects(bucket):
+    objects = list_s3_objects(bucket, 'data/', n_threads=4)
+
+    sequential = sorted(
+        obj.key for obj in bucket.objects.filter(Prefix='data/'))
+    assert [obj['Key'] for obj in objects] == sequential
+    assert len(objects) == 41
+
+    tsv = objects[0]
+    assert tsv['Key'] == 'data/participants.tsv'
+    assert tsv['Size'] == len('data/participants.tsv')
+    assert tsv['ETag'] == bucket.Object('data/participants.tsv').e_tag.strip(
+        '"')
+
+
+def test_cached_list_s3_objects(bucket, tmpdir):
+    cache_dir = str(tmpdir.join('listings'))
+
+    objects = cached_list_s3_objects(bucket, 'data/', cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+
+    # within the TTL, the cached listing is reused
+    bucket.Object('data/sub-20/anat/T1w.nii.gz').put(Body=b'new')
+    assert cached_list_s3_objects(bucket, 'data/', cache_dir) == objects
+
+    # past it, the prefix is listed again
+    relisted = cached_list_s3_objects(bucket, 'data/', cache_dir, ttl=0)
+    assert len(relisted) == len(objects) + 1
+
+    # other prefixes get their own listing
+    assert len(cached_list_s3_objects(bucket, 'other/', cache_dir)) == 1
+    assert len(os.listdir(cache_dir)) == 2
@@ -0,0 +1,56 @@
+import pickle
+
+from CPAC.utils.strategy import ResourcePool, Strategy
+
+
+def test_resource_pool_fork():
+    pool = ResourcePool({'anatomical': ('anat_gather_0', 'outputspec.anat')})
+    pool['anatomical_brain'] = ('anat_preproc_afni_0', 'outputspec.brain')
+
+    fork = pool.fork()
+    fork['anatomical_brain'] = ('anat_preproc_bet_0', 'outputspec.brain')
+    fork['functional'] = ('func_gather_0', 'outputspec.rest')
+    del fork['anatomical']
+    pool['anatomical_wm_mask'] = ('seg_preproc_0', 'outputspec.wm_mask')
+
+    assert dict(pool) == {
+        'anatomical': ('anat_gather_0', 'outputspec.anat'),
+        'anatomical_brain': ('anat_preproc_afni_0', 'outputspec.brain'),
+        'anatomical_wm_mask': ('seg_preproc_0', 'outputspec.wm_mask')
+    }
+    assert list(fork) == ['anatomical_brain', 'functional']
+    assert 'anatomical' not in fork and 'functional' not in pool
+
+    # the forks share the entries set before forking
+    assert fork._parent is pool._parent
+    assert pickle.loads(pickle.dumps(fork)) == fork
+
+
+def test_resource_pool_depth():
+    pool = ResourcePool()
+    for i in range(3 * ResourcePool.max_depth):
+        pool['resource_{0}'.format(i)] = i
+        pool = pool.fork()
+
+    assert pool._depth <= ResourcePool.max_depth
+    assert len(pool) == 3 * ResourcePool.max_depth
+    assert pool['resource_0'] == 0
+
+
+def test_forking_points():
+    strat = Strategy()
+    strat.append_name('anat_preproc_afni_0')
+    strat.update_resource_pool({'anatomical_brain': ('afni', 'brain')})
+
+    fork = strat.fork()
+    fork.append_name('nuisance_0')
+    fork.update_resource_pool({'functional_nuisance_residuals':
+                               ('nuisance', 'residuals')})
+    strat.append_name('frequency_filter_0')
+
+    assert 'functional_nuisance_residuals' not in strat
+    assert fork['anatomical_brain'] == ('afni', 'brain')
+    assert Strategy.get_forking_points([strat, fork]) == [
+        ['frequency_filter'], ['nuisance']]
+    assert list(Strategy.get_forking_labels([strat, fork]).values()) == [
+        'freq-filter', 'nuisance']
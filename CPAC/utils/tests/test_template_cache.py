@@ -0,0 +1,60 @@
+import os
+import threading
+
+from CPAC.utils.template_cache import ImageCache, file_sha1, grid_signature
+
+
+def test_image_cache(tmpdir):
+    template = tmpdir.join('template.nii.gz')
+    template.write('template')
+    cache = ImageCache(str(tmpdir.join('cache')))
+    calls = []
+
+    def compute(tmp_dir):
+        calls.append(tmp_dir)
+        out_file = os.path.join(tmp_dir, 'template_resample.nii.gz')
+        with open(out_file, 'w') as f:
+            f.write('resampled')
+        return out_file
+
+    key = ['3dresample', file_sha1(str(template)), (3.0, 3.0, 3.0), 'Cu']
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        cache.get(key, compute))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # computed once, by the first writer to get the lock
+    assert len(calls) == 1
+    assert len(set(results)) == 1
+    assert os.path.basename(results[0]) == 'template_resample.nii.gz'
+    with open(results[0]) as f:
+        assert f.read() == 'resampled'
+    assert not os.path.exists(calls[0])
+
+    # a different resolution is a different entry
+    other = cache.get(key[:2] + [(2.0, 2.0, 2.0), 'Cu'], compute)
+    assert len(calls) == 2 and other != results[0]
+
+    # the key follows the content of the template, not its path
+    template.write('edited template')
+    os.utime(str(template), (0, 0))
+    assert file_sha1(str(template)) != key[1]
+
+
+def test_grid_signature():
+    import nibabel as nb
+    import numpy as np
+
+    affine = np.diag([3.0, 3.0, 3.0, 1.0])
+    func = nb.Nifti1Image(np.zeros((4, 5, 6, 10), dtype=np.float32), affine)
+    same_grid = nb.Nifti1Image(np.zeros((4, 5, 6, 2), dtype=np.float32),
+                               affine + 1e-7)
+    other_grid = nb.Nifti1Image(np.zeros((4, 5, 6, 10), dtype=np.float32),
+                                np.diag([2.0, 2.0, 2.0, 1.0]))
+
+    # the number of volumes doesn't change the grid
+    assert grid_signature(func) == grid_signature(same_grid)
+    assert grid_signature(func) != grid_signature(other_grid)
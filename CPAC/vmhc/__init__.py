@@ -1,9 +1,11 @@
 from .vmhc import create_vmhc
 
 from .utils import get_img_nvols, \
-                  get_operand_expression
+                  get_operand_expression, \
+                  compute_vmhc
 
 
 __all__ = ['create_vmhc', \
            'get_img_nvols', \
-           'get_operand_expression']
+           'get_operand_expression', \
+           'compute_vmhc']
@@ -26,3 +26,39 @@ def test_vmhc_ants():
             output_name='vmhc_{0}'.format(num_strat))
 
     workflow.run()
+
+
+def test_compute_vmhc(tmpdir):
+
+    import numpy as np
+    import nibabel as nb
+    from CPAC.vmhc import compute_vmhc
+
+    np.random.seed(0)
+    data = np.random.randn(7, 4, 3, 50).astype(np.float32)
+    # left-right symmetric column: perfectly homotopic
+    data[5] = data[1]
+    # flat time series: no correlation
+    data[0, 0, 0] = 1.0
+
+    in_file = str(tmpdir.join('func_symm.nii.gz'))
+    nb.Nifti1Image(data, np.eye(4)).to_filename(in_file)
+
+    with tmpdir.as_cwd():
+        vmhc_raw, vmhc_fisher_z, vmhc_z_stat = compute_vmhc(in_file)
+
+    r = nb.load(vmhc_raw).get_fdata()
+    assert r.shape == (7, 4, 3)
+
+    expected = np.corrcoef(data[2, 1, 2], data[4, 1, 2])[0, 1]
+    np.testing.assert_allclose(r[2, 1, 2], expected, rtol=1e-4)
+    np.testing.assert_allclose(r[2], r[4], rtol=1e-5)
+    np.testing.assert_allclose(r[1], 1.0, rtol=1e-5)
+    assert r[0, 0, 0] == 0
+
+    z = nb.load(vmhc_fisher_z).get_fdata()
+    assert np.all(np.isfinite(z))
+    np.testing.assert_allclose(z[2, 1, 2], np.arctanh(expected), rtol=1e-3)
+
+    z_stat = nb.load(vmhc_z_stat).get_fdata()
+    np.testing.assert_allclose(z_stat, z * np.sqrt(50 - 3), rtol=1e-5)
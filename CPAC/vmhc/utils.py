@@ -53,3 +53,88 @@ def get_operand_expression(nvols):
 
     return expr
 
+
+
+def compute_vmhc(in_file):
+
+    """
+    Computes Voxel-Mirrored Homotopic Connectivity in a single pass over a
+    functional image that is already in symmetric template space
+
+    The image is loaded once and mirrored along the left-right axis with a
+    negative-stride view, so no flipped copy is ever written or read back.
+    The homotopic Pearson correlation is computed as a batched dot product
+    of the z-scored time series, followed by the Fisher r-to-z transform
+    and the z-statistic scaling of `get_operand_expression`.
+
+    Parameters
+    ----------
+
+    in_file : string (nifti file)
+        4D functional image in symmetric template space
+
+    Returns
+    -------
+
+    vmhc_raw : string (nifti file)
+        voxelwise Pearson correlation between each voxel and its mirror
+
+    vmhc_fisher_z : string (nifti file)
+        Fisher Z transform map
+
+    vmhc_z_stat : string (nifti file)
+        Z statistic map
+
+    """
+
+    import os
+    import numpy as np
+    import nibabel as nb
+    from CPAC.utils.nifti_utils import intermediate_ext
+
+    img = nb.load(in_file)
+    data = np.asarray(img.dataobj, dtype=np.float32)
+
+    if data.ndim != 4 or data.shape[3] < 4:
+        raise ValueError('VMHC requires a 4D functional image with at least '
+                         '4 volumes, got shape {0} for {1}'.format(
+                             data.shape, in_file))
+
+    nvols = data.shape[3]
+
+    # z-score each time series in place, flat voxels become all-zero
+    data -= data.mean(axis=3, keepdims=True)
+    std = data.std(axis=3, keepdims=True)
+    std[std == 0] = 1.0
+    data /= std
+    del std
+
+    # fslswapdim -x y z, without the copy
+    flipped = data[::-1, ...]
+
+    r = np.einsum('...t,...t->...', data, flipped) / nvols
+    np.clip(r, -1.0, 1.0, out=r)
+
+    # keep the midline (r == 1) finite after the r-to-z transform
+    eps = np.finfo(np.float32).eps
+    fisher_z = np.arctanh(np.clip(r, -1.0 + eps, 1.0 - eps))
+
+    # same scaling as get_operand_expression: a*sqrt(nvols-3)
+    z_stat = fisher_z * np.sqrt(nvols - 3)
+
+    header = img.header.copy()
+    header.set_data_dtype(np.float32)
+
+    out_files = []
+    for name, out_data in [('vmhc_raw_score', r),
+                           ('vmhc_fisher_zstd', fisher_z),
+                           ('vmhc_fisher_zstd_zstat_map', z_stat)]:
+        out_img = nb.Nifti1Image(out_data.astype(np.float32),
+                                 affine=img.affine, header=header)
+        out_file = os.path.join(os.getcwd(), name + intermediate_ext())
+        out_img.to_filename(out_file)
+        out_files.append(out_file)
+
+    vmhc_raw, vmhc_fisher_z, vmhc_z_stat = out_files
+
+    return vmhc_raw, vmhc_fisher_z, vmhc_z_stat
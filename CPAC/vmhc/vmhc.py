@@ -10,6 +10,7 @@ from nipype.interfaces.afni import preprocess
 from CPAC.registration import create_wf_calculate_ants_warp, \
                               output_func_to_standard
 from CPAC.image_utils import spatial_smooth
+from CPAC.utils.interfaces import function
 
 def create_vmhc(workflow, num_strat, strat, pipeline_config_object,
         func_key='functional_nuisance_residuals', output_name='vmhc'):
@@ -179,6 +180,10 @@ def create_vmhc(workflow, num_strat, strat, pipeline_config_object,
         rest_res_2symmstandard.nii.gz
         tmp_LRflipped.nii.gz
 
+    - If ``vmhc_in_process`` is enabled in the pipeline configuration, the L/R
+    swap and the correlation are replaced by a single `compute_vmhc` node,
+    which also writes the Fisher Z and Z statistic maps.
+
     Workflow:
 
     .. image:: ../images/vmhc_graph.dot.png
@@ -237,6 +242,30 @@ def create_vmhc(workflow, num_strat, strat, pipeline_config_object,
         output_func_to_standard(workflow, smooth_key, 'template_skull_for_func_preproc',
             func_symm_mni_key, strat, num_strat, pipeline_config_object, input_image_type='func_4d')
 
+    func_node, func_file = strat[func_symm_mni_key]
+
+    if getattr(pipeline_config_object, 'vmhc_in_process', False):
+        # flip, correlate and r-to-z in one node, reading the image once
+        vmhc = pe.Node(function.Function(input_names=['in_file'],
+                                         output_names=['vmhc_raw',
+                                                       'vmhc_fisher_z',
+                                                       'vmhc_z_stat'],
+                                         function=compute_vmhc,
+                                         as_module=True),
+                       name='vmhc_in_process_{0}'.format(num_strat))
+
+        workflow.connect(func_node, func_file, vmhc, 'in_file')
+
+        strat.update_resource_pool({
+            'vmhc_raw_score': (vmhc, 'vmhc_raw'),
+            'vmhc_fisher_zstd': (vmhc, 'vmhc_fisher_z'),
+            'vmhc_fisher_zstd_zstat_map': (vmhc, 'vmhc_z_stat')
+        })
+
+        strat.append_name(vmhc.name)
+
+        return workflow, strat
+
     # write out a swapped version of the file
     # copy and L/R swap file
     copy_and_L_R_swap = pe.Node(interface=fsl.SwapDimensions(),
@@ -244,7 +273,6 @@ def create_vmhc(workflow, num_strat, strat, pipeline_config_object,
 
     copy_and_L_R_swap.inputs.new_dims = ('-x', 'y', 'z')
 
-    func_node, func_file = strat[func_symm_mni_key]
     workflow.connect(func_node, func_file,
                      copy_and_L_R_swap, 'in_file')
 
@@ -259,6 +259,32 @@ def bids_parse_sidecar(config_dict, dbg=False, raise_error=True):
     return(bids_config_dict)
 
 
+class BIDSSidecarResolver(object):
+    """
+    Resolves the scan parameters of BIDS files from their JSON sidecars.
+
+    The sidecars are merged along the inheritance hierarchy once, and the
+    parameters resolved for a combination of filename entities are cached,
+    so every further scan sharing them is resolved with a dictionary lookup.
+    """
+
+    levels = ['scantype', 'site', 'sub', 'ses', 'task', 'acq', 'rec', 'dir',
+              'run']
+
+    def __init__(self, config_dict, dbg=False, raise_error=True):
+        self.bids_config_dict = bids_parse_sidecar(
+            config_dict, dbg=dbg, raise_error=raise_error
+        ) if config_dict else {}
+        self._params = {}
+
+    def __call__(self, f_dict):
+        key = tuple(f_dict.get(level, 'none') for level in self.levels)
+        if key not in self._params:
+            self._params[key] = bids_retrieve_params(self.bids_config_dict,
+                                                     f_dict)
+        return self._params[key]
+
+
 def gen_bids_outputs_sublist(base_path, paths_list, key_list, creds_path):
     import copy
 
@@ -375,7 +401,8 @@ def bids_gen_cpac_sublist(bids_dir, paths_list, config_dict, creds_path, dbg=Fal
     # otherwise parse the information in the sidecar json files into a dict
     # we can use to extract data for our nifti files
     if config_dict:
-        bids_config_dict = bids_parse_sidecar(config_dict, raise_error=raise_error)
+        resolve_params = BIDSSidecarResolver(config_dict,
+                                             raise_error=raise_error)
 
     subdict = {}
 
@@ -388,8 +415,7 @@ def bids_gen_cpac_sublist(bids_dir, paths_list, config_dict, creds_path, dbg=Fal
             f_dict = bids_decode_fname(p, raise_error=raise_error)
 
             if config_dict:
-                t_params = bids_retrieve_params(bids_config_dict,
-                                                f_dict)
+                t_params = resolve_params(f_dict)
                 if not t_params:
                     print(f_dict)
                     print("Did not receive any parameters for %s," % (p) +
@@ -504,10 +530,13 @@ def bids_gen_cpac_sublist(bids_dir, paths_list, config_dict, creds_path, dbg=Fal
     return sublist
 
 
-def collect_bids_files_configs(bids_dir, aws_input_creds=''):
+def collect_bids_files_configs(bids_dir, aws_input_creds='',
+                               index_path=None):
     """
     :param bids_dir:
     :param aws_input_creds:
+    :param index_path: SQLite index of a local bids_dir, created or
+        incrementally updated instead of walking the whole directory
     :return:
     """
 
@@ -533,21 +562,25 @@ def collect_bids_files_configs(bids_dir, aws_input_creds=''):
 
         print(f"gathering files from S3 bucket ({bucket}) for {prefix}")
 
+        from CPAC.utils.bids_utils import fetch_s3_sidecars
+
+        # list first, then download all the sidecars at once
+        sidecar_keys = []
         for s3_obj in bucket.objects.filter(Prefix=prefix):
-            for suf in suffixes:
-                if suf in str(s3_obj.key):
-                    if str(s3_obj.key).endswith("json"):
-                        try:
-                            config_dict[s3_obj.key.replace(prefix, "").lstrip('/')] \
-                                = json.loads(s3_obj.get()["Body"].read())
-                        except Exception as e:
-                            print("Error retrieving %s (%s)" %
-                                  (s3_obj.key.replace(prefix, ""),
-                                  e.message))
-                            raise
-                    elif 'nii' in str(s3_obj.key):
-                        file_paths.append(str(s3_obj.key)
-                                          .replace(prefix,'').lstrip('/'))
+            if not any(suf in str(s3_obj.key) for suf in suffixes):
+                continue
+            if str(s3_obj.key).endswith("json"):
+                sidecar_keys.append(str(s3_obj.key))
+            elif 'nii' in str(s3_obj.key):
+                file_paths.append(str(s3_obj.key)
+                                  .replace(prefix,'').lstrip('/'))
+
+        config_dict.update(fetch_s3_sidecars(bucket, sidecar_keys, prefix))
+
+    elif index_path:
+        from CPAC.utils.bids_index import BIDSIndex
+        with BIDSIndex(bids_dir, index_path) as index:
+            file_paths, config_dict = index.collect_files_configs(suffixes)
 
     else:
         for root, dirs, files in os.walk(bids_dir, topdown=False):
@@ -557,10 +590,12 @@ def collect_bids_files_configs(bids_dir, aws_input_creds=''):
                         if 'nii' in f and suf in f:
                             file_paths += [os.path.join(root, f).replace(bids_dir,'')
                                    .lstrip('/')]
-                        if f.endswith('json') and suf in f:
+                    # parse each sidecar once, whatever suffixes it matches
+                    if f.endswith('json') and any(suf in f for suf in suffixes):
+                        with open(os.path.join(root, f), 'r') as json_file:
                             config_dict.update(
                                 {os.path.join(root.replace(bids_dir, '').lstrip('/'), f):
-                                     json.load(open(os.path.join(root, f), 'r'))})
+                                     json.load(json_file)})
 
     if not file_paths and not config_dict:
         raise IOError("Didn't find any files in {0}. Please verify that the "
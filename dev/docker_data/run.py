@@ -222,6 +222,11 @@ parser.add_argument('-v', '--version', action='version',
                     version='C-PAC BIDS-App version {}'.format(__version__))
 parser.add_argument('--bids_validator_config', help='JSON file specifying configuration of '
                     'bids-validator: See https://github.com/bids-standard/bids-validator for more info.')
+parser.add_argument('--bids_index', help='SQLite file in which to keep an '
+                    'index of a local bids_dir, so that later runs only '
+                    'rescan the directories that changed.',
+                    default=None)
+
 parser.add_argument('--skip_bids_validator',
                     help='Skips bids validation.',
                     action='store_true')
@@ -483,7 +488,7 @@ elif args.analysis_level in ["test_config", "participant"]:
         print("Parsing {0}..".format(args.bids_dir))
 
         (file_paths, config) = collect_bids_files_configs(
-            args.bids_dir, args.aws_input_creds)
+            args.bids_dir, args.aws_input_creds, args.bids_index)
 
         if args.participant_label:
             file_paths = [